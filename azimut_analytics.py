@@ -0,0 +1,330 @@
+import argparse
+import itertools
+import json
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from pathlib import Path
+
+import azimut_schema as schema
+import azimut_storage as storage
+
+# =========================================================
+# ANALÍTICA AGREGADA (sin interfaz, todos los usuarios de DATA_DIR)
+# =========================================================
+# Uso:
+#   python azimut_analytics.py --data-dir data --output data/analytics_summary.json
+#   python azimut_analytics.py --backend sqlite --workers 8 --as-of 2026-01-31
+#
+# Cada proceso del pool recibe un lote de usuarios, recorre sus registros uno a
+# uno y devuelve un agregado parcial (contadores). El proceso principal solo
+# suma parciales: nunca hay un DataFrame con todos los registros ni datos de un
+# usuario concreto en el resumen. Las categorías con menos de --min-users
+# usuarios se agrupan para no identificar a nadie.
+ANALYTICS_BATCH_USERS = 500
+ANALYTICS_MIN_USERS = 5
+ANALYTICS_TOP_SESGOS = 10
+RETENTION_DAYS = (1, 7, 30)
+SESGO_BLOQUE = 6
+SESGO_PREFIX = "Sesgo — "
+INTEGRATION_BLOQUE = 9
+OTHER_SESGO = "Otros"
+_DAY = 86400
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+class Partial:
+    # Contadores sumables: la unión de dos parciales es su suma.
+    def __init__(self):
+        self.users = 0
+        self.entries = 0
+        self.unreadable = 0
+        self.bloque_entries: dict[int, int] = {}
+        self.bloque_users: dict[int, int] = {}
+        self.sesgo_entries: dict[str, int] = {}
+        self.sesgo_users: dict[str, int] = {}
+        self.eligible: dict[int, int] = {}
+        self.retained: dict[int, int] = {}
+        self.active_days: dict[int, int] = {}  # nº de días activos → usuarios
+        self.b9_users = 0
+        self.b9_other_bloques_users = 0  # usuarios con algún bloque 1–8
+        self.b9_fields: dict[int, int] = {}  # campos rellenados en la integración → usuarios
+
+    def add_user(self, records, as_of_day: int):
+        # Todo se cuenta en locales y se suma al final: si la lectura falla a
+        # mitad (fichero dañado), el usuario no queda contado a medias.
+        bloques: set[int] = set()
+        sesgos: set[str] = set()
+        days: set[int] = set()
+        bloque_entries: dict[int, int] = {}
+        sesgo_entries: dict[str, int] = {}
+        b9_fields = -1
+        n = 0
+        for ts, bloque, concepto, respuesta, meta in records:
+            n += 1
+            if ts is not None:
+                days.add(ts // _DAY)
+            if not isinstance(bloque, int):
+                continue
+            bloques.add(bloque)
+            bloque_entries[bloque] = bloque_entries.get(bloque, 0) + 1
+            if bloque == SESGO_BLOQUE and isinstance(concepto, str) and concepto.startswith(SESGO_PREFIX):
+                s = concepto[len(SESGO_PREFIX) :].strip()
+                if s:
+                    sesgos.add(s)
+                    sesgo_entries[s] = sesgo_entries.get(s, 0) + 1
+            elif bloque == INTEGRATION_BLOQUE:
+                filled = bool((respuesta or "").strip()) + sum(
+                    1 for k in schema.BLOQUE_META_KEYS[INTEGRATION_BLOQUE] if str(meta.get(k) or "").strip()
+                )
+                b9_fields = max(b9_fields, filled)
+        if n == 0:
+            return
+        self.users += 1
+        self.entries += n
+        for b, k in bloque_entries.items():
+            self.bloque_entries[b] = self.bloque_entries.get(b, 0) + k
+        for s, k in sesgo_entries.items():
+            self.sesgo_entries[s] = self.sesgo_entries.get(s, 0) + k
+        for b in bloques:
+            self.bloque_users[b] = self.bloque_users.get(b, 0) + 1
+        for s in sesgos:
+            self.sesgo_users[s] = self.sesgo_users.get(s, 0) + 1
+        if days:
+            first, last = min(days), max(days)
+            for d in RETENTION_DAYS:
+                # Solo cuentan quienes empezaron hace al menos `d` días.
+                if first + d <= as_of_day:
+                    self.eligible[d] = self.eligible.get(d, 0) + 1
+                    if last >= first + d:
+                        self.retained[d] = self.retained.get(d, 0) + 1
+            self.active_days[len(days)] = self.active_days.get(len(days), 0) + 1
+        if bloques - {INTEGRATION_BLOQUE}:
+            self.b9_other_bloques_users += 1
+        if b9_fields >= 0:
+            self.b9_users += 1
+            self.b9_fields[b9_fields] = self.b9_fields.get(b9_fields, 0) + 1
+
+    def merge(self, other: "Partial"):
+        for name, value in vars(other).items():
+            if isinstance(value, dict):
+                mine = getattr(self, name)
+                for k, v in value.items():
+                    mine[k] = mine.get(k, 0) + v
+            else:
+                setattr(self, name, getattr(self, name) + value)
+        return self
+
+
+# ---------- lectura (un usuario cada vez, registro a registro) ----------
+def _archived(user_dir: Path):
+    # Meses archivados del usuario (users/ab/<uid>/archive), si los hay.
+    return storage.ArchiveTier(user_dir).entries()
+
+
+def _entry_records(entries):
+    for e in entries:
+        if not isinstance(e, dict):
+            continue
+        meta = e.get("meta")
+        yield schema.entry_ts(e), e.get("bloque"), e.get("concepto"), e.get("respuesta"), meta if isinstance(meta, dict) else {}
+
+
+def _json_records(history_file: Path):
+    entries = storage.read_history(history_file)
+    if history_file.parent.name == history_file.stem[len("history_") :]:
+        # Estructura por usuario (la plana anterior no tiene archivo).
+        entries = itertools.chain(_archived(history_file.parent), entries)
+    return _entry_records(entries)
+
+
+def _json_batch(paths: list[str], as_of_day: int) -> Partial:
+    part = Partial()
+    for p in paths:
+        try:
+            part.add_user(_json_records(Path(p)), as_of_day)
+        except Exception:
+            part.unreadable += 1
+    return part
+
+
+def _sqlite_rows(con, uids: list[str]):
+    sql = (
+        "SELECT uid, timestamp, bloque, concepto, respuesta, meta FROM entries "
+        f"WHERE uid IN ({', '.join('?' * len(uids))}) ORDER BY uid"
+    )
+    for uid, ts, bloque, concepto, respuesta, meta in con.execute(sql, uids):
+        try:
+            meta = json.loads(meta) if meta else {}
+        except ValueError:
+            meta = {}
+        yield uid, (schema.ts_from_text(ts), bloque, concepto, respuesta, meta if isinstance(meta, dict) else {})
+
+
+def _sqlite_batch(db_path: str, uids: list[str], as_of_day: int) -> Partial:
+    part = Partial()
+    users_dir = Path(db_path).parent / storage.USERS_DIR
+
+    def add(uid, records):
+        try:
+            archive = _archived(users_dir / uid[: storage.USER_SHARD_CHARS] / uid)
+            records.extend(_entry_records(archive))
+            part.add_user(records, as_of_day)
+        except Exception:
+            part.unreadable += 1
+
+    con = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        current, records, seen = None, [], set()
+        for uid, rec in _sqlite_rows(con, uids):
+            if uid != current:
+                if records:
+                    add(current, records)
+                seen.add(current)
+                current, records = uid, []
+            records.append(rec)
+        if records:
+            add(current, records)
+        seen.add(current)
+    finally:
+        con.close()
+    for uid in uids:
+        if uid not in seen:
+            add(uid, [])  # todo archivado
+    return part
+
+
+# ---------- descubrimiento de usuarios ----------
+def json_history_files(data_dir: Path) -> list[str]:
+    # Estructura por prefijo (users/ab/<uid>/) y la plana anterior; sin migrar ni crear nada.
+    out = []
+    users_dir = data_dir / storage.USERS_DIR
+    if users_dir.is_dir():
+        for shard in os.scandir(users_dir):
+            if not shard.is_dir():
+                continue
+            for user in os.scandir(shard.path):
+                if user.is_dir() and not user.name.startswith("."):
+                    out.append(os.path.join(user.path, f"history_{user.name}.json"))
+    out.extend(str(p) for p in data_dir.glob("history_*.json"))
+    return sorted(out)
+
+
+def sqlite_uids(db_path: Path) -> list[str]:
+    con = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        uids = {r[0] for r in con.execute("SELECT DISTINCT uid FROM entries")}
+    finally:
+        con.close()
+    # Usuarios con todo archivado (sin filas en la base de datos).
+    users_dir = db_path.parent / storage.USERS_DIR
+    if users_dir.is_dir():
+        for shard in os.scandir(users_dir):
+            if shard.is_dir():
+                uids.update(
+                    user.name
+                    for user in os.scandir(shard.path)
+                    if os.path.exists(os.path.join(user.path, storage.ARCHIVE_DIR, storage.ARCHIVE_MANIFEST))
+                )
+    return sorted(uids)
+
+
+def _batches(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+# ---------- ejecución ----------
+def run(data_dir: Path, backend: str, workers: int | None, as_of: date, batch: int = ANALYTICS_BATCH_USERS) -> Partial:
+    as_of_day = as_of.toordinal() - _EPOCH_ORDINAL
+    total = Partial()
+    if backend == "sqlite":
+        db_path = data_dir / storage.SQLITE_FILE
+        jobs = [(_sqlite_batch, str(db_path), b, as_of_day) for b in _batches(sqlite_uids(db_path), batch)]
+    else:
+        jobs = [(_json_batch, b, as_of_day) for b in _batches(json_history_files(data_dir), batch)]
+    if workers == 1:
+        for fn, *args in jobs:
+            total.merge(fn(*args))
+        return total
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(fn, *args) for fn, *args in jobs]
+        for f in futures:
+            total.merge(f.result())
+    return total
+
+
+def _rate(num: int, den: int) -> float | None:
+    return round(num / den, 4) if den else None
+
+
+def summarize(part: Partial, as_of: date, min_users: int = ANALYTICS_MIN_USERS, top: int = ANALYTICS_TOP_SESGOS) -> dict:
+    sesgos = []
+    other = {"sesgo": OTHER_SESGO, "entries": 0, "users": 0}
+    for s, n in sorted(part.sesgo_entries.items(), key=lambda kv: (-kv[1], kv[0])):
+        users = part.sesgo_users.get(s, 0)
+        if users >= min_users and len(sesgos) < top:
+            sesgos.append({"sesgo": s, "entries": n, "users": users})
+        else:
+            # Usuarios de "Otros" es una cota superior (alguien puede tener varios).
+            other["entries"] += n
+            other["users"] += users
+    if other["entries"]:
+        sesgos.append(other)
+    return {
+        "generated_at": datetime.now().strftime(schema.TS_FORMAT),
+        "as_of": as_of.isoformat(),
+        "min_users": min_users,
+        "users": part.users,
+        "entries": part.entries,
+        "unreadable_files": part.unreadable,
+        "bloques": {
+            str(b): {"entries": part.bloque_entries[b], "users": part.bloque_users.get(b, 0)}
+            for b in sorted(part.bloque_entries)
+        },
+        "sesgos_bloque6": sesgos,
+        "retention": {
+            f"d{d}": {
+                "eligible": part.eligible.get(d, 0),
+                "retained": part.retained.get(d, 0),
+                "rate": _rate(part.retained.get(d, 0), part.eligible.get(d, 0)),
+            }
+            for d in RETENTION_DAYS
+        },
+        "active_days": {str(k): v for k, v in sorted(part.active_days.items()) if v >= min_users},
+        "bloque9": {
+            "completed_users": part.b9_users,
+            "completion_rate": _rate(part.b9_users, part.users),
+            "completion_rate_after_other_bloques": _rate(part.b9_users, part.b9_other_bloques_users),
+            "fields_filled": {str(k): v for k, v in sorted(part.b9_fields.items()) if v >= min_users},
+        },
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Resumen agregado y anónimo de todos los historiales de Azimut.")
+    ap.add_argument("--data-dir", default="data")
+    ap.add_argument("--backend", default=os.environ.get("AZIMUT_STORAGE", "json"), choices=("json", "sqlite"))
+    ap.add_argument("--workers", type=int, default=None, help="Procesos del pool (por defecto, uno por CPU; 1 = sin pool).")
+    ap.add_argument("--batch", type=int, default=ANALYTICS_BATCH_USERS, help="Usuarios por tarea.")
+    ap.add_argument("--as-of", type=date.fromisoformat, default=date.today(), help="Fecha de referencia (YYYY-MM-DD).")
+    ap.add_argument("--min-users", type=int, default=ANALYTICS_MIN_USERS)
+    ap.add_argument("--output", default=None, help="Por defecto, <data-dir>/analytics_summary.json")
+    args = ap.parse_args(argv)
+
+    data_dir = Path(args.data_dir)
+    t0 = time.perf_counter()
+    part = run(data_dir, args.backend, args.workers, args.as_of, args.batch)
+    summary = summarize(part, args.as_of, args.min_users)
+    summary["elapsed_s"] = round(time.perf_counter() - t0, 2)
+
+    output = Path(args.output) if args.output else data_dir / "analytics_summary.json"
+    storage.atomic_write_text(output, json.dumps(summary, ensure_ascii=False, separators=(",", ":")), durable=False)
+    print(f"{part.users} usuarios, {part.entries} registros en {summary['elapsed_s']} s → {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+import bisect
+import os
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+
+import azimut_schema as schema
+
+# =========================================================
+# HISTORIAL COLUMNAR (compacto, compartido entre sesiones)
+# =========================================================
+# Se comporta como una lista de registros (len, [i], iteración, append), pero
+# guarda columnas: timestamp como entero (segundos), bloque como int8, textos
+# repetidos y claves de meta internadas. Los registros que no encajan en el
+# esquema (claves extra, tipos raros) se guardan tal cual en `_raw`. Se
+# aceptan registros v1 y v2 (ver azimut_schema) y cada uno se devuelve en su forma.
+_ENTRY_KEYS = frozenset(("timestamp", "bloque", "fecha", "concepto", "respuesta", "meta"))
+_ENTRY_KEYS_V2 = frozenset(("v", "ts", "bloque", "fecha", "concepto", "respuesta", "meta"))
+
+
+class ColumnarHistory:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.ts = array("q")
+        self.version = array("b")
+        self.bloque = array("b")
+        self.fecha: list[str] = []
+        self.concepto: list = []
+        self.respuesta: list[str] = []
+        self.meta: list[tuple] = []  # ((id_clave, valor), ...)
+        self.meta_keys: list[str] = []
+        self._meta_key_ids: dict[str, int] = {}
+        self._pool: dict[str, str] = {}
+        self._raw: dict[int, dict] = {}
+        self._memo: dict = {}
+        self._attached: dict = {}
+        self.nbytes = 0
+
+    @classmethod
+    def from_entries(cls, entries) -> "ColumnarHistory":
+        h = cls()
+        for e in entries:
+            h.append(e)
+        return h
+
+    def _intern(self, s: str) -> str:
+        # Textos cortos muy repetidos (fechas, conceptos, valores de meta): una sola copia.
+        if len(s) > 80:
+            return s
+        return self._pool.setdefault(s, s)
+
+    def _ts_of(self, e) -> int | None:
+        # Segundos del registro si encaja en el esquema compacto (v1 o v2), si no None.
+        if not isinstance(e, dict):
+            return None
+        keys = set(e)
+        if keys == _ENTRY_KEYS:
+            return schema.ts_from_text(e.get("timestamp"))
+        if keys == _ENTRY_KEYS_V2 and schema.is_current(e):
+            return e["ts"]
+        return None
+
+    def _fits(self, e, ts: int | None) -> bool:
+        if ts is None:
+            return False
+        b = e.get("bloque")
+        if b is not None and not (isinstance(b, int) and not isinstance(b, bool) and 0 <= b < 128):
+            return False
+        for k in ("fecha", "respuesta"):
+            if not isinstance(e.get(k, ""), str):
+                return False
+        if not isinstance(e.get("concepto"), (str, type(None))):
+            return False
+        meta = e.get("meta", {})
+        return isinstance(meta, dict) and all(isinstance(k, str) and isinstance(v, str) for k, v in meta.items())
+
+    def append(self, e):
+        with self._lock:
+            i = len(self.ts)
+            ts = self._ts_of(e)
+            if self._fits(e, ts):
+                self.ts.append(ts)
+                self.version.append(schema.SCHEMA_VERSION if "v" in e else 1)
+                b = e.get("bloque")
+                self.bloque.append(schema.NO_BLOQUE if b is None else b)
+                self.fecha.append(self._intern(e.get("fecha", "")))
+                c = e.get("concepto")
+                self.concepto.append(None if c is None else self._intern(c))
+                self.respuesta.append(self._intern(e.get("respuesta", "")))
+                pairs = []
+                for k, v in e.get("meta", {}).items():
+                    kid = self._meta_key_ids.get(k)
+                    if kid is None:
+                        kid = self._meta_key_ids[k] = len(self.meta_keys)
+                        self.meta_keys.append(sys.intern(k))
+                    pairs.append((kid, self._intern(v)))
+                self.meta.append(tuple(pairs))
+                self.nbytes += 48 + len(e.get("respuesta", "")) + sum(len(v) for _, v in pairs) // 2
+            else:
+                self.ts.append(schema.NO_TS)
+                self.version.append(0)
+                self.bloque.append(schema.NO_BLOQUE)
+                self.fecha.append("")
+                self.concepto.append(None)
+                self.respuesta.append("")
+                self.meta.append(())
+                self._raw[i] = e
+                self.nbytes += 64 + len(repr(e))
+            self._memo.clear()
+
+    def __len__(self):
+        return len(self.ts)
+
+    def __bool__(self):
+        return len(self.ts) > 0
+
+    def _entry(self, i: int):
+        raw = self._raw.get(i)
+        if raw is not None:
+            return raw
+        b = self.bloque[i]
+        keys = self.meta_keys
+        if self.version[i] == schema.SCHEMA_VERSION:
+            head = {"v": schema.SCHEMA_VERSION, "ts": self.ts[i]}
+        else:
+            head = {"timestamp": schema.ts_to_text(self.ts[i])}
+        head.update(
+            {
+                "bloque": None if b == schema.NO_BLOQUE else b,
+                "fecha": self.fecha[i],
+                "concepto": self.concepto[i],
+                "respuesta": self.respuesta[i],
+                "meta": {keys[k]: v for k, v in self.meta[i]},
+            }
+        )
+        return head
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._entry(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._entry(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._entry(i)
+
+    def raw_rows(self) -> dict[int, dict]:
+        return self._raw
+
+    def memo(self, name: str, build):
+        # Derivados compartidos (p. ej. el DataFrame), válidos mientras no cambie la longitud.
+        with self._lock:
+            key = (name, len(self))
+            hit = self._memo.get(key)
+            if hit is None:
+                hit = self._memo[key] = build()
+            return hit
+
+    def attached(self, name: str, build):
+        # Estructuras que se mantienen incrementalmente junto al historial (índice de
+        # búsqueda, resumen): sobreviven a los append y las comparten todas las sesiones.
+        with self._lock:
+            obj = self._attached.get(name)
+            if obj is None:
+                obj = self._attached[name] = build()
+            return obj
+
+    def detach(self, name: str):
+        # Se reconstruirá en el próximo `attached` (p. ej. tras una importación masiva).
+        with self._lock:
+            self._attached.pop(name, None)
+
+
+# =========================================================
+# VISTAS: archivo frío + historial caliente
+# =========================================================
+class ConcatHistory:
+    # Varias ColumnarHistory seguidas (meses archivados + caliente), de solo
+    # lectura. Expone `ts`, `bloque` y `fecha` concatenados, así que el índice de consultas
+    # se construye por columnas igual que sobre una sola.
+    def __init__(self, parts):
+        self.parts = list(parts)
+        self.offsets = []
+        self._lens = [len(p) for p in self.parts]  # la última parte (caliente) puede crecer después
+        self.ts = array("q")
+        self.bloque = array("b")
+        self.fecha: list[str] = []
+        self._raw: dict[int, dict] = {}
+        n = 0
+        for p, size in zip(self.parts, self._lens):
+            self.offsets.append(n)
+            self.ts.extend(p.ts[:size])
+            self.bloque.extend(p.bloque[:size])
+            self.fecha.extend(p.fecha[:size])
+            self._raw.update({n + i: e for i, e in p.raw_rows().items() if i < size})
+            n += size
+        self._n = n
+        self._lock = threading.RLock()
+        self._attached: dict = {}
+
+    def __len__(self):
+        return self._n
+
+    def __bool__(self):
+        return self._n > 0
+
+    def _entry(self, i: int):
+        k = bisect.bisect_right(self.offsets, i) - 1
+        return self.parts[k][i - self.offsets[k]]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._entry(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._entry(i)
+
+    def __iter__(self):
+        for p, size in zip(self.parts, self._lens):
+            for i in range(size):
+                yield p[i]
+
+    def raw_rows(self) -> dict[int, dict]:
+        return self._raw
+
+    def attached(self, name: str, build):
+        with self._lock:
+            obj = self._attached.get(name)
+            if obj is None:
+                obj = self._attached[name] = build()
+            return obj
+
+
+class TieredHistory:
+    # Todo el historial (archivo completo + caliente) para reconstruir resúmenes:
+    # la longitud sale del manifiesto y los segmentos solo se leen al iterar.
+    def __init__(self, archive, hot):
+        self.archive = archive
+        self.hot = hot
+        self._n = archive.count() + len(hot)
+
+    def __len__(self):
+        return self._n
+
+    def __iter__(self):
+        yield from self.archive.entries()
+        yield from self.hot
+
+
+# =========================================================
+# CACHÉ LRU POR PROCESO (uid → ColumnarHistory)
+# =========================================================
+HISTORY_CACHE_MAX_BYTES = int(float(os.environ.get("AZIMUT_HISTORY_CACHE_MB", "256")) * 1024 * 1024)
+
+
+class HistoryCache:
+    def __init__(self, max_bytes: int = HISTORY_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._items: OrderedDict[str, ColumnarHistory] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, uid: str, loader) -> ColumnarHistory:
+        with self._lock:
+            h = self._items.get(uid)
+            if h is not None:
+                self._items.move_to_end(uid)
+                # `append` en sitio hace crecer `nbytes` sin pasar por aquí: el
+                # límite se vuelve a comprobar en cada acceso.
+                self._evict()
+                return h
+        h = ColumnarHistory.from_entries(loader())
+        with self._lock:
+            # Otra sesión pudo cargarlo a la vez: nos quedamos con el primero.
+            existing = self._items.get(uid)
+            if existing is not None:
+                self._items.move_to_end(uid)
+                return existing
+            self._items[uid] = h
+            self._evict()
+        return h
+
+    def invalidate(self, uid: str):
+        with self._lock:
+            self._items.pop(uid, None)
+
+    def _evict(self):
+        # Nunca se expulsa la entrada recién usada (la última).
+        while len(self._items) > 1 and self.total_bytes() > self.max_bytes:
+            self._items.popitem(last=False)
+
+    def total_bytes(self) -> int:
+        return sum(h.nbytes for h in self._items.values())
+
+    def __len__(self):
+        return len(self._items)
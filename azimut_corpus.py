@@ -0,0 +1,302 @@
+import hashlib
+import json
+import mmap
+import re
+import sys
+import threading
+from array import array
+from pathlib import Path
+
+import azimut_search as search
+import azimut_storage as storage
+
+# =========================================================
+# CORPUS EN DISCO (mmap, decodificado bajo demanda)
+# =========================================================
+class CorpusFile:
+    # El fichero se mapea la primera vez que se necesita; corpus[a:b] decodifica
+    # solo ese rango de bytes.
+    def __init__(self, path):
+        self.path = Path(path)
+        self._fh = None
+        self._buf = None
+
+    def buffer(self):
+        if self._buf is None:
+            try:
+                size = self.path.stat().st_size
+            except OSError:
+                size = 0
+            if size == 0:
+                self._buf = b""
+            else:
+                self._fh = self.path.open("rb")
+                self._buf = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._buf
+
+    def __len__(self):
+        return len(self.buffer())
+
+    def __getitem__(self, key) -> str:
+        if not isinstance(key, slice):
+            raise TypeError("CorpusFile solo admite slices")
+        return bytes(self.buffer()[key]).decode("utf-8", errors="ignore")
+
+    def text(self) -> str:
+        return self[:]
+
+    def signature(self) -> dict:
+        try:
+            st_ = self.path.stat()
+        except OSError:
+            return {"size": 0, "mtime_ns": 0}
+        return {"size": st_.st_size, "mtime_ns": st_.st_mtime_ns}
+
+    def sha256(self) -> str:
+        h = hashlib.sha256()
+        buf = self.buffer()
+        for i in range(0, len(buf), 1 << 20):
+            h.update(buf[i : i + (1 << 20)])
+        return h.hexdigest()
+
+
+# =========================================================
+# SECCIONES POR BLOQUE (offsets de bytes de cada capítulo)
+# =========================================================
+# Un capítulo empieza en una línea "BLOQUE <n>..." (con o sin # / * delante) y
+# acaba en la siguiente. Si un número aparece varias veces (índice al principio,
+# referencias) se queda el tramo más largo. Cada capítulo se divide en páginas
+# de unos READING_PAGE_BYTES, siempre en límites de párrafo.
+READING_PAGE_BYTES = 4000
+_HEADING_RE = re.compile(rb"(?im)^[ \t#*]*bloque[ \t]+(\d{1,2})\b[^\n]*")
+
+
+def index_sections(buf, page_bytes: int = READING_PAGE_BYTES) -> list[dict]:
+    heads = [(m.start(), m.end(), int(m.group(1)), m.group()) for m in _HEADING_RE.finditer(buf)]
+    best: dict[int, dict] = {}
+    for i, (start, head_end, n, line) in enumerate(heads):
+        end = heads[i + 1][0] if i + 1 < len(heads) else len(buf)
+        if n in best and best[n]["end"] - best[n]["start"] >= end - start:
+            continue
+        best[n] = {
+            "bloque": n,
+            "title": line.decode("utf-8", errors="ignore").strip(" \t\r#*"),
+            "start": start,
+            "end": end,
+            "body": head_end,
+        }
+    out = []
+    for n in sorted(best):
+        sec = best[n]
+        pages: list[list[int]] = []
+        cur = None
+        for p_start, p_end in search.iter_paragraphs(buf, sec.pop("body"), sec["end"]):
+            if cur is not None and p_end - cur[0] > page_bytes:
+                pages.append(cur)
+                cur = None
+            cur = [p_start, p_end] if cur is None else [cur[0], p_end]
+        if cur is not None:
+            pages.append(cur)
+        sec["pages"] = pages
+        out.append(sec)
+    return out
+
+
+# =========================================================
+# ARTEFACTOS PRECALCULADOS (caché en disco)
+# =========================================================
+# corpus_meta.json → firma de cada fuente + vocabulario de emociones (con frecuencias) + offsets de pasajes
+#                     + secciones por bloque (se añaden la primera vez que se piden)
+# corpus_bm25.bin  → índice BM25 (solo se lee cuando hace falta buscar): una línea
+#                     JSON de cabecera y, detrás, las listas de postings como un
+#                     único array de enteros. Solo datos (no pickle): cargarlo no
+#                     ejecuta nada aunque alguien haya cambiado el fichero.
+#
+# Validación: si tamaño y mtime coinciden no se lee el corpus. Si cambian, se
+# compara el sha256 (un `touch` o una copia no obligan a reconstruir).
+CORPUS_CACHE_VERSION = 2
+CORPUS_META_FILE = "corpus_meta.json"
+CORPUS_BM25_FILE = "corpus_bm25.bin"
+# Versiones anteriores lo guardaban con pickle: se borra sin leerlo.
+LEGACY_BM25_FILES = ("corpus_bm25.pkl",)
+
+
+class Corpus:
+    def __init__(self, sources: dict, cache_dir, emotions_fn, emotions_source: str):
+        # sources: nombre → ruta. emotions_fn(text) → lista de emociones.
+        self.files = {name: CorpusFile(path) for name, path in sources.items()}
+        self.cache_dir = Path(cache_dir)
+        self._emotions_fn = emotions_fn
+        self._emotions_source = emotions_source
+        self._meta = None
+        self._index = None
+        # Un Corpus lo comparten todas las sesiones: el primer relleno de cada
+        # caché (meta, secciones, BM25) lo hace una sola.
+        self._lock = threading.RLock()
+
+    # ---------- meta (pequeño) ----------
+    def _read_meta(self):
+        try:
+            return json.loads((self.cache_dir / CORPUS_META_FILE).read_text(encoding="utf-8"))
+        except Exception:
+            return None
+
+    def _write_meta(self, meta: dict):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        storage.atomic_write_text(self.cache_dir / CORPUS_META_FILE, json.dumps(meta, ensure_ascii=False), durable=False)
+
+    def _source_is_current(self, name: str, stored: dict | None, sig: dict) -> bool:
+        if not stored:
+            return False
+        if stored.get("size") == sig["size"] and stored.get("mtime_ns") == sig["mtime_ns"]:
+            return True
+        return stored.get("size") == sig["size"] and stored.get("sha256") == self.files[name].sha256()
+
+    def meta(self) -> dict:
+        if self._meta is not None:
+            return self._meta
+        with self._lock:
+            if self._meta is None:
+                self._meta = self._load_meta()
+            return self._meta
+
+    def _load_meta(self) -> dict:
+        meta = self._read_meta()
+        sigs = {name: f.signature() for name, f in self.files.items()}
+        valid = (
+            isinstance(meta, dict)
+            and meta.get("version") == CORPUS_CACHE_VERSION
+            and set(meta.get("sources", {})) == set(self.files)
+            and all(self._source_is_current(n, meta["sources"].get(n), sigs[n]) for n in self.files)
+        )
+        if valid:
+            if any(meta["sources"][n].get("mtime_ns") != sigs[n]["mtime_ns"] for n in self.files):
+                for n in self.files:
+                    meta["sources"][n]["mtime_ns"] = sigs[n]["mtime_ns"]
+                self._write_meta(meta)
+        else:
+            meta = self._build_meta(sigs)
+            self._write_meta(meta)
+            (self.cache_dir / CORPUS_BM25_FILE).unlink(missing_ok=True)
+        return meta
+
+    def _build_meta(self, sigs: dict) -> dict:
+        sources = {}
+        passages = {}
+        for name, f in self.files.items():
+            sources[name] = dict(sigs[name], sha256=f.sha256())
+            passages[name] = search.split_passages(f.buffer())
+        emotions_file = self.files.get(self._emotions_source)
+        emotions_text = emotions_file.text() if emotions_file is not None else ""
+        emotions = self._emotions_fn(emotions_text) if emotions_text else []
+        return {
+            "version": CORPUS_CACHE_VERSION,
+            "sources": sources,
+            "passages": passages,
+            "emotions": emotions,
+            "emotion_freq": search.term_frequencies(emotions_text, emotions),
+        }
+
+    @property
+    def emotions(self) -> list[str]:
+        return list(self.meta().get("emotions", []))
+
+    @property
+    def emotion_freq(self) -> dict[str, int]:
+        return dict(self.meta().get("emotion_freq", {}))
+
+    def passages(self, name: str) -> list[tuple[int, int]]:
+        return [tuple(p) for p in self.meta().get("passages", {}).get(name, [])]
+
+    # ---------- capítulos por bloque ----------
+    def sections(self, name: str) -> list[dict]:
+        # Se calculan una vez y se guardan en corpus_meta.json junto al resto.
+        meta = self.meta()
+        sections = meta.get("sections") or {}
+        if name in sections:
+            return sections[name]
+        with self._lock:
+            sections = meta.setdefault("sections", {})
+            if name not in sections:
+                f = self.files.get(name)
+                sections[name] = index_sections(f.buffer()) if f is not None else []
+                self._write_meta(meta)
+            return sections[name]
+
+    def section(self, name: str, bloque: int) -> dict | None:
+        for sec in self.sections(name):
+            if sec["bloque"] == bloque:
+                return sec
+        return None
+
+    def section_page(self, name: str, bloque: int, page: int) -> str:
+        # Solo se decodifican los bytes de esa página.
+        sec = self.section(name, bloque)
+        if sec is None or not 0 <= page < len(sec["pages"]):
+            return ""
+        start, end = sec["pages"][page]
+        return self.files[name][start:end]
+
+    # ---------- índice BM25 (grande, perezoso) ----------
+    def index(self) -> search.CorpusIndex:
+        if self._index is not None:
+            return self._index
+        with self._lock:
+            if self._index is None:
+                self._index = self._load_index()
+            return self._index
+
+    def _load_index(self) -> search.CorpusIndex:
+        meta = self.meta()
+        stamp = {n: meta["sources"][n].get("sha256") for n in self.files}
+        path = self.cache_dir / CORPUS_BM25_FILE
+        idx = None
+        for legacy in LEGACY_BM25_FILES:
+            (self.cache_dir / legacy).unlink(missing_ok=True)
+        try:
+            idx = _read_index(path, stamp)
+        except Exception:
+            idx = None
+
+        if idx is None:
+            idx = search.CorpusIndex()
+            for name, f in self.files.items():
+                idx.add_document(name, f, self.passages(name))
+            idx.finalize()
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            _write_index(path, stamp, idx)
+
+        for name, f in self.files.items():
+            idx.attach(name, f)
+        return idx
+
+
+def _write_index(path: Path, stamp: dict, idx: search.CorpusIndex):
+    head, flat = idx.dump()
+    head.update(version=CORPUS_CACHE_VERSION, stamp=stamp, byteorder=sys.byteorder, itemsize=flat.itemsize)
+    line = json.dumps(head, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+    def write(fh):
+        fh.write(line)
+        flat.tofile(fh)
+
+    storage.atomic_write(path, write, durable=False)
+
+
+def _read_index(path: Path, stamp: dict) -> search.CorpusIndex | None:
+    # None si es de otra versión o de otro corpus; ValueError si está truncado.
+    data = path.read_bytes()
+    cut = data.index(b"\n")
+    head = json.loads(data[:cut])
+    if head.get("version") != CORPUS_CACHE_VERSION or head.get("stamp") != stamp:
+        return None
+    flat = array("I")
+    if head.get("itemsize") != flat.itemsize:
+        return None
+    body = memoryview(data)[cut + 1 :]
+    if len(body) % flat.itemsize:
+        raise ValueError("índice BM25 truncado")
+    flat.frombytes(body)
+    if head.get("byteorder") != sys.byteorder:
+        flat.byteswap()
+    return search.CorpusIndex.from_dump(head, flat)
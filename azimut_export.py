@@ -0,0 +1,130 @@
+import json
+import tempfile
+
+# =========================
+# Parquet opcional (NO rompe si falta)
+# =========================
+PARQUET_AVAILABLE = False
+try:
+    import pyarrow as pa  # type: ignore
+    import pyarrow.parquet as pq  # type: ignore
+
+    PARQUET_AVAILABLE = True
+except Exception:
+    PARQUET_AVAILABLE = False
+
+# =========================================================
+# EXPORTACIÓN (por bloques, a un fichero temporal)
+# =========================================================
+# Los registros llegan en DataFrames de EXPORT_CHUNK_ROWS filas (`chunks_fn()`
+# devuelve un iterador nuevo en cada llamada) y cada bloque se serializa en
+# cuanto llega a un fichero temporal: nunca están a la vez el DataFrame
+# completo y el fichero entero. Streamlit sirve la descarga desde memoria,
+# así que export_bytes sí devuelve los bytes finales (una sola copia).
+EXPORT_COLS = ["timestamp", "bloque", "fecha", "concepto", "respuesta", "meta"]
+
+# Formato → (extensión, MIME)
+EXPORT_FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "JSONL": ("jsonl", "application/jsonl"),
+}
+if PARQUET_AVAILABLE:
+    EXPORT_FORMATS["Parquet"] = ("parquet", "application/vnd.apache.parquet")
+
+# Filas por bloque (DataFrame, row group de Parquet): acota la memoria intermedia.
+EXPORT_CHUNK_ROWS = 5000
+
+
+def _plain(v):
+    # Escalares numpy → tipos Python (json.dumps no los acepta).
+    if hasattr(v, "item"):
+        try:
+            return v.item()
+        except Exception:
+            pass
+    return str(v)
+
+
+def _is_null(v) -> bool:
+    return v is None or (isinstance(v, float) and v != v)
+
+
+def _text(v):
+    return None if _is_null(v) else str(v)
+
+
+def frame_chunks(df, rows: int = EXPORT_CHUNK_ROWS):
+    # Un DataFrame ya en memoria, por tramos (benchmarks, llamadas sueltas).
+    return lambda: (df.iloc[i : i + rows] for i in range(0, len(df), rows))
+
+
+def write_csv(fh, chunks_fn):
+    header = True
+    for df in chunks_fn():
+        df[EXPORT_COLS].to_csv(fh, index=False, header=header, encoding="utf-8")
+        header = False
+    if header:
+        fh.write((",".join(EXPORT_COLS) + "\n").encode("utf-8"))
+
+
+def write_jsonl(fh, chunks_fn):
+    for df in chunks_fn():
+        lines = []
+        for row in df[EXPORT_COLS].itertuples(index=False, name=None):
+            rec = {k: (None if _is_null(v) else v) for k, v in zip(EXPORT_COLS, row)}
+            if not isinstance(rec["meta"], dict):
+                rec["meta"] = {}
+            lines.append(json.dumps(rec, ensure_ascii=False, default=_plain))
+        if lines:
+            fh.write(("\n".join(lines) + "\n").encode("utf-8"))
+
+
+def _meta_keys(metas, keys: dict):
+    for m in metas:
+        if isinstance(m, dict):
+            for k in m:
+                keys.setdefault(k, None)
+
+
+def write_parquet(fh, chunks_fn):
+    # `meta` se aplana en columnas meta_<clave>. El esquema se fija antes de
+    # escribir: una primera pasada (solo la columna meta) reúne las claves.
+    if not PARQUET_AVAILABLE:
+        raise RuntimeError("Parquet requiere pyarrow")
+    keys: dict = {}
+    for df in chunks_fn():
+        _meta_keys(df["meta"], keys)
+    meta_keys = list(keys)
+    fields = [
+        pa.field("timestamp", pa.string()),
+        pa.field("bloque", pa.int64()),
+        pa.field("fecha", pa.string()),
+        pa.field("concepto", pa.string()),
+        pa.field("respuesta", pa.string()),
+    ] + [pa.field(f"meta_{k}", pa.string()) for k in meta_keys]
+    schema = pa.schema(fields)
+
+    with pq.ParquetWriter(fh, schema) as writer:
+        for chunk in chunks_fn():
+            cols = {
+                "timestamp": [_text(v) for v in chunk["timestamp"]],
+                "bloque": [None if _is_null(v) else int(v) for v in chunk["bloque"]],
+                "fecha": [_text(v) for v in chunk["fecha"]],
+                "concepto": [_text(v) for v in chunk["concepto"]],
+                "respuesta": [_text(v) for v in chunk["respuesta"]],
+            }
+            metas = [m if isinstance(m, dict) else {} for m in chunk["meta"]]
+            for k in meta_keys:
+                cols[f"meta_{k}"] = [_text(m.get(k)) for m in metas]
+            writer.write_table(pa.Table.from_pydict(cols, schema=schema))
+
+
+def write_export(fh, chunks_fn, fmt: str):
+    {"JSONL": write_jsonl, "Parquet": write_parquet}.get(fmt, write_csv)(fh, chunks_fn)
+
+
+def export_bytes(chunks_fn, fmt: str) -> bytes:
+    with tempfile.TemporaryFile() as fh:
+        write_export(fh, chunks_fn, fmt)
+        fh.seek(0)
+        return fh.read()
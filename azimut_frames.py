@@ -0,0 +1,79 @@
+import pandas as pd
+
+import azimut_schema as schema
+
+# =========================================================
+# DATAFRAMES DEL HISTORIAL (sin dependencias de Streamlit)
+# =========================================================
+HISTORY_COLS = ["timestamp", "bloque", "fecha", "concepto", "respuesta", "meta"]
+
+
+def entries_df(hist: list):
+    if not hist:
+        return pd.DataFrame(columns=HISTORY_COLS)
+    if hasattr(hist, "meta_keys"):
+        return _columnar_df(hist)
+    df = pd.DataFrame(hist)
+    for col in HISTORY_COLS:
+        if col not in df.columns:
+            df[col] = None
+    return schema.upgrade_frame(df)
+
+
+def _columnar_df(h):
+    # Desde ColumnarHistory: columnas vectorizadas, sin crear un dict por registro.
+    ts = pd.Series(pd.to_datetime(pd.array(h.ts, dtype="int64"), unit="s")).dt.strftime(schema.TS_FORMAT)
+    bloque = pd.Series(h.bloque, dtype="int64")
+    if (bloque < 0).any():
+        bloque = bloque.astype("float64").mask(bloque < 0)
+    keys = h.meta_keys
+    df = pd.DataFrame(
+        {
+            "v": h.version,
+            "timestamp": ts,
+            "bloque": bloque,
+            "fecha": h.fecha,
+            "concepto": h.concepto,
+            "respuesta": h.respuesta,
+            "meta": [{keys[k]: v for k, v in pairs} for pairs in h.meta],
+        }
+    )
+    raw = h.raw_rows()
+    if raw:
+        # Registros fuera del esquema compacto (raros): se normalizan uno a uno.
+        for i, e in raw.items():
+            e = e if isinstance(e, dict) else {}
+            for col in HISTORY_COLS:
+                df.at[i, col] = e.get(col)
+            df.at[i, "timestamp"] = schema.entry_timestamp(e)
+            df.at[i, "fecha"] = schema.fecha_to_iso(e.get("fecha"))
+            df.at[i, "v"] = schema.SCHEMA_VERSION
+    return schema.upgrade_frame(df)
+
+
+def add_date_columns(df):
+    df["ts_dt"] = pd.to_datetime(df["timestamp"], format=schema.TS_FORMAT, errors="coerce")
+    df["ts_date"] = df["ts_dt"].dt.date
+    return df
+
+
+# ---------- series para gráficos ----------
+# Un rango largo de días se agrega por semanas o meses para que la serie enviada
+# al navegador no pase de CHART_MAX_POINTS puntos.
+CHART_MAX_POINTS = 180
+CHART_FREQ_LABELS = {"D": "día", "W": "semana", "M": "mes"}
+
+
+def resample_counts(daily: pd.DataFrame, max_points: int = CHART_MAX_POINTS) -> tuple[pd.DataFrame, str]:
+    # `daily`: columnas ts_date (date) y registros. Devuelve (serie, "D" | "W" | "M").
+    if daily.empty:
+        return daily, "D"
+    dates = pd.to_datetime(daily["ts_date"])
+    span = (dates.max() - dates.min()).days + 1
+    if span <= max_points:
+        return daily, "D"
+    freq = "W" if span / 7 <= max_points else "M"
+    # Semanas de lunes a domingo (igual que las de emociones); meses naturales.
+    bucket = dates.dt.to_period("W-SUN" if freq == "W" else "M").dt.start_time.dt.date
+    out = daily.groupby(bucket.values, sort=True)["registros"].sum()
+    return out.rename_axis("ts_date").reset_index(name="registros"), freq
@@ -0,0 +1,292 @@
+import ast
+import codecs
+import hashlib
+import io
+import json
+import re
+
+import pandas as pd
+
+import azimut_schema as schema
+
+# =========================
+# Parquet opcional (NO rompe si falta)
+# =========================
+PARQUET_AVAILABLE = False
+try:
+    import pyarrow.parquet as pq  # type: ignore
+
+    PARQUET_AVAILABLE = True
+except Exception:
+    PARQUET_AVAILABLE = False
+
+# =========================================================
+# IMPORTACIÓN (CSV / JSONL / Parquet exportados por la app)
+# =========================================================
+# Se lee por bloques de IMPORT_CHUNK_ROWS filas: fechas y bloques se parsean
+# por columnas y cada fila se convierte en un registro v2. Los duplicados (mismo
+# contenido que un registro existente o que otra fila del fichero) se descartan
+# por hash. La escritura la hace el store en un solo lote.
+#
+# Un fichero dañado no rompe la página: una fila ilegible (bytes que no son
+# UTF-8, una línea JSON cortada) se descarta y se cuenta; si el fichero deja de
+# poderse leer a mitad (CSV mal formado, JSON que no es una lista) se anota en
+# `failed` y se para. ".json" es una lista de registros (p. ej. history_{uid}.json):
+# se lee entera, no por bloques.
+IMPORT_CHUNK_ROWS = 5000
+IMPORT_FORMATS = {"csv": "CSV", "jsonl": "JSONL", "json": "JSON"}
+if PARQUET_AVAILABLE:
+    IMPORT_FORMATS["parquet"] = "Parquet"
+
+
+class ImportReport:
+    def __init__(self):
+        self.read = 0
+        self.imported = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.errors: list[str] = []  # primeras filas descartadas, para mostrar
+        self.failed: str | None = None  # el fichero dejó de poderse leer
+
+    def reject(self, row: int, reason: str):
+        self.rejected += 1
+        if len(self.errors) < 5:
+            self.errors.append(f"fila {row}: {reason}")
+
+
+def entry_hash(e) -> bytes:
+    # Hash del contenido (no de la forma): un v1 y su v2 equivalente coinciden.
+    if not schema.is_current(e):
+        e = schema.upgrade_entry(e)
+        if not isinstance(e, dict):
+            return hashlib.blake2b(repr(e).encode("utf-8"), digest_size=16).digest()
+    meta = e.get("meta") if isinstance(e.get("meta"), dict) else {}
+    key = (
+        schema.entry_ts(e),
+        e.get("bloque"),
+        e.get("fecha") or "",
+        e.get("concepto") or "",
+        e.get("respuesta") or "",
+        tuple(sorted((str(k), str(v)) for k, v in meta.items() if v not in (None, ""))),
+    )
+    return hashlib.blake2b(repr(key).encode("utf-8"), digest_size=16).digest()
+
+
+def detect_format(filename: str) -> str | None:
+    return IMPORT_FORMATS.get(filename.rsplit(".", 1)[-1].lower()) if "." in filename else None
+
+
+# ---------- lectura por bloques ----------
+# Cada lector genera (DataFrame, filas ya descartadas al leer). Los de JSON
+# llevan en `_row` el número de fila en el fichero.
+# Los bytes que no son UTF-8 se sustituyen por un no-carácter (U+10FFFE, nunca
+# en texto real) para descartar solo su fila; pandas no admite surrogates.
+_BAD_BYTES = "\U0010fffe"
+codecs.register_error("azimut_import", lambda exc: (_BAD_BYTES, exc.end))
+
+
+def _csv_chunks(fh, report: ImportReport):
+    # Todo como texto: el exportador escribe `meta` como repr de un dict.
+    text = io.TextIOWrapper(fh, encoding="utf-8", errors="azimut_import", newline="")
+    chunks = pd.read_csv(text, dtype=str, keep_default_na=False, chunksize=IMPORT_CHUNK_ROWS)
+    for df in chunks:
+        yield df, 0
+
+
+def _records_frame(records: list[dict], rows: list[int]) -> pd.DataFrame:
+    # `ts` de cada registro (v1 o v2) con la misma regla que el resto de la app.
+    df = pd.DataFrame.from_records(records)
+    df["ts"] = pd.array([schema.entry_ts(r) for r in records], dtype="Int64")
+    df["_row"] = rows
+    return df
+
+
+def _jsonl_chunks(fh, report: ImportReport):
+    records, rows, bad, row = [], [], 0, 0
+    for raw in fh:
+        if not raw.strip():
+            continue
+        row += 1
+        try:
+            rec = json.loads(raw.decode("utf-8"))
+        except (UnicodeDecodeError, ValueError):
+            rec = None
+        if not isinstance(rec, dict):
+            report.reject(row, "línea JSON ilegible")
+            bad += 1
+            continue
+        records.append(rec)
+        rows.append(row)
+        if len(records) >= IMPORT_CHUNK_ROWS:
+            yield _records_frame(records, rows), bad
+            records, rows, bad = [], [], 0
+    if records or bad:
+        yield _records_frame(records, rows), bad
+
+
+def _json_chunks(fh, report: ImportReport):
+    try:
+        data = json.loads(fh.read().decode("utf-8"))
+    except (UnicodeDecodeError, ValueError):
+        raise _Unreadable("el fichero no es JSON válido")
+    if isinstance(data, dict) and isinstance(data.get("entries"), list):
+        data = data["entries"]  # snapshot con diario absorbido (ver azimut_storage)
+    if not isinstance(data, list):
+        raise _Unreadable("el JSON no es una lista de registros")
+    for start in range(0, len(data), IMPORT_CHUNK_ROWS):
+        records, rows, bad = [], [], 0
+        for row, rec in enumerate(data[start : start + IMPORT_CHUNK_ROWS], start=start + 1):
+            if isinstance(rec, dict):
+                records.append(rec)
+                rows.append(row)
+            else:
+                report.reject(row, "el registro no es un objeto")
+                bad += 1
+        yield _records_frame(records, rows), bad
+
+
+class _Unreadable(Exception):
+    pass
+
+
+def _present(v) -> bool:
+    return not (v is None or v is pd.NA or (isinstance(v, float) and v != v))
+
+
+def _parquet_chunks(fh, report: ImportReport):
+    # Columnas meta_<clave> (ver export_parquet_bytes) → dict `meta`.
+    if not PARQUET_AVAILABLE:
+        raise _Unreadable("Parquet requiere pyarrow")
+    for batch in pq.ParquetFile(fh).iter_batches(batch_size=IMPORT_CHUNK_ROWS):
+        df = batch.to_pandas()
+        meta_cols = [c for c in df.columns if c.startswith("meta_")]
+        metas = [{} for _ in range(len(df))]
+        for c in meta_cols:
+            k = c[len("meta_") :]
+            for m, v in zip(metas, df[c].tolist()):
+                if _present(v):
+                    m[k] = v
+        df = df.drop(columns=meta_cols)
+        df["meta"] = metas
+        yield df, 0
+
+
+def _parse_meta(v):
+    if isinstance(v, dict):
+        return v
+    if v is None or (isinstance(v, float) and v != v) or v == "":
+        return {}
+    if isinstance(v, str):
+        try:
+            parsed = ast.literal_eval(v)
+        except (ValueError, SyntaxError):
+            try:
+                parsed = json.loads(v)
+            except ValueError:
+                raise schema.SchemaError("meta ilegible")
+        if isinstance(parsed, dict):
+            return parsed
+    raise schema.SchemaError("meta no es un diccionario")
+
+
+_META_PAIR_RE = re.compile(r"""('[^'\\]*'|"[^"\\]*"): ('[^'\\]*'|"[^"\\]*")""")
+
+
+def _fast_meta(text: str):
+    # repr de un dict de textos sin escapes: regex en vez de compilar con
+    # literal_eval. Solo se acepta si el repr del resultado es idéntico.
+    if "\\" in text or not text.startswith("{"):
+        return None
+    d = {k[1:-1]: v[1:-1] for k, v in _META_PAIR_RE.findall(text)}
+    return d if repr(d) == text else None
+
+
+def _parse_meta_column(values) -> list:
+    out = []
+    for v in values:
+        parsed = _fast_meta(v) if isinstance(v, str) else None
+        out.append(v if parsed is None else parsed)
+    return out
+
+
+def _chunk_entries(df: pd.DataFrame, first_row: int, report: ImportReport):
+    # Parseo por columnas (formatos explícitos) y validación por fila.
+    if "ts" in df.columns:
+        # JSON/JSONL: ya resuelto por registro con schema.entry_ts.
+        secs = df["ts"]
+    else:
+        if "timestamp" not in df.columns:
+            df["timestamp"] = None
+        ts = pd.to_datetime(df["timestamp"].astype("string"), format=schema.TS_FORMAT, errors="coerce")
+        secs = ((ts - pd.Timestamp(schema.EPOCH)) // pd.Timedelta(seconds=1)).astype("Int64")
+    for col in ("bloque", "fecha", "concepto", "respuesta", "meta"):
+        if col not in df.columns:
+            df[col] = None
+    bloque = pd.to_numeric(df["bloque"], errors="coerce").astype("Float64")
+    fecha = schema.fecha_series_to_iso(df["fecha"])
+    numbers = df["_row"] if "_row" in df.columns else range(first_row, first_row + len(df))
+    rows = zip(numbers, secs, bloque, fecha, df["concepto"], df["respuesta"], _parse_meta_column(df["meta"]))
+    for row, s, b, f, concepto, respuesta, meta in rows:
+        if s is pd.NA:
+            report.reject(row, "timestamp no válido")
+            continue
+        if b is pd.NA or b != int(b):
+            report.reject(row, "bloque no válido")
+            continue
+        if _undecodable(concepto) or _undecodable(respuesta) or _undecodable(meta):
+            report.reject(row, "texto que no es UTF-8")
+            continue
+        try:
+            meta = schema.validate_meta(int(b), _parse_meta(meta))
+        except schema.SchemaError as exc:
+            report.reject(row, str(exc))
+            continue
+        yield {
+            "v": schema.SCHEMA_VERSION,
+            "ts": int(s),
+            "bloque": int(b),
+            "fecha": f,
+            "concepto": None if concepto is None or concepto == "" else str(concepto),
+            "respuesta": "" if respuesta is None else str(respuesta),
+            "meta": meta,
+        }
+
+
+def _undecodable(v) -> bool:
+    return isinstance(v, str) and _BAD_BYTES in v
+
+
+_READERS = {"CSV": _csv_chunks, "JSONL": _jsonl_chunks, "JSON": _json_chunks, "Parquet": _parquet_chunks}
+
+
+def _chunks(fh, fmt: str, report: ImportReport):
+    # Un error de lectura a mitad de fichero se anota y corta la importación.
+    try:
+        yield from _READERS[fmt](fh, report)
+    except _Unreadable as exc:
+        report.failed = str(exc)
+    except (UnicodeDecodeError, ValueError, pd.errors.ParserError, OSError) as exc:
+        report.failed = f"fichero ilegible ({type(exc).__name__})"
+
+
+def read_entries(fh, fmt: str, existing_hashes: set, report: ImportReport):
+    # Genera los registros nuevos del fichero, ya deduplicados. `existing_hashes`
+    # se amplía con cada registro aceptado (deduplica también dentro del fichero).
+    if isinstance(fh, (bytes, bytearray)):
+        fh = io.BytesIO(fh)
+    row = 1
+    for df, bad in _chunks(fh, fmt, report):
+        report.read += len(df) + bad
+        for e in _chunk_entries(df.reset_index(drop=True), row, report):
+            h = entry_hash(e)
+            if h in existing_hashes:
+                report.duplicates += 1
+                continue
+            existing_hashes.add(h)
+            report.imported += 1
+            yield e
+        row += len(df)
+
+
+def history_hashes(hist) -> set:
+    return {entry_hash(e) for e in hist}
@@ -0,0 +1,208 @@
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+import azimut_storage as storage
+
+# =========================================================
+# MÉTRICAS POR FASE (opt-in: AZIMUT_METRICS=1)
+# =========================================================
+# Cada ejecución del script mide sus fases (tema, carga de historial, DataFrame,
+# render del historial, gráficos, export...). Los tiempos se acumulan por
+# (página, fase) en memoria para p50/p95, se escriben en un JSONL rotativo y se
+# pueden exportar en formato de texto de Prometheus.
+METRICS_ENABLED = os.environ.get("AZIMUT_METRICS", "").strip().lower() in {"1", "true", "yes", "on"}
+METRICS_WINDOW = 1000  # muestras por (página, fase) para los percentiles
+METRICS_LOG_MAX_BYTES = 5 * 1024 * 1024
+METRICS_LOG_BACKUPS = 3
+METRICS_PROM_EVERY = 20  # runs entre escrituras del fichero .prom
+
+_lock = threading.Lock()
+_samples: dict[tuple[str, str], deque] = {}
+_counts: dict[tuple[str, str], int] = {}
+_sums: dict[tuple[str, str], float] = {}
+_local = threading.local()
+_logger = None
+_metrics_dir = None
+_runs = 0
+
+
+def configure(metrics_dir):
+    # Prepara el JSONL rotativo en `metrics_dir` (solo si las métricas están activas).
+    global _logger, _metrics_dir
+    if not METRICS_ENABLED or _logger is not None:
+        return
+    _metrics_dir = Path(metrics_dir)
+    _metrics_dir.mkdir(parents=True, exist_ok=True)
+    logger = logging.getLogger("azimut.metrics")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    handler = logging.handlers.RotatingFileHandler(
+        _metrics_dir / "metrics.jsonl", maxBytes=METRICS_LOG_MAX_BYTES, backupCount=METRICS_LOG_BACKUPS, encoding="utf-8"
+    )
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    _logger = logger
+
+
+def record(page: str, phase_name: str, seconds: float):
+    key = (page, phase_name)
+    with _lock:
+        buf = _samples.get(key)
+        if buf is None:
+            buf = _samples[key] = deque(maxlen=METRICS_WINDOW)
+        buf.append(seconds)
+        _counts[key] = _counts.get(key, 0) + 1
+        _sums[key] = _sums.get(key, 0.0) + seconds
+
+
+# ---------- ciclo de vida de una ejecución ----------
+# Una ejecución del script va de begin_run() a end_run(); antes de st.rerun() o
+# st.stop() se cierra con end_run(complete=False). Los st.fragment se vuelven a
+# ejecutar sin pasar por el script, así que cada uno mide su cuerpo en su propia
+# ejecución con run(page). Lo que Streamlit corta por su cuenta no se registra.
+def _new_run(page: str) -> dict:
+    return {"page": page, "t0": time.perf_counter(), "phases": {}}
+
+
+def _finish(run: dict, kind: str, complete: bool):
+    global _runs
+    total = time.perf_counter() - run["t0"]
+    page = run["page"]
+    for name, secs in run["phases"].items():
+        record(page, name, secs)
+    record(page, f"{kind}_total", total)
+    if _logger is not None:
+        _logger.info(
+            json.dumps(
+                {
+                    "ts": time.time(),
+                    "page": page,
+                    "kind": kind,
+                    "complete": complete,
+                    "total": total,
+                    "phases": run["phases"],
+                },
+                ensure_ascii=False,
+            )
+        )
+    with _lock:
+        _runs += 1
+        write_prom = _metrics_dir is not None and _runs % METRICS_PROM_EVERY == 0
+    if write_prom:
+        write_prometheus_file()
+
+
+def begin_run():
+    if METRICS_ENABLED:
+        _local.run = _new_run("?")
+
+
+def set_page(page: str):
+    run = getattr(_local, "run", None) if METRICS_ENABLED else None
+    if run is not None:
+        run["page"] = page
+
+
+def end_run(complete: bool = True):
+    run = getattr(_local, "run", None) if METRICS_ENABLED else None
+    if run is None:
+        return
+    _local.run = None
+    _finish(run, "script", complete)
+
+
+@contextmanager
+def _fragment_run(page: str):
+    # Las fases del fragmento van a su página, se ejecute dentro del script o solo.
+    outer = getattr(_local, "run", None)
+    run = _local.run = _new_run(page)
+    complete = False
+    try:
+        yield
+        complete = True
+    finally:
+        _local.run = outer
+        _finish(run, "fragment", complete)
+
+
+def run(page: str):
+    return _fragment_run(page) if METRICS_ENABLED else nullcontext()
+
+
+@contextmanager
+def _phase(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        dt = time.perf_counter() - t0
+        run = getattr(_local, "run", None)
+        if run is not None:
+            run["phases"][name] = run["phases"].get(name, 0.0) + dt
+        else:
+            # Fuera de una ejecución (p. ej. el export diferido en otro hilo).
+            record("-", name, dt)
+
+
+def phase(name: str):
+    return _phase(name) if METRICS_ENABLED else nullcontext()
+
+
+# ---------- agregados ----------
+def _quantile(sorted_vals: list[float], q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    i = min(len(sorted_vals) - 1, max(0, int(round(q * (len(sorted_vals) - 1)))))
+    return sorted_vals[i]
+
+
+def summary() -> list[dict]:
+    with _lock:
+        items = [(k, sorted(v), _counts[k], _sums[k]) for k, v in _samples.items()]
+    out = [
+        {
+            "page": page,
+            "phase": name,
+            "count": count,
+            "p50_ms": _quantile(vals, 0.5) * 1000,
+            "p95_ms": _quantile(vals, 0.95) * 1000,
+            "max_ms": (vals[-1] if vals else 0.0) * 1000,
+        }
+        for (page, name), vals, count, _ in items
+    ]
+    return sorted(out, key=lambda r: r["p95_ms"], reverse=True)
+
+
+def _label(s: str) -> str:
+    return s.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def prometheus_text() -> str:
+    lines = [
+        "# HELP azimut_phase_seconds Duración de cada fase de una ejecución del script.",
+        "# TYPE azimut_phase_seconds summary",
+    ]
+    with _lock:
+        items = [(k, sorted(v), _counts[k], _sums[k]) for k, v in _samples.items()]
+    for (page, name), vals, count, total in sorted(items):
+        labels = f'page="{_label(page)}",phase="{_label(name)}"'
+        for q in (0.5, 0.95):
+            lines.append(f'azimut_phase_seconds{{{labels},quantile="{q}"}} {_quantile(vals, q):.6f}')
+        lines.append(f"azimut_phase_seconds_sum{{{labels}}} {total:.6f}")
+        lines.append(f"azimut_phase_seconds_count{{{labels}}} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus_file():
+    # Formato textfile (node_exporter): escritura atómica de metrics.prom.
+    if _metrics_dir is None:
+        return
+    path = _metrics_dir / "metrics.prom"
+    storage.atomic_write_text(path, prometheus_text(), durable=False)
@@ -0,0 +1,260 @@
+import bisect
+import heapq
+import threading
+from array import array
+from datetime import date
+from itertools import islice
+
+import azimut_schema as schema
+
+# =========================================================
+# CONSULTAS SOBRE EL HISTORIAL (rango de fechas + bloques)
+# =========================================================
+# Posiciones del historial ordenadas por timestamp, en global y por bloque
+# (listas de posiciones). Un rango de fechas se resuelve con dos búsquedas
+# binarias por bloque; solo se materializan los registros de la página pedida.
+# El orden de los resultados es bloque → fecha → timestamp, el mismo que la
+# vista "Historial por bloque → por fecha": cada fecha sale una sola vez.
+#
+# La fecha de un registro es su `fecha` (o el día del timestamp si no tiene).
+# Casi siempre coincide con el día del timestamp, y entonces ordenar por
+# timestamp ya es ordenar por fecha. Los que no (fechas elegidas a mano) van
+# aparte en cada bloque, ordenados por (día, ts), y se intercalan al paginar.
+# El rango Desde/Hasta filtra por timestamp en los dos casos.
+_DAY = 86400
+
+
+class _Postings:
+    # Pares (ts, posición) ordenados por ts, en dos arrays paralelos.
+    # `inserts` cuenta las inserciones fuera del final: desplazan los índices,
+    # así que un span calculado antes deja de valer.
+    __slots__ = ("ts", "pos", "inserts")
+
+    def __init__(self):
+        self.ts = array("q")
+        self.pos = array("q")
+        self.inserts = 0
+
+    def add(self, ts: int, pos: int):
+        if not self.ts or ts >= self.ts[-1]:
+            self.ts.append(ts)
+            self.pos.append(pos)
+        else:
+            # Registro más antiguo que el último (importaciones): caso raro.
+            i = bisect.bisect_right(self.ts, ts)
+            self.ts.insert(i, ts)
+            self.pos.insert(i, pos)
+            self.inserts += 1
+
+    def span(self, lo_ts: int | None, hi_ts: int | None) -> tuple[int, int]:
+        lo = 0 if lo_ts is None else bisect.bisect_left(self.ts, lo_ts)
+        hi = len(self.ts) if hi_ts is None else bisect.bisect_left(self.ts, hi_ts)
+        return lo, max(lo, hi)
+
+    def keyed(self, lo: int, hi: int):
+        # (día, ts, posición) del span, para intercalar con los de otra fecha.
+        ts, pos = self.ts, self.pos
+        for i in range(lo, hi):
+            yield ts[i] // _DAY, ts[i], pos[i]
+
+
+class _BloquePostings:
+    # Un bloque: `dated` (fecha = día del ts) por ts y `other` por (día, ts, pos).
+    __slots__ = ("dated", "other")
+
+    def __init__(self):
+        self.dated = _Postings()
+        self.other: list[tuple[int, int, int]] = []
+
+    def add(self, day: int, ts: int, pos: int):
+        if day == ts // _DAY:
+            self.dated.add(ts, pos)
+        else:
+            bisect.insort(self.other, (day, ts, pos))
+
+    def __bool__(self):
+        return bool(self.dated.ts or self.other)
+
+    def select(self, lo_ts: int | None, hi_ts: int | None) -> tuple:
+        lo, hi = self.dated.span(lo_ts, hi_ts)
+        other = [
+            k for k in self.other if (lo_ts is None or k[1] >= lo_ts) and (hi_ts is None or k[1] < hi_ts)
+        ]
+        return self.dated, lo, hi, other
+
+
+class QueryResult:
+    def __init__(self, positions: list[int], total: int, all_positions):
+        self.positions = positions  # página pedida (offset/limit)
+        self.total = total  # coincidencias sin paginar
+        self._all = all_positions
+
+    def all_positions(self) -> list[int]:
+        return self._all()
+
+    def __len__(self):
+        return len(self.positions)
+
+
+class HistoryQueryIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.n_entries = 0
+        self.all = _Postings()
+        self.by_bloque: dict[int, _BloquePostings] = {}
+        # Por posición del historial (para filtrar resultados de texto y contar).
+        self._ts_of = array("q")
+        self._day_of = array("q")
+        self._bloque_of = array("b")
+
+    @classmethod
+    def from_history(cls, hist) -> "HistoryQueryIndex":
+        idx = cls()
+        ts_col = getattr(hist, "ts", None)
+        if ts_col is not None and hasattr(hist, "bloque") and hasattr(hist, "fecha") and not hist.raw_rows():
+            # ColumnarHistory: columnas ya en segundos, sin crear un dict por registro.
+            idx._ts_of = array("q", ts_col)
+            idx._bloque_of = array("b", hist.bloque)
+            idx._day_of = array("q", (_group_day(f, ts) for f, ts in zip(hist.fecha, ts_col)))
+            for pos in sorted(range(len(ts_col)), key=ts_col.__getitem__):
+                b = idx._bloque_of[pos]
+                idx._add(ts_col[pos], idx._day_of[pos], pos, None if b == schema.NO_BLOQUE else b)
+            idx.n_entries = len(ts_col)
+            return idx
+        for pos, e in enumerate(hist):
+            idx.add(pos, e)
+        return idx
+
+    def add(self, pos: int, entry: dict):
+        with self._lock:
+            self.n_entries = max(self.n_entries, pos + 1)
+            while len(self._ts_of) < self.n_entries:
+                self._ts_of.append(schema.NO_TS)
+                self._day_of.append(schema.NO_TS)
+                self._bloque_of.append(schema.NO_BLOQUE)
+            ts = schema.entry_ts(entry)
+            if ts is None:
+                return
+            b = entry.get("bloque") if isinstance(entry, dict) else None
+            b = b if isinstance(b, int) and 0 <= b < 128 else None
+            day = _group_day(entry.get("fecha"), ts)
+            self._ts_of[pos] = ts
+            self._day_of[pos] = day
+            self._bloque_of[pos] = schema.NO_BLOQUE if b is None else b
+            self._add(ts, day, pos, b)
+
+    def _add(self, ts: int, day: int, pos: int, bloque: int | None):
+        # Los registros sin bloque van en su propia lista (schema.NO_BLOQUE, la primera).
+        self.all.add(ts, pos)
+        key = schema.NO_BLOQUE if bloque is None else bloque
+        postings = self.by_bloque.get(key)
+        if postings is None:
+            postings = self.by_bloque[key] = _BloquePostings()
+        postings.add(day, ts, pos)
+
+    # ---------- límites ----------
+    def bounds(self) -> tuple[date | None, date | None]:
+        if not self.all.ts:
+            return None, None
+        return (
+            schema.ts_day(self.all.ts[0]),
+            schema.ts_day(self.all.ts[-1]),
+        )
+
+    def bloques(self) -> list[int]:
+        return sorted(b for b, p in self.by_bloque.items() if p and b != schema.NO_BLOQUE)
+
+    # ---------- consulta ----------
+    def query(self, start=None, end=None, bloques=None, hits=None, limit=None, offset: int = 0) -> QueryResult:
+        # `hits`: posiciones ya filtradas por texto (índice invertido) o None.
+        lo_ts = None if start is None else schema.day_start(start)
+        hi_ts = None if end is None else schema.day_start(end) + _DAY
+        with self._lock:
+            if bloques is None:
+                groups = [self.by_bloque[b] for b in sorted(self.by_bloque)]
+            else:
+                groups = [self.by_bloque[b] for b in sorted({int(b) for b in bloques}) if b in self.by_bloque]
+
+            if hits is not None:
+                matches = self._filter_hits(hits, lo_ts, hi_ts, bloques)
+                page = matches[offset : None if limit is None else offset + limit]
+                return QueryResult(page, len(matches), lambda: list(matches))
+
+            spans = [g.select(lo_ts, hi_ts) for g in groups]
+            inserts = [p.inserts for p, _, _, _ in spans]
+            total = sum(hi - lo + len(other) for _, lo, hi, other in spans)
+            page = self._slice(spans, offset, limit)
+
+        def everything():
+            # Los spans guardados solo valen si desde la consulta únicamente se
+            # ha añadido al final; si no, se recalculan con el mismo rango.
+            with self._lock:
+                current = [
+                    (p, lo, hi, other) if p.inserts == n else (p, *p.span(lo_ts, hi_ts), other)
+                    for (p, lo, hi, other), n in zip(spans, inserts)
+                ]
+                return self._slice(current, 0, None)
+
+        return QueryResult(page, total, everything)
+
+    @staticmethod
+    def _slice(spans, offset: int, limit: int | None) -> list[int]:
+        out: list[int] = []
+        skip = offset
+        for p, lo, hi, other in spans:
+            n = hi - lo + len(other)
+            if skip >= n:
+                skip -= n
+                continue
+            want = None if limit is None else limit - len(out)
+            if not other:
+                a = lo + skip
+                b = hi if want is None else min(hi, a + want)
+                out.extend(p.pos[a:b])
+            else:
+                merged = heapq.merge(p.keyed(lo, hi), other)
+                out.extend(k[2] for k in islice(merged, skip, None if want is None else skip + want))
+            skip = 0
+            if limit is not None and len(out) >= limit:
+                break
+        return out
+
+    def _filter_hits(self, hits, lo_ts, hi_ts, bloques) -> list[int]:
+        allowed = None if bloques is None else {int(b) for b in bloques}
+        keyed = []
+        n = len(self._ts_of)
+        for pos in hits:
+            if not 0 <= pos < n:
+                continue
+            ts = self._ts_of[pos]
+            if ts == schema.NO_TS or (lo_ts is not None and ts < lo_ts) or (hi_ts is not None and ts >= hi_ts):
+                continue
+            b = self._bloque_of[pos]
+            if allowed is not None and b not in allowed:
+                continue
+            keyed.append((b, self._day_of[pos], ts, pos))
+        keyed.sort()
+        return [pos for _, _, _, pos in keyed]
+
+    # ---------- agregados sobre un resultado ----------
+    def daily_counts(self, positions) -> list[tuple[date, int]]:
+        counts: dict[int, int] = {}
+        for pos in positions:
+            ts = self._ts_of[pos]
+            if ts != schema.NO_TS:
+                counts[ts // _DAY] = counts.get(ts // _DAY, 0) + 1
+        return [(schema.ts_day(d * _DAY), n) for d, n in sorted(counts.items())]
+
+    def bloque_counts(self, positions) -> dict[int, int]:
+        counts: dict[int, int] = {}
+        for pos in positions:
+            b = self._bloque_of[pos]
+            if b != schema.NO_BLOQUE:
+                counts[b] = counts.get(b, 0) + 1
+        return counts
+
+
+def _group_day(fecha, ts: int) -> int:
+    # Día con el que se agrupa el registro: su `fecha` o, si no tiene, el del timestamp.
+    day = schema.fecha_day(fecha)
+    return ts // _DAY if day is None else day
@@ -0,0 +1,199 @@
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+import pandas as pd
+
+# =========================================================
+# ESQUEMA DE REGISTRO (versionado)
+# =========================================================
+# v1 (histórico): {"timestamp": "YYYY-MM-DD HH:MM:SS", "fecha": "DD/MM/YYYY", ...}
+# v2:             {"v": 2, "ts": <segundos>, "fecha": "YYYY-MM-DD", ...}
+#
+# `ts` son segundos desde 1970-01-01 en hora local (sin zona), igual que el
+# timestamp de texto de siempre. Los registros v1 no se reescriben al cargar:
+# se convierten por columnas (formato explícito, sin inferencia) al construir
+# el DataFrame, y por registro solo donde hace falta uno suelto.
+SCHEMA_VERSION = 2
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+LEGACY_FECHA_FORMAT = "%d/%m/%Y"
+FECHA_FORMAT = "%Y-%m-%d"
+EPOCH = datetime(1970, 1, 1)
+# Centinelas de las columnas enteras (azimut_cache, azimut_query): sin ts / sin bloque.
+NO_TS = -(2**62)
+NO_BLOQUE = -1
+
+# Claves de `meta` admitidas por bloque (las que escribe cada pantalla).
+BLOQUE_META_KEYS: dict[int, tuple[str, ...]] = {
+    1: (),
+    2: ("situacion", "utilidad"),
+    3: ("emocion_automatica", "sentimiento", "estado_animo", "energia"),
+    4: ("primaria", "secundaria", "pensamiento"),
+    5: ("antes", "precisas", "cuerpo"),
+    6: ("situacion", "pensamiento", "alternativa"),
+    7: ("evidencia",),
+    8: ("habilidad", "distinto"),
+    9: ("bloque_util", "dificil", "mejor", "rumbo"),
+}
+
+
+class SchemaError(ValueError):
+    pass
+
+
+# ---------- valores sueltos ----------
+def ts_from_text(ts) -> int | None:
+    # "YYYY-MM-DD HH:MM:SS" exacto (fromisoformat es mucho más rápido que strptime).
+    if not isinstance(ts, str) or len(ts) != 19 or ts[10] != " ":
+        return None
+    try:
+        return int((datetime.fromisoformat(ts) - EPOCH).total_seconds())
+    except ValueError:
+        return None
+
+
+def ts_to_text(ts: int) -> str:
+    return (EPOCH + timedelta(seconds=int(ts))).strftime(TS_FORMAT)
+
+
+def ts_day(ts: int) -> date:
+    return (EPOCH + timedelta(seconds=int(ts))).date()
+
+
+def day_start(d: date) -> int:
+    return int((datetime(d.year, d.month, d.day) - EPOCH).total_seconds())
+
+
+def fecha_to_iso(fecha) -> str:
+    # Acepta date, "YYYY-MM-DD" o "DD/MM/YYYY"; devuelve "" si no es una fecha.
+    if isinstance(fecha, date):
+        return fecha.strftime(FECHA_FORMAT)
+    if not isinstance(fecha, str) or not fecha.strip():
+        return ""
+    return _fecha_text_to_iso(fecha.strip())
+
+
+@lru_cache(maxsize=65536)
+def _fecha_text_to_iso(fecha: str) -> str:
+    # Las fechas se repiten mucho (un día, varios registros): se memoiza.
+    for fmt in (FECHA_FORMAT, LEGACY_FECHA_FORMAT):
+        try:
+            return datetime.strptime(fecha, fmt).strftime(FECHA_FORMAT)
+        except ValueError:
+            continue
+    return ""
+
+
+def fecha_day(fecha) -> int | None:
+    # Día de la fecha (días desde EPOCH), como ts // 86400; None si no es una fecha.
+    iso = fecha_to_iso(fecha)
+    return _iso_day(iso) if iso else None
+
+
+@lru_cache(maxsize=65536)
+def _iso_day(iso: str) -> int:
+    return (datetime.fromisoformat(iso) - EPOCH).days
+
+
+def validate_meta(bloque, meta) -> dict:
+    # Claves desconocidas o valores que no son texto → SchemaError.
+    meta = meta or {}
+    if not isinstance(meta, dict):
+        raise SchemaError(f"meta debe ser un dict, no {type(meta).__name__}")
+    allowed = BLOQUE_META_KEYS.get(bloque)
+    if allowed is None:
+        raise SchemaError(f"bloque desconocido: {bloque!r}")
+    unknown = [k for k in meta if k not in allowed]
+    if unknown:
+        raise SchemaError(f"claves de meta no válidas para el bloque {bloque}: {', '.join(map(str, unknown))}")
+    bad = [k for k, v in meta.items() if not isinstance(v, str)]
+    if bad:
+        raise SchemaError(f"meta del bloque {bloque} con valores no textuales: {', '.join(bad)}")
+    return dict(meta)
+
+
+# ---------- registros ----------
+def make_entry(bloque: int, fecha, concepto, respuesta, meta=None, now: datetime | None = None) -> dict:
+    bloque = int(bloque)
+    now = now or datetime.now()
+    return {
+        "v": SCHEMA_VERSION,
+        "ts": int((now.replace(microsecond=0) - EPOCH).total_seconds()),
+        "bloque": bloque,
+        "fecha": fecha_to_iso(fecha),
+        "concepto": concepto,
+        "respuesta": respuesta or "",
+        "meta": validate_meta(bloque, meta),
+    }
+
+
+def is_current(e) -> bool:
+    return isinstance(e, dict) and e.get("v") == SCHEMA_VERSION and isinstance(e.get("ts"), int)
+
+
+def entry_ts(e) -> int | None:
+    if not isinstance(e, dict):
+        return None
+    if is_current(e):
+        return e["ts"]
+    return ts_from_text(e.get("timestamp"))
+
+
+def entry_timestamp(e) -> str:
+    ts = entry_ts(e)
+    if ts is not None:
+        return ts_to_text(ts)
+    return (e.get("timestamp") or "") if isinstance(e, dict) else ""
+
+
+def entry_day(e) -> date | None:
+    ts = entry_ts(e)
+    return None if ts is None else ts_day(ts)
+
+
+def upgrade_entry(e) -> dict:
+    # Un registro suelto a v2 (escrituras, SQLite). Los que no se pueden leer se devuelven tal cual.
+    if not isinstance(e, dict) or is_current(e):
+        return e
+    ts = ts_from_text(e.get("timestamp"))
+    if ts is None:
+        return e
+    out = {k: v for k, v in e.items() if k != "timestamp"}
+    out["v"] = SCHEMA_VERSION
+    out["ts"] = ts
+    out["fecha"] = fecha_to_iso(e.get("fecha"))
+    return out
+
+
+# ---------- por columnas (DataFrame) ----------
+def fecha_series_to_iso(fecha: pd.Series) -> pd.Series:
+    # "DD/MM/YYYY" o "YYYY-MM-DD" → "YYYY-MM-DD"; lo demás → "". Las filas de
+    # SQLite y las importaciones pueden traer ya la fecha en ISO.
+    raw = fecha.astype("string")
+    iso = pd.to_datetime(raw, format=LEGACY_FECHA_FORMAT, errors="coerce")
+    iso = iso.fillna(pd.to_datetime(raw, format=FECHA_FORMAT, errors="coerce"))
+    return iso.dt.strftime(FECHA_FORMAT).fillna("").astype(object)
+
+
+def upgrade_frame(df: pd.DataFrame) -> pd.DataFrame:
+    # Normaliza in situ un DataFrame de registros mezclados v1/v2:
+    #   timestamp → texto "YYYY-MM-DD HH:MM:SS" (desde `ts` en los v2)
+    #   fecha     → ISO "YYYY-MM-DD" o "" (desde "DD/MM/YYYY" en los v1)
+    # Todo con operaciones vectorizadas y formatos explícitos.
+    n = len(df)
+    current = df["v"].eq(SCHEMA_VERSION) if "v" in df.columns else pd.Series(False, index=df.index)
+    if "timestamp" not in df.columns:
+        df["timestamp"] = None
+    if current.any() and "ts" in df.columns:
+        secs = pd.to_numeric(df.loc[current, "ts"], errors="coerce")
+        df.loc[current, "timestamp"] = pd.to_datetime(secs, unit="s").dt.strftime(TS_FORMAT)
+
+    fecha = df["fecha"] if "fecha" in df.columns else pd.Series([""] * n, index=df.index, dtype=object)
+    legacy = ~current
+    if legacy.any():
+        fecha = fecha.astype(object)
+        fecha.loc[legacy] = fecha_series_to_iso(fecha[legacy])
+    df["fecha"] = fecha.where(fecha.notna(), "")
+    for col in ("v", "ts"):
+        if col in df.columns:
+            del df[col]
+    return df
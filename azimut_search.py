@@ -0,0 +1,390 @@
+import bisect
+import heapq
+import json
+import math
+import os
+import re
+import unicodedata
+from array import array
+
+# =========================================================
+# NORMALIZACIÓN (español): minúsculas, sin tildes, sin stopwords
+# =========================================================
+_SPANISH_STOPWORDS = """
+a al algo algun alguna algunas alguno algunos ante antes aqui asi aun bien cada casi como con
+contra cual cuales cuando de del desde donde dos el ella ellas ello ellos en entonces entre era
+eramos eran eres es esa esas ese eso esos esta estaba estado estamos estan estar estas este esto
+estos estoy fue fueron fui ha habia han has hasta hay he la las le les lo los mas me mi mis mucho
+muy nada ni no nos nosotros o os otra otras otro otros para pero poco por porque que quien se sea
+ser si sin sino sobre solo somos son soy su sus tal tambien te tengo ti tiene tienen todo todos
+tu tus un una unas uno unos usted ya yo
+"""
+STOPWORDS = frozenset(_SPANISH_STOPWORDS.split())
+
+_TOKEN_RE = re.compile(r"[a-z0-9ñ]+")
+
+
+_NON_ASCII_RE = re.compile(r"[^\x00-\x7fñ]")
+_COMMON_ACCENTS = str.maketrans("áéíóúüàèìòùâêîôûäëïö", "aeiouuaeiouaeiouaeio")
+
+
+def strip_accents(s: str) -> str:
+    # "Emoción" → "emocion"; la ñ se conserva.
+    s = (s or "").lower()
+    if s.isascii():
+        return s
+    # Caso habitual (tildes del español, rayas, comillas): tabla de traducción y
+    # solo se miran los caracteres no ASCII que queden.
+    t = s.translate(_COMMON_ACCENTS)
+    rest = set(_NON_ASCII_RE.findall(t))
+    if all(unicodedata.category(c) != "Mn" and not unicodedata.decomposition(c) for c in rest):
+        return t
+    s = s.replace("ñ", "\0")
+    s = "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
+    return s.replace("\0", "ñ")
+
+
+def tokenize(s: str) -> list[str]:
+    return [t for t in _TOKEN_RE.findall(strip_accents(s)) if len(t) > 1 and t not in STOPWORDS]
+
+
+# =========================================================
+# PASAJES: párrafos agrupados, guardados como offsets
+# =========================================================
+PASSAGE_MIN_CHARS = 400
+PASSAGE_MAX_CHARS = 1400
+
+_PARAGRAPH_RE = re.compile(r"[^\n](?:[^\n]|\n(?![ \t\r]*\n))*")
+_PARAGRAPH_RE_BYTES = re.compile(rb"[^\n](?:[^\n]|\n(?![ \t\r]*\n))*")
+
+
+def iter_paragraphs(text, start: int = 0, end: int | None = None):
+    # (inicio, fin) de cada párrafo no vacío de text[start:end], con offsets absolutos.
+    pattern = _PARAGRAPH_RE if isinstance(text, str) else _PARAGRAPH_RE_BYTES
+    for m in pattern.finditer(text, start, len(text) if end is None else end):
+        if m.group().strip():
+            yield m.start(), m.end()
+
+
+def split_passages(text) -> list[tuple[int, int]]:
+    # Devuelve (inicio, fin) sobre `text`; se agrupan párrafos hasta PASSAGE_MIN_CHARS.
+    # Acepta str u objetos tipo bytes (mmap): entonces los offsets son de bytes.
+    out = []
+    if text is None or len(text) == 0:
+        return out
+    cur_start = cur_end = None
+    for m_start, m_end in iter_paragraphs(text):
+        if cur_start is None:
+            cur_start, cur_end = m_start, m_end
+        elif m_end - cur_start > PASSAGE_MAX_CHARS:
+            out.append((cur_start, cur_end))
+            cur_start, cur_end = m_start, m_end
+        else:
+            cur_end = m_end
+        if cur_end - cur_start >= PASSAGE_MIN_CHARS:
+            out.append((cur_start, cur_end))
+            cur_start = cur_end = None
+    if cur_start is not None:
+        out.append((cur_start, cur_end))
+    return out
+
+
+# =========================================================
+# BM25 (índice invertido)
+# =========================================================
+class BM25Index:
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_len = array("I")
+        # término → (ids de documento, frecuencias), en arrays compactos
+        self.postings: dict[str, tuple[array, array]] = {}
+        self._norm: list[float] = []
+        self._idf: dict[str, float] = {}
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    def add(self, tokens: list[str]) -> int:
+        doc_id = len(self.doc_len)
+        tf: dict[str, int] = {}
+        for t in tokens:
+            tf[t] = tf.get(t, 0) + 1
+        for t, n in tf.items():
+            plist = self.postings.get(t)
+            if plist is None:
+                plist = self.postings[t] = (array("I"), array("I"))
+            plist[0].append(doc_id)
+            plist[1].append(n)
+        self.doc_len.append(len(tokens))
+        return doc_id
+
+    def finalize(self):
+        # Precalcula idf y la normalización por longitud: las consultas solo suman.
+        n_docs = len(self.doc_len)
+        avgdl = (sum(self.doc_len) / n_docs) if n_docs else 0.0
+        self._norm = [
+            self.k1 * (1 - self.b + self.b * (dl / avgdl if avgdl else 0.0)) for dl in self.doc_len
+        ]
+        self._idf = {
+            t: math.log(1 + (n_docs - len(p[0]) + 0.5) / (len(p[0]) + 0.5)) for t, p in self.postings.items()
+        }
+        return self
+
+    def search(self, query_tokens: list[str], k: int = 3) -> list[tuple[int, float]]:
+        scores: dict[int, float] = {}
+        k1 = self.k1
+        norm = self._norm
+        for t in set(query_tokens):
+            plist = self.postings.get(t)
+            if plist is None:
+                continue
+            idf = self._idf[t]
+            for doc_id, tf in zip(plist[0], plist[1]):
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1) / (tf + norm[doc_id])
+        return heapq.nlargest(k, scores.items(), key=lambda kv: kv[1])
+
+    # ---------- persistencia (solo datos: cabecera JSON + un array de enteros) ----------
+    def dump(self) -> tuple[dict, array]:
+        # idf y normalización no se guardan: finalize() los recalcula al cargar.
+        terms = list(self.postings)
+        flat = array("I", self.doc_len)
+        for t in terms:
+            ids, tfs = self.postings[t]
+            flat.extend(ids)
+            flat.extend(tfs)
+        head = {
+            "k1": self.k1,
+            "b": self.b,
+            "n_docs": len(self.doc_len),
+            "terms": terms,
+            "counts": [len(self.postings[t][0]) for t in terms],
+        }
+        return head, flat
+
+    @classmethod
+    def from_dump(cls, head: dict, flat: array) -> "BM25Index":
+        n_docs, terms, counts = int(head["n_docs"]), head["terms"], head["counts"]
+        if len(terms) != len(counts) or n_docs + 2 * sum(counts) != len(flat):
+            raise ValueError("índice BM25 incompleto")
+        idx = cls(float(head["k1"]), float(head["b"]))
+        idx.doc_len = flat[:n_docs]
+        pos = n_docs
+        for t, n in zip(terms, counts):
+            idx.postings[t] = (flat[pos : pos + n], flat[pos + n : pos + 2 * n])
+            pos += 2 * n
+        return idx.finalize()
+
+
+class CorpusIndex:
+    # Índice BM25 sobre varios textos; cada pasaje es (fuente, inicio, fin).
+    # Los documentos solo tienen que admitir doc[inicio:fin] → str (str o CorpusFile)
+    # y no se serializan con el índice: se vuelven a enlazar con attach().
+    def __init__(self):
+        self.bm25 = BM25Index()
+        self.passages: list[tuple[str, int, int]] = []
+        self.docs: dict = {}
+
+    def dump(self) -> tuple[dict, array]:
+        head, flat = self.bm25.dump()
+        return {"bm25": head, "passages": [list(p) for p in self.passages]}, flat
+
+    @classmethod
+    def from_dump(cls, head: dict, flat: array) -> "CorpusIndex":
+        idx = cls()
+        idx.bm25 = BM25Index.from_dump(head["bm25"], flat)
+        idx.passages = [(str(s), int(a), int(b)) for s, a, b in head["passages"]]
+        if len(idx.passages) != len(idx.bm25):
+            raise ValueError("índice BM25 incompleto")
+        return idx
+
+    def attach(self, source: str, doc):
+        self.docs[source] = doc
+        return self
+
+    def add_document(self, source: str, doc, passages: list[tuple[int, int]]):
+        self.attach(source, doc)
+        for start, end in passages:
+            tokens = tokenize(doc[start:end])
+            if tokens:
+                self.bm25.add(tokens)
+                self.passages.append((source, start, end))
+        return self
+
+    def finalize(self):
+        self.bm25.finalize()
+        return self
+
+    def search(self, query: str, k: int = 3) -> list[dict]:
+        tokens = tokenize(query)
+        if not tokens or not len(self.bm25):
+            return []
+        out = []
+        for doc_id, score in self.bm25.search(tokens, k):
+            source, start, end = self.passages[doc_id]
+            doc = self.docs.get(source)
+            if doc is None:
+                continue
+            out.append({"source": source, "text": doc[start:end], "score": score})
+        return out
+
+
+# =========================================================
+# BÚSQUEDA EN EL HISTORIAL DEL USUARIO (índice incremental)
+# =========================================================
+# El índice se persiste como JSON lines junto al historial: una línea por
+# registro con sus términos ya normalizados ({"id": posición, "t": [...]}).
+# Al cargar no se vuelve a tokenizar nada; solo se indexa la cola que falte.
+def entry_text(entry: dict) -> str:
+    parts = [str(entry.get("concepto") or ""), str(entry.get("respuesta") or "")]
+    meta = entry.get("meta")
+    if isinstance(meta, dict):
+        parts.extend(str(v) for v in meta.values() if v is not None)
+    return " ".join(parts)
+
+
+class HistoryIndex:
+    def __init__(self):
+        self.n_entries = 0
+        self.postings: dict[str, set[int]] = {}
+        self._vocab: list[str] | None = None
+
+    def _add_terms(self, entry_id: int, terms):
+        for t in terms:
+            self.postings.setdefault(t, set()).add(entry_id)
+        self.n_entries = max(self.n_entries, entry_id + 1)
+        self._vocab = None
+
+    def add(self, entry_id: int, entry: dict) -> list[str]:
+        terms = sorted(set(tokenize(entry_text(entry))))
+        self._add_terms(entry_id, terms)
+        return terms
+
+    def _matching(self, token: str) -> set[int]:
+        # Coincidencia por prefijo ("ansie" → "ansiedad") con bisect sobre el vocabulario ordenado.
+        if self._vocab is None:
+            self._vocab = sorted(self.postings)
+        vocab = self._vocab
+        out: set[int] = set()
+        i = bisect.bisect_left(vocab, token)
+        while i < len(vocab) and vocab[i].startswith(token):
+            out |= self.postings[vocab[i]]
+            i += 1
+        return out
+
+    def search(self, query: str) -> set[int]:
+        # Todos los términos de la consulta deben aparecer (AND).
+        result: set[int] | None = None
+        for tok in sorted(set(tokenize(query)), key=len, reverse=True):
+            ids = self._matching(tok)
+            result = ids if result is None else (result & ids)
+            if not result:
+                return set()
+        return result or set()
+
+
+class ConcatIndex:
+    # Índices de varias partes seguidas (archivo + caliente): cada parte busca
+    # en sus posiciones y se desplazan por su `offset`.
+    def __init__(self, parts: list[tuple[int, HistoryIndex]]):
+        self.parts = parts
+
+    def search(self, query: str) -> set[int]:
+        out: set[int] = set()
+        for offset, idx in self.parts:
+            out |= {offset + i for i in idx.search(query)}
+        return out
+
+
+def build_history_index(hist) -> HistoryIndex:
+    # Solo en memoria (meses archivados: no cambian y se leen pocas veces).
+    idx = HistoryIndex()
+    for i, e in enumerate(hist):
+        if isinstance(e, dict):
+            idx.add(i, e)
+    return idx
+
+
+def _index_lines(rows) -> str:
+    return "".join(json.dumps({"id": entry_id, "t": terms}, ensure_ascii=False) + "\n" for entry_id, terms in rows)
+
+
+def _append_index_lines(path, rows):
+    with open(path, "a", encoding="utf-8") as fh:
+        fh.write(_index_lines(rows))
+
+
+def load_history_index(path, hist: list) -> HistoryIndex:
+    idx = HistoryIndex()
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    rec = json.loads(line)
+                except Exception:
+                    continue
+                if isinstance(rec, dict) and isinstance(rec.get("id"), int):
+                    idx._add_terms(rec["id"], rec.get("t") or [])
+
+    if idx.n_entries > len(hist):
+        # El historial se ha reducido (limpieza): el índice ya no es válido.
+        os.remove(path)
+        idx = HistoryIndex()
+
+    missing = [(i, idx.add(i, hist[i])) for i in range(idx.n_entries, len(hist)) if isinstance(hist[i], dict)]
+    if missing:
+        _append_index_lines(path, missing)
+    return idx
+
+
+def index_entries_text(idx: HistoryIndex, items) -> str:
+    # Indexa en memoria y devuelve las líneas a persistir (las escribe quien llama,
+    # p. ej. el escritor en segundo plano).
+    return _index_lines([(entry_id, idx.add(entry_id, entry)) for entry_id, entry in items])
+
+
+def clear_history_index(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+# =========================================================
+# AUTOCOMPLETADO (índice de prefijos con ranking por frecuencia)
+# =========================================================
+class PrefixIndex:
+    # Cada prefijo normalizado (sin tildes) guarda ya su top-K: una consulta es
+    # un acceso a diccionario, sin recorrer el vocabulario.
+    def __init__(self, words: list[str], freq: dict[str, int] | None = None, k: int = 6):
+        freq = freq or {}
+        order = {w: i for i, w in enumerate(words)}
+        ranked = sorted(words, key=lambda w: (-freq.get(w, 0), order[w]))
+        self.k = k
+        self._top: dict[str, list[str]] = {}
+        for w in ranked:
+            norm = strip_accents(w).strip()
+            keys = {norm[:i] for i in range(1, len(norm) + 1)}
+            for part in norm.split()[1:]:
+                keys.update(part[:i] for i in range(1, len(part) + 1))
+            for key in keys:
+                bucket = self._top.setdefault(key, [])
+                if len(bucket) < k:
+                    bucket.append(w)
+
+    def suggest(self, prefix: str, k: int | None = None) -> list[str]:
+        key = strip_accents(prefix).strip()
+        if not key:
+            return []
+        return self._top.get(key, [])[: k or self.k]
+
+
+def term_frequencies(text: str, terms: list[str]) -> dict[str, int]:
+    # Frecuencia de cada término (sin tildes) en `text`; para expresiones de
+    # varias palabras se usa la palabra menos frecuente.
+    counts: dict[str, int] = {}
+    for t in _TOKEN_RE.findall(strip_accents(text)):
+        counts[t] = counts.get(t, 0) + 1
+    out = {}
+    for term in terms:
+        toks = _TOKEN_RE.findall(strip_accents(term))
+        out[term] = min((counts.get(t, 0) for t in toks), default=0)
+    return out
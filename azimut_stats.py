@@ -0,0 +1,311 @@
+import bisect
+import hashlib
+import json
+from datetime import date, timedelta
+from pathlib import Path
+
+import azimut_schema as schema
+import azimut_search as search
+import azimut_storage as storage
+
+# =========================================================
+# RESUMEN INCREMENTAL (registros por día / bloque, rachas)
+# =========================================================
+# Se actualiza en O(1) con cada guardado y responde a consultas por rango de
+# fechas recorriendo días, no registros. Se persiste en rollup_{uid}.json.
+ROLLUP_VERSION = 1
+
+
+def entry_day(entry: dict) -> date | None:
+    return schema.entry_day(entry)
+
+
+class Rollup:
+    def __init__(self):
+        self.n_entries = 0
+        self.daily: dict[str, dict[str, int]] = {}  # "YYYY-MM-DD" → {"bloque": n}
+        self.by_bloque: dict[str, int] = {}
+        self.current_streak = 0
+        self.longest_streak = 0
+        self._days: list[str] = []  # días con registros, ordenados
+
+    # ---------- construcción ----------
+    @classmethod
+    def from_history(cls, hist: list) -> "Rollup":
+        r = cls()
+        for e in hist:
+            r.add(e, _recompute_streaks=False)
+        r._recompute_streaks()
+        return r
+
+    def add(self, entry: dict, _recompute_streaks: bool = True):
+        self.n_entries += 1
+        bloque = entry.get("bloque") if isinstance(entry, dict) else None
+        bkey = str(bloque) if bloque is not None else "?"
+        self.by_bloque[bkey] = self.by_bloque.get(bkey, 0) + 1
+
+        d = entry_day(entry)
+        if d is None:
+            return
+        day = d.isoformat()
+        counts = self.daily.get(day)
+        if counts is None:
+            counts = self.daily[day] = {}
+            last = self._days[-1] if self._days else None
+            if last is None or day > last:
+                self._days.append(day)
+                if last is not None and date.fromisoformat(last) + timedelta(days=1) == d:
+                    self.current_streak += 1
+                else:
+                    self.current_streak = 1
+                self.longest_streak = max(self.longest_streak, self.current_streak)
+            else:
+                # Día anterior al último (importaciones): caso raro, se recalcula.
+                bisect.insort(self._days, day)
+                if _recompute_streaks:
+                    self._recompute_streaks()
+        counts[bkey] = counts.get(bkey, 0) + 1
+
+    def add_many(self, entries):
+        # Importaciones: días fuera de orden sin recalcular rachas por registro.
+        for e in entries:
+            self.add(e, _recompute_streaks=False)
+        self._recompute_streaks()
+
+    def _recompute_streaks(self):
+        current = longest = 0
+        prev = None
+        for day in self._days:
+            d = date.fromisoformat(day)
+            current = current + 1 if prev is not None and prev + timedelta(days=1) == d else 1
+            longest = max(longest, current)
+            prev = d
+        self.current_streak = current
+        self.longest_streak = longest
+
+    # ---------- consultas ----------
+    def _days_between(self, start: date | None, end: date | None) -> list[str]:
+        lo = 0 if start is None else bisect.bisect_left(self._days, start.isoformat())
+        hi = len(self._days) if end is None else bisect.bisect_right(self._days, end.isoformat())
+        return self._days[lo:hi]
+
+    def daily_counts(self, start=None, end=None, bloques=None) -> list[tuple[date, int]]:
+        keys = None if bloques is None else {str(b) for b in bloques}
+        out = []
+        for day in self._days_between(start, end):
+            counts = self.daily[day]
+            n = sum(counts.values()) if keys is None else sum(v for k, v in counts.items() if k in keys)
+            if n:
+                out.append((date.fromisoformat(day), n))
+        return out
+
+    def bloque_counts(self, start=None, end=None, bloques=None) -> dict[int, int]:
+        keys = None if bloques is None else {str(b) for b in bloques}
+        out: dict[int, int] = {}
+        if start is None and end is None:
+            items = [(k, v) for k, v in self.by_bloque.items()]
+        else:
+            items = [kv for day in self._days_between(start, end) for kv in self.daily[day].items()]
+        for k, v in items:
+            if k == "?" or (keys is not None and k not in keys):
+                continue
+            out[int(k)] = out.get(int(k), 0) + v
+        return out
+
+    def streaks(self, today: date | None = None) -> tuple[int, int]:
+        # La racha actual solo cuenta si el último registro es de hoy o de ayer.
+        today = today or date.today()
+        if not self._days or date.fromisoformat(self._days[-1]) < today - timedelta(days=1):
+            return 0, self.longest_streak
+        return self.current_streak, self.longest_streak
+
+    def cadence(self, days: int, today: date | None = None) -> float:
+        # Registros por día en los últimos `days` días (incluido hoy).
+        today = today or date.today()
+        total = sum(n for _, n in self.daily_counts(today - timedelta(days=days - 1), today))
+        return total / days
+
+    # ---------- persistencia ----------
+    def to_dict(self) -> dict:
+        return {
+            "version": ROLLUP_VERSION,
+            "n_entries": self.n_entries,
+            "daily": self.daily,
+            "by_bloque": self.by_bloque,
+            "current_streak": self.current_streak,
+            "longest_streak": self.longest_streak,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Rollup":
+        r = cls()
+        r.n_entries = int(data.get("n_entries", 0))
+        r.daily = {k: dict(v) for k, v in (data.get("daily") or {}).items()}
+        r.by_bloque = dict(data.get("by_bloque") or {})
+        r.current_streak = int(data.get("current_streak", 0))
+        r.longest_streak = int(data.get("longest_streak", 0))
+        r._days = sorted(r.daily)
+        return r
+
+
+def load_rollup(path, hist: list) -> Rollup:
+    # Si el resumen persistido no corresponde al historial (p. ej. tras limpiarlo
+    # o si falta), se reconstruye una vez y se vuelve a guardar.
+    path = Path(path)
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+        if data.get("version") == ROLLUP_VERSION and int(data.get("n_entries", -1)) == len(hist):
+            return Rollup.from_dict(data)
+    except Exception:
+        pass
+    r = Rollup.from_history(hist)
+    save_rollup(path, r)
+    return r
+
+
+def rollup_text(rollup) -> str:
+    return json.dumps(rollup.to_dict(), ensure_ascii=False)
+
+
+def save_rollup(path, rollup):
+    storage.atomic_write_text(Path(path), rollup_text(rollup), durable=False)
+
+
+def clear_rollup(path):
+    Path(path).unlink(missing_ok=True)
+
+
+# =========================================================
+# EMOCIONES POR SEMANA (Bloques 3, 4 y 5)
+# =========================================================
+# Contadores semana → bloque → emoción, normalizados contra el vocabulario de
+# EMOTIONS (sin tildes ni mayúsculas). Lo que no está en el vocabulario cuenta
+# como OTHER_EMOTION. Se actualizan en cada guardado; la vista solo suma semanas.
+# Se persiste en emotions_{uid}.json junto con la firma del vocabulario.
+EMOTIONS_VERSION = 1
+EMOTION_META_KEYS = {
+    3: ("emocion_automatica",),
+    4: ("primaria", "secundaria"),
+    5: ("precisas",),
+}
+OTHER_EMOTION = "Otras"
+
+
+def week_start(d: date) -> date:
+    return d - timedelta(days=d.weekday())
+
+
+def vocabulary_signature(vocabulary: list[str]) -> str:
+    return hashlib.sha1("\n".join(vocabulary).encode("utf-8")).hexdigest()
+
+
+class EmotionRollup:
+    def __init__(self, vocabulary: list[str]):
+        self.vocabulary = list(vocabulary)
+        self.signature = vocabulary_signature(self.vocabulary)
+        self._canon = {}
+        for e in self.vocabulary:
+            self._canon.setdefault(search.strip_accents(e).strip(), e)
+        self.n_entries = 0
+        self.weekly: dict[str, dict[str, dict[str, int]]] = {}  # "YYYY-MM-DD" (lunes) → {"bloque": {emoción: n}}
+
+    def emotions_of(self, entry: dict) -> list[str]:
+        bloque = entry.get("bloque") if isinstance(entry, dict) else None
+        keys = EMOTION_META_KEYS.get(bloque)
+        meta = entry.get("meta") if keys else None
+        if not isinstance(meta, dict):
+            return []
+        out = []
+        for k in keys:
+            value = meta.get(k)
+            if not isinstance(value, str):
+                continue
+            for part in value.split(","):
+                norm = search.strip_accents(part).strip()
+                if norm:
+                    out.append(self._canon.get(norm, OTHER_EMOTION))
+        return out
+
+    @classmethod
+    def from_history(cls, hist, vocabulary: list[str]) -> "EmotionRollup":
+        r = cls(vocabulary)
+        for e in hist:
+            r.add(e)
+        return r
+
+    def add(self, entry: dict):
+        self.n_entries += 1
+        emotions = self.emotions_of(entry)
+        d = entry_day(entry)
+        if not emotions or d is None:
+            return
+        week = self.weekly.setdefault(week_start(d).isoformat(), {})
+        counts = week.setdefault(str(entry.get("bloque")), {})
+        for e in emotions:
+            counts[e] = counts.get(e, 0) + 1
+
+    # ---------- consultas ----------
+    def week_counts(self, start=None, end=None, bloques=None) -> dict[date, dict[str, int]]:
+        keys = None if bloques is None else {str(b) for b in bloques}
+        lo = None if start is None else week_start(start).isoformat()
+        hi = None if end is None else end.isoformat()
+        out: dict[date, dict[str, int]] = {}
+        for week in sorted(self.weekly):
+            if (lo is not None and week < lo) or (hi is not None and week > hi):
+                continue
+            merged: dict[str, int] = {}
+            for b, counts in self.weekly[week].items():
+                if keys is not None and b not in keys:
+                    continue
+                for e, n in counts.items():
+                    merged[e] = merged.get(e, 0) + n
+            if merged:
+                out[date.fromisoformat(week)] = merged
+        return out
+
+    def top_emotions(self, n: int, start=None, end=None, bloques=None) -> list[tuple[str, int]]:
+        totals: dict[str, int] = {}
+        for counts in self.week_counts(start, end, bloques).values():
+            for e, c in counts.items():
+                totals[e] = totals.get(e, 0) + c
+        return sorted(totals.items(), key=lambda kv: (-kv[1], kv[0]))[:n]
+
+    def top_per_week(self, n: int, start=None, end=None, bloques=None) -> list[tuple[date, list[tuple[str, int]]]]:
+        return [
+            (week, sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))[:n])
+            for week, counts in self.week_counts(start, end, bloques).items()
+        ]
+
+    # ---------- persistencia ----------
+    def to_dict(self) -> dict:
+        return {
+            "version": EMOTIONS_VERSION,
+            "signature": self.signature,
+            "n_entries": self.n_entries,
+            "weekly": self.weekly,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, vocabulary: list[str]) -> "EmotionRollup":
+        r = cls(vocabulary)
+        r.n_entries = int(data.get("n_entries", 0))
+        r.weekly = {w: {b: dict(c) for b, c in v.items()} for w, v in (data.get("weekly") or {}).items()}
+        return r
+
+
+def load_emotion_rollup(path, hist: list, vocabulary: list[str]) -> EmotionRollup:
+    # Se reconstruye si falta, si no corresponde al historial o si cambió el vocabulario.
+    path = Path(path)
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+        if (
+            data.get("version") == EMOTIONS_VERSION
+            and data.get("signature") == vocabulary_signature(list(vocabulary))
+            and int(data.get("n_entries", -1)) == len(hist)
+        ):
+            return EmotionRollup.from_dict(data, vocabulary)
+    except Exception:
+        pass
+    r = EmotionRollup.from_history(hist, vocabulary)
+    save_rollup(path, r)
+    return r
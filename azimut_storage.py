@@ -0,0 +1,1160 @@
+import atexit
+import gzip
+import json
+import lzma
+import os
+import queue
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager, suppress
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import azimut_schema as schema
+
+# =========================
+# Bloqueo entre procesos (fcntl; en Windows solo entre hilos)
+# =========================
+FCNTL_AVAILABLE = False
+try:
+    import fcntl  # type: ignore
+
+    FCNTL_AVAILABLE = True
+except Exception:
+    FCNTL_AVAILABLE = False
+
+
+@contextmanager
+def _flock(lock_file: Path):
+    # Exclusivo entre procesos; entre hilos lo pone el llamante (RLock/Lock).
+    if not FCNTL_AVAILABLE:
+        yield
+        return
+    with Path(lock_file).open("a") as fh:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+# =========================================================
+# HISTORIAL EN DISCO: snapshot (JSON) + diario (JSON lines)
+# =========================================================
+# history_{uid}.json   → snapshot completo (lista JSON, formato de siempre)
+# history_{uid}.jsonl  → diario append-only: un registro por línea
+#
+# Guardar un registro solo añade una línea al diario. Cuando el diario crece
+# más de JOURNAL_COMPACT_EVERY líneas se compacta en el snapshot.
+#
+# Compactar es escribir el snapshot y después borrar el diario. El diario empieza
+# con una cabecera {"_journal": id} y el snapshot que lo absorbe guarda ese id
+# ({"journal": id, "entries": [...]}; sin diario sigue siendo una lista). Si la
+# compactación se corta entre los dos pasos, el diario sobrante se reconoce por
+# el id, no por su contenido: dos guardados idénticos son legítimos.
+JOURNAL_COMPACT_EVERY = 200
+_JOURNAL_HEADER = "_journal"
+_SNAPSHOT_HEAD_BYTES = 64
+
+
+def journal_path(history_file: Path) -> Path:
+    return history_file.with_suffix(".jsonl")
+
+
+def _read_snapshot(history_file: Path) -> tuple[list, str | None]:
+    # (registros, id del diario absorbido o None).
+    if not history_file.exists():
+        return [], None
+    try:
+        data = json.loads(history_file.read_text(encoding="utf-8"))
+    except Exception:
+        return [], None
+    if isinstance(data, dict) and isinstance(data.get("entries"), list):
+        return data["entries"], data.get("journal")
+    return (data, None) if isinstance(data, list) else ([], None)
+
+
+def _snapshot_journal_id(history_file: Path) -> str | None:
+    # Solo la cabecera del snapshot: write_history pone "journal" delante.
+    try:
+        with history_file.open("rb") as fh:
+            head = fh.read(_SNAPSHOT_HEAD_BYTES).decode("utf-8", "ignore")
+    except OSError:
+        return None
+    prefix = '{"journal": "'
+    if not head.startswith(prefix):
+        return None
+    end = head.find('"', len(prefix))
+    return head[len(prefix) : end] if end > 0 else None
+
+
+def _journal_id(path: Path) -> str | None:
+    try:
+        with path.open("r", encoding="utf-8") as fh:
+            first = fh.readline()
+    except OSError:
+        return None
+    try:
+        rec = json.loads(first)
+    except Exception:
+        return None
+    return rec.get(_JOURNAL_HEADER) if isinstance(rec, dict) and len(rec) == 1 else None
+
+
+def _read_journal(path: Path) -> list:
+    if not path.exists():
+        return []
+    out = []
+    with path.open("r", encoding="utf-8") as fh:
+        for line in fh:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                out.append(json.loads(line))
+            except Exception:
+                # Línea cortada por una caída a mitad de escritura: se descarta.
+                continue
+    return out
+
+
+# Permisos de los ficheros nuevos (mkstemp los crea 0600): los de siempre según umask.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def atomic_write(path: Path, write, durable: bool = True):
+    # `write(fh)` escribe en un temporal único del mismo directorio que después
+    # sustituye a `path`: escritores concurrentes (sesiones, workers) nunca
+    # comparten temporal y un lector ve el fichero anterior o el nuevo entero.
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            write(fh)
+            if durable:
+                fh.flush()
+                os.fsync(fh.fileno())
+        os.chmod(tmp, 0o666 & ~_UMASK)
+        os.replace(tmp, path)
+    except BaseException:
+        with suppress(OSError):
+            os.unlink(tmp)
+        raise
+
+
+def atomic_write_text(path: Path, text: str, durable: bool = True):
+    data = text.encode("utf-8")
+    atomic_write(path, lambda fh: fh.write(data), durable)
+
+
+def read_history(history_file: Path) -> list:
+    snapshot, absorbed = _read_snapshot(history_file)
+    tail = _read_journal(journal_path(history_file))
+    journal_id = None
+    if tail and isinstance(tail[0], dict) and len(tail[0]) == 1 and _JOURNAL_HEADER in tail[0]:
+        journal_id = tail.pop(0)[_JOURNAL_HEADER]
+    # Compactación interrumpida: el snapshot ya contiene este diario.
+    if absorbed is not None and journal_id == absorbed:
+        tail = []
+    return snapshot + tail
+
+
+def write_history(history_file: Path, hist: list):
+    # Sin indentación: json.dumps(indent=...) usa el codificador en Python puro,
+    # varias veces más lento que el de C con historiales grandes.
+    hist = hist if isinstance(hist, list) else list(hist)
+    jpath = journal_path(history_file)
+    absorbed = _journal_id(jpath)
+    data = hist if absorbed is None else {"journal": absorbed, "entries": hist}
+    atomic_write_text(history_file, json.dumps(data, ensure_ascii=False))
+    jpath.unlink(missing_ok=True)
+
+
+def _write_journal(history_file: Path, lines: list[str]) -> Path:
+    jpath = journal_path(history_file)
+    journal_id = _journal_id(jpath)
+    if journal_id is not None and journal_id == _snapshot_journal_id(history_file):
+        # Sobrante de una compactación cortada: lo nuevo empieza diario nuevo.
+        jpath.unlink()
+    with jpath.open("a", encoding="utf-8") as fh:
+        if fh.tell() == 0:
+            fh.write(json.dumps({_JOURNAL_HEADER: uuid.uuid4().hex}) + "\n")
+        fh.writelines(lines)
+        fh.flush()
+        os.fsync(fh.fileno())
+    return jpath
+
+
+def append_history(history_file: Path, entry: dict, hist: list | None = None):
+    jpath = _write_journal(history_file, [json.dumps(entry, ensure_ascii=False) + "\n"])
+
+    if _journal_lines(jpath) >= JOURNAL_COMPACT_EVERY:
+        compact_history(history_file, hist)
+
+
+def extend_history(history_file: Path, entries: list, hist: list | None = None):
+    # Muchos registros en un solo lote: una apertura y un fsync para todo el diario.
+    if not entries:
+        return
+    jpath = journal_path(history_file)
+    if hist is not None and _journal_lines(jpath) + len(entries) >= JOURNAL_COMPACT_EVERY:
+        # El diario se compactaría enseguida: se escribe directamente el snapshot.
+        write_history(history_file, hist)
+        return
+    _write_journal(history_file, [json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries])
+
+    if _journal_lines(jpath) >= JOURNAL_COMPACT_EVERY:
+        compact_history(history_file, hist)
+
+
+def compact_history(history_file: Path, hist: list | None = None):
+    # `hist` es la lista completa ya en memoria (evita releer el disco).
+    full = hist if hist is not None else read_history(history_file)
+    write_history(history_file, full)
+
+
+def _journal_lines(path: Path) -> int:
+    try:
+        with path.open("rb") as fh:
+            return sum(1 for _ in fh)
+    except FileNotFoundError:
+        return 0
+
+
+# =========================================================
+# ARCHIVO FRÍO (registros antiguos, comprimidos por mes)
+# =========================================================
+# users/ab/<uid>/archive/2023-04.jsonl.gz (o .xz) + archive/manifest.json
+#
+# Desactivado por defecto (reescribe datos al cargar): con
+# AZIMUT_ARCHIVE_AFTER_DAYS > 0, al cargar un historial los meses completos
+# anteriores a esos días se mueven a un segmento comprimido por mes (JSON lines, un miembro
+# gzip/xz por cada tanda añadida) y el historial caliente se reescribe sin
+# ellos. Los segmentos solo se leen cuando se pide ese rango.
+#
+# Orden de escritura (seguro ante caídas): segmentos → manifiesto con
+# `pending` → historial caliente → manifiesto sin `pending`. El manifiesto
+# guarda cuántos registros y bytes válidos tiene cada segmento: lo que haya
+# detrás (una tanda a medias) se ignora y se trunca en la siguiente escritura.
+# Con `pending`, la carga termina el movimiento (quitar del caliente lo anterior).
+ARCHIVE_AFTER_DAYS = int(os.environ.get("AZIMUT_ARCHIVE_AFTER_DAYS", "0"))  # 0 = sin archivo
+ARCHIVE_CODEC = os.environ.get("AZIMUT_ARCHIVE_CODEC", "gzip").strip().lower()
+ARCHIVE_DIR = "archive"
+ARCHIVE_MANIFEST = "manifest.json"
+_ARCHIVE_CODECS = {"gzip": (".jsonl.gz", gzip), "lzma": (".jsonl.xz", lzma)}
+# Ficheros por posición del historial caliente: dejan de valer al archivar.
+POSITIONAL_FILE_PATTERNS = ("search_{uid}.jsonl",)
+
+
+def archive_cutoff(today: date | None = None, after_days: int = ARCHIVE_AFTER_DAYS) -> int | None:
+    # Primer segundo del mes que contiene hoy - after_days: se archivan meses enteros.
+    if after_days <= 0:
+        return None
+    d = (today or date.today()) - timedelta(days=after_days)
+    return int((datetime(d.year, d.month, 1) - datetime(1970, 1, 1)).total_seconds())
+
+
+def _month_of(ts: int) -> str:
+    return schema.ts_to_text(ts)[:7]
+
+
+class ArchiveTier:
+    def __init__(self, user_dir: Path, codec: str = ARCHIVE_CODEC):
+        self.dir = Path(user_dir) / ARCHIVE_DIR
+        self.codec = codec if codec in _ARCHIVE_CODECS else "gzip"
+        self._manifest = None
+        self._manifest_stamp = None
+
+    # ---------- manifiesto ----------
+    def manifest(self) -> dict:
+        # Se relee solo si cambió el fichero (lo consulta cada ejecución de la app).
+        path = self.dir / ARCHIVE_MANIFEST
+        try:
+            info = path.stat()
+            stamp = (info.st_mtime_ns, info.st_size)
+        except OSError:
+            self._manifest, self._manifest_stamp = {"months": {}, "pending": None}, None
+            return self._manifest
+        if stamp != self._manifest_stamp:
+            try:
+                data = json.loads(path.read_text(encoding="utf-8"))
+            except Exception:
+                data = {}
+            self._manifest = {"months": data.get("months") or {}, "pending": data.get("pending")}
+            self._manifest_stamp = stamp
+        return self._manifest
+
+    def _write_manifest(self, manifest: dict):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        atomic_write_text(self.dir / ARCHIVE_MANIFEST, json.dumps(manifest, ensure_ascii=False))
+        self._manifest_stamp = None
+
+    def months(self) -> list[str]:
+        return sorted(self.manifest()["months"])
+
+    def months_between(self, start: date | None, end: date | None) -> list[str]:
+        lo = None if start is None else start.strftime("%Y-%m")
+        hi = None if end is None else end.strftime("%Y-%m")
+        return [m for m in self.months() if (lo is None or m >= lo) and (hi is None or m <= hi)]
+
+    def count(self, months=None) -> int:
+        info = self.manifest()["months"]
+        return sum(info[m]["count"] for m in (info if months is None else months) if m in info)
+
+    def stamp(self, months) -> str:
+        # Identifica el contenido de esos meses (cambia si se añade a un segmento).
+        info = self.manifest()["months"]
+        return ",".join(f"{m}:{info[m]['count']}" for m in months if m in info)
+
+    def pending(self) -> int | None:
+        return self.manifest()["pending"]
+
+    # ---------- lectura ----------
+    def read_month(self, month: str) -> list:
+        info = self.manifest()["months"].get(month)
+        if not info:
+            return []
+        path = self.dir / info["file"]
+        module = gzip if info["file"].endswith(".gz") else lzma
+        out = []
+        try:
+            with path.open("rb") as raw:
+                data = raw.read(info["bytes"])
+            for line in module.decompress(data).decode("utf-8").splitlines():
+                if len(out) >= info["count"]:
+                    break
+                if line.strip():
+                    out.append(json.loads(line))
+        except (OSError, EOFError, ValueError, lzma.LZMAError):
+            pass
+        return out
+
+    def entries(self, months=None):
+        for m in self.months() if months is None else months:
+            yield from self.read_month(m)
+
+    # ---------- escritura ----------
+    def add(self, entries: list, pending: int):
+        # Añade una tanda comprimida por mes y deja el manifiesto con `pending`.
+        by_month: dict[str, list] = {}
+        for e in entries:
+            by_month.setdefault(_month_of(schema.entry_ts(e)), []).append(e)
+        manifest = self.manifest()
+        months = dict(manifest["months"])
+        self.dir.mkdir(parents=True, exist_ok=True)
+        for month, items in sorted(by_month.items()):
+            info = dict(months.get(month) or {})
+            if not info:
+                suffix, _ = _ARCHIVE_CODECS[self.codec]
+                info = {"file": month + suffix, "count": 0, "bytes": 0}
+            module = gzip if info["file"].endswith(".gz") else lzma
+            payload = module.compress("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in items).encode("utf-8"))
+            path = self.dir / info["file"]
+            with path.open("ab") as fh:
+                fh.truncate(info["bytes"])  # restos de una tanda no confirmada
+                fh.write(payload)
+                fh.flush()
+                os.fsync(fh.fileno())
+            info["count"] += len(items)
+            info["bytes"] += len(payload)
+            months[month] = info
+        self._write_manifest({"months": months, "pending": pending})
+
+    def settle(self):
+        manifest = self.manifest()
+        self._write_manifest({"months": manifest["months"], "pending": None})
+
+    def clear(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+        self._manifest_stamp = None
+
+
+def _is_archived(e, cutoff: int) -> bool:
+    ts = schema.entry_ts(e)
+    return ts is not None and ts < cutoff
+
+
+def settle_archive(tier: ArchiveTier, hist: list, replace_hot, cutoff: int | None = None) -> list:
+    # Devuelve el historial caliente: completa un movimiento interrumpido y, si
+    # hay meses enteros más antiguos que `cutoff`, los archiva. `replace_hot(hot)`
+    # reescribe el historial caliente en el backend (`cutoff`: lo anterior ya está archivado).
+    pending = tier.pending()
+    if pending is None and cutoff is not None:
+        old = [e for e in hist if _is_archived(e, cutoff)]
+        if old:
+            tier.add(old, cutoff)
+            pending = cutoff
+    if pending is None:
+        return hist
+    hot = [e for e in hist if not _is_archived(e, pending)]
+    replace_hot(hot, pending)
+    tier.settle()
+    return hot
+
+
+# =========================================================
+# ÍNDICE DE USUARIOS (tamaño, nº de registros, última escritura)
+# =========================================================
+# users_index.jsonl: una línea por escritura, gana la última de cada uid. Se
+# compacta cuando hay más del doble de líneas que usuarios.
+#
+# Varios workers escriben el mismo fichero: añadir y compactar van bajo un flock
+# (users_index.jsonl.lock) y cada proceso lee antes lo que hayan añadido los
+# demás, así que la compactación parte del fichero, no de una vista vieja.
+# `size` solo existe en el backend JSON (en SQLite no hay ficheros por usuario).
+USER_INDEX_FILE = "users_index.jsonl"
+USER_INDEX_MIN_COMPACT = 1000
+
+
+class UserIndex:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._users: dict[str, dict] = {}
+        self._lines = 0
+        self._offset = 0  # bytes ya leídos del fichero
+        self._inode = None
+
+    def _refresh(self) -> dict[str, dict]:
+        # Lee solo lo añadido desde la última vez; todo, si otro proceso lo compactó.
+        try:
+            info = self.path.stat()
+        except FileNotFoundError:
+            self._users, self._lines, self._offset, self._inode = {}, 0, 0, None
+            return self._users
+        if info.st_ino != self._inode or info.st_size < self._offset:
+            self._users, self._lines, self._offset, self._inode = {}, 0, 0, info.st_ino
+        if info.st_size > self._offset:
+            with self.path.open("rb") as fh:
+                fh.seek(self._offset)
+                data = fh.read(info.st_size - self._offset)
+            end = data.rfind(b"\n") + 1  # una línea a medio escribir se lee la próxima vez
+            for line in data[:end].splitlines():
+                self._lines += 1
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(rec, dict) and rec.get("uid"):
+                    self._users[rec["uid"]] = rec
+            self._offset += end
+        return self._users
+
+    def get(self, uid: str) -> dict | None:
+        with self._lock:
+            rec = self._refresh().get(uid)
+            return dict(rec) if rec is not None else None
+
+    def all(self) -> dict[str, dict]:
+        with self._lock:
+            return {uid: dict(rec) for uid, rec in self._refresh().items()}
+
+    def record(self, uid: str, size: int | None, entries: int | None, last_write: str | None = None):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock, _flock(self.path.with_name(self.path.name + ".lock")):
+            users = self._refresh()
+            if entries is None:
+                entries = int((users.get(uid) or {}).get("entries", 0)) + 1
+            rec = {"uid": uid}
+            if size is not None:
+                rec["size"] = int(size)
+            rec["entries"] = int(entries)
+            rec["last_write"] = last_write or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            with self.path.open("a", encoding="utf-8") as fh:
+                fh.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            users = self._refresh()
+            if self._lines > max(USER_INDEX_MIN_COMPACT, 2 * len(users)):
+                text = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in users.values())
+                atomic_write_text(self.path, text)
+                info = self.path.stat()
+                self._lines, self._offset, self._inode = len(users), info.st_size, info.st_ino
+
+
+# =========================================================
+# ESTRUCTURA EN DISCO: una carpeta por usuario, repartidas por prefijo
+# =========================================================
+# data/users/ab/ab12cd34ef56ab78/history_{uid}.json (+ .jsonl, search_, rollup_)
+#
+# La estructura plana anterior (data/history_{uid}.json, ...) se migra en línea:
+# cada usuario se mueve al acceder a él y el resto en segundo plano, por lotes.
+# El movimiento enlaza los ficheros en una carpeta temporal y la renombra de una
+# vez, así que un lector ve o la estructura vieja o la nueva completa.
+USERS_DIR = "users"
+USER_SHARD_CHARS = 2
+USER_FILE_PATTERNS = (
+    "history_{uid}.json",
+    "history_{uid}.jsonl",
+    "search_{uid}.jsonl",
+    "rollup_{uid}.json",
+)
+# Copias en texto plano que la versión anterior escribía en cada visita a MIS
+# RESPUESTAS (el export ya no toca el disco): la migración las borra sin moverlas.
+LEGACY_DROPPED_PATTERNS = ("history_export_{uid}.csv",)
+MIGRATION_BATCH = 200
+MIGRATION_PAUSE_S = 0.05
+
+
+class UserLayout:
+    def __init__(self, data_dir: Path):
+        self.data_dir = Path(data_dir)
+        self.index = UserIndex(self.data_dir / USER_INDEX_FILE)
+        self._locks: dict[str, threading.RLock] = {}
+        self._locks_lock = threading.Lock()
+        self._ready: set[str] = set()
+        self._held: dict[str, int] = {}
+        self._archives: dict[str, ArchiveTier] = {}
+        self._migration_thread = None
+
+    def user_dir(self, uid: str) -> Path:
+        return self.data_dir / USERS_DIR / uid[:USER_SHARD_CHARS] / uid
+
+    def lock(self, uid: str) -> threading.RLock:
+        with self._locks_lock:
+            lk = self._locks.get(uid)
+            if lk is None:
+                lk = self._locks[uid] = threading.RLock()
+            return lk
+
+    @contextmanager
+    def file_lock(self, uid: str):
+        # Exclusión entre hilos (RLock) y entre procesos/réplicas con el mismo
+        # disco (flock sobre history_{uid}.lock). Reentrante dentro del proceso.
+        with self.lock(uid):
+            if self._held.get(uid) or not FCNTL_AVAILABLE:
+                self._held[uid] = self._held.get(uid, 0) + 1
+                try:
+                    yield
+                finally:
+                    self._held[uid] -= 1
+                return
+            with _flock(self.path(uid, f"history_{uid}.lock")):
+                self._held[uid] = 1
+                try:
+                    yield
+                finally:
+                    self._held[uid] = 0
+
+    def path(self, uid: str, name: str) -> Path:
+        # Ruta de un fichero del usuario; la primera vez migra sus ficheros planos.
+        if uid not in self._ready:
+            with self.lock(uid):
+                if uid not in self._ready:
+                    self._migrate_user(uid)
+                    self.user_dir(uid).mkdir(parents=True, exist_ok=True)
+                    self._ready.add(uid)
+        return self.user_dir(uid) / name
+
+    def _legacy_files(self, uid: str) -> list[Path]:
+        paths = (self.data_dir / pattern.format(uid=uid) for pattern in USER_FILE_PATTERNS)
+        return [p for p in paths if p.exists()]
+
+    def _migrate_user(self, uid: str) -> bool:
+        for pattern in LEGACY_DROPPED_PATTERNS:
+            (self.data_dir / pattern.format(uid=uid)).unlink(missing_ok=True)
+        legacy = self._legacy_files(uid)
+        target = self.user_dir(uid)
+        if not legacy:
+            return False
+        if target.is_dir():
+            # Movimiento interrumpido tras el renombrado: solo faltaba borrar los planos.
+            for p in legacy:
+                p.unlink(missing_ok=True)
+            return False
+        tmp = target.with_name(f".{uid}.tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        for p in legacy:
+            try:
+                os.link(p, tmp / p.name)
+            except OSError:
+                shutil.copy2(p, tmp / p.name)
+        os.replace(tmp, target)
+        for p in legacy:
+            p.unlink(missing_ok=True)
+        history_file = target / f"history_{uid}.json"
+        if history_file.exists() or journal_path(history_file).exists():
+            self.record_write(uid, history_file, len(read_history(history_file)))
+        return True
+
+    def archive(self, uid: str) -> ArchiveTier:
+        with self._locks_lock:
+            tier = self._archives.get(uid)
+            if tier is None:
+                tier = self._archives[uid] = ArchiveTier(self.user_dir(uid))
+            return tier
+
+    def drop_positional(self, uid: str):
+        for pattern in POSITIONAL_FILE_PATTERNS:
+            (self.user_dir(uid) / pattern.format(uid=uid)).unlink(missing_ok=True)
+
+    def record_write(self, uid: str, history_file: Path, entries: int | None):
+        size = 0
+        for p in (history_file, journal_path(history_file)):
+            try:
+                size += p.stat().st_size
+            except OSError:
+                pass
+        self.index.record(uid, size, entries)
+
+    def legacy_uids(self) -> set[str]:
+        uids = set()
+        for pattern in USER_FILE_PATTERNS + LEGACY_DROPPED_PATTERNS:
+            prefix, suffix = pattern.split("{uid}")
+            for p in self.data_dir.glob(prefix + "*" + suffix):
+                uid = p.name[len(prefix) : len(p.name) - len(suffix)]
+                if uid:
+                    uids.add(uid)
+        return uids
+
+    def uids(self) -> set[str]:
+        sharded = {p.name for p in (self.data_dir / USERS_DIR).glob("*/*") if p.is_dir() and not p.name.startswith(".")}
+        return sharded | self.legacy_uids()
+
+    def migrate_all(self, batch: int = MIGRATION_BATCH, pause: float = MIGRATION_PAUSE_S) -> int:
+        # Mueve todos los usuarios planos, por lotes y con pausas para no competir con la app.
+        moved = 0
+        for i, uid in enumerate(sorted(self.legacy_uids())):
+            with self.lock(uid):
+                if self._migrate_user(uid):
+                    moved += 1
+            if pause and (i + 1) % batch == 0:
+                time.sleep(pause)
+        return moved
+
+    def start_migration(self):
+        if self._migration_thread is not None or not self.legacy_uids():
+            return
+        self._migration_thread = threading.Thread(target=self.migrate_all, name="azimut-layout-migration", daemon=True)
+        self._migration_thread.start()
+
+
+# =========================================================
+# DETECCIÓN DE CAMBIOS (otra sesión, otro worker, otra réplica)
+# =========================================================
+# Cada store expone una versión barata del historial en disco (stat de los
+# ficheros en JSON, contador por uid en SQLite). Se anota la versión vista al
+# cargar y la que deja cada escritura propia; si la de disco es otra, alguien
+# más ha escrito y hay que recargar antes de seguir.
+class SeenVersions:
+    def __init__(self):
+        self._seen: dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def loaded(self, uid: str, version):
+        with self._lock:
+            self._seen[uid] = version
+
+    def wrote(self, uid: str, before, after):
+        # Solo se adelanta si lo anterior ya era conocido: si otro escribió entre
+        # medias, el cambio ajeno sigue detectándose.
+        with self._lock:
+            if uid in self._seen and self._seen[uid] == before:
+                self._seen[uid] = after
+
+    def changed(self, uid: str, version) -> bool:
+        with self._lock:
+            return uid in self._seen and self._seen[uid] != version
+
+
+# =========================================================
+# BACKENDS: JSON (por defecto) o SQLite
+# =========================================================
+class JsonHistoryStore:
+    def __init__(self, data_dir: Path, archive_after_days: int = ARCHIVE_AFTER_DAYS):
+        self.data_dir = Path(data_dir)
+        self.layout = UserLayout(self.data_dir)
+        self.versions = SeenVersions()
+        self.archive_after_days = archive_after_days
+
+    def user_path(self, uid: str, name: str) -> Path:
+        return self.layout.path(uid, name)
+
+    def history_file(self, uid: str) -> Path:
+        return self.user_path(uid, f"history_{uid}.json")
+
+    def disk_version(self, uid: str) -> tuple:
+        # (mtime_ns, tamaño) de snapshot y diario: dos stat, sin leer el contenido.
+        path = self.history_file(uid)
+        out = []
+        for p in (path, journal_path(path)):
+            try:
+                info = p.stat()
+                out.append((info.st_mtime_ns, info.st_size))
+            except OSError:
+                out.append(None)
+        return tuple(out)
+
+    def changed(self, uid: str) -> bool:
+        return self.versions.changed(uid, self.disk_version(uid))
+
+    @contextmanager
+    def _writing(self, uid: str):
+        with self.layout.file_lock(uid):
+            before = self.disk_version(uid)
+            yield self.history_file(uid)
+            self.versions.wrote(uid, before, self.disk_version(uid))
+
+    def _own(self, uid: str, hist):
+        # El historial en memoria solo sirve para compactar si nadie más ha escrito.
+        return hist if hist is not None and not self.changed(uid) else None
+
+    def archive(self, uid: str) -> ArchiveTier:
+        return self.layout.archive(uid)
+
+    def load(self, uid: str) -> list:
+        # Solo el historial caliente; lo antiguo pasa al archivo por meses.
+        with self.layout.file_lock(uid):
+            path = self.history_file(uid)
+            cutoff = archive_cutoff(after_days=self.archive_after_days)
+            hist = settle_archive(self.archive(uid), read_history(path), lambda hot, _: self._replace_hot(uid, hot), cutoff)
+            self.versions.loaded(uid, self.disk_version(uid))
+            return hist
+
+    def _replace_hot(self, uid: str, hot: list):
+        path = self.history_file(uid)
+        write_history(path, hot)
+        self.layout.drop_positional(uid)
+        self.layout.record_write(uid, path, len(hot))
+
+    def save(self, uid: str, hist: list):
+        # Reemplaza el historial completo, archivo incluido (p. ej. al limpiarlo).
+        with self._writing(uid) as path:
+            write_history(path, hist)
+            self.archive(uid).clear()
+            self.layout.record_write(uid, path, len(hist))
+
+    def append(self, uid: str, entry: dict, hist: list | None = None):
+        with self._writing(uid) as path:
+            own = self._own(uid, hist)
+            append_history(path, entry, own)
+            self.layout.record_write(uid, path, len(own) if own is not None else None)
+
+    def extend(self, uid: str, entries: list, hist: list | None = None, n_entries: int | None = None):
+        # Sin `hist` (escritor en segundo plano) la compactación relee el disco.
+        with self._writing(uid) as path:
+            own = self._own(uid, hist)
+            extend_history(path, entries, own)
+            self.layout.record_write(uid, path, len(own) if own is not None else n_entries)
+
+
+SQLITE_FILE = "azimut.sqlite3"
+SQLITE_POOL_SIZE = 4
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    uid TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    bloque INTEGER,
+    fecha TEXT,
+    concepto TEXT,
+    respuesta TEXT,
+    meta TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_entries_uid_ts ON entries (uid, timestamp);
+CREATE INDEX IF NOT EXISTS idx_entries_uid_bloque ON entries (uid, bloque);
+CREATE TABLE IF NOT EXISTS migrated_json (
+    uid TEXT PRIMARY KEY,
+    migrated_at TEXT NOT NULL DEFAULT (datetime('now'))
+);
+CREATE TABLE IF NOT EXISTS versions (
+    uid TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+"""
+
+_ENTRY_COLS = ("timestamp", "bloque", "fecha", "concepto", "respuesta", "meta")
+
+
+class SQLiteHistoryStore:
+    def __init__(self, db_path: Path, pool_size: int = SQLITE_POOL_SIZE, archive_after_days: int = ARCHIVE_AFTER_DAYS):
+        self.db_path = Path(db_path)
+        self.archive_after_days = archive_after_days
+        # Los ficheros auxiliares por usuario (índice de búsqueda, resumen) viven
+        # en la misma estructura por prefijo que el backend JSON.
+        self.layout = UserLayout(self.db_path.parent)
+        self.versions = SeenVersions()
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        with self.connection() as con:
+            con.executescript(_SQLITE_SCHEMA)
+
+    def user_path(self, uid: str, name: str) -> Path:
+        return self.layout.path(uid, name)
+
+    def _connect(self):
+        con = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=30)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        return con
+
+    @contextmanager
+    def connection(self):
+        # Conexiones reutilizables: se toman del pool y se devuelven al salir.
+        try:
+            con = self._pool.get_nowait()
+        except queue.Empty:
+            con = self._connect()
+        try:
+            yield con
+            con.commit()
+        except BaseException:
+            con.rollback()
+            raise
+        finally:
+            try:
+                self._pool.put_nowait(con)
+            except queue.Full:
+                con.close()
+
+    @staticmethod
+    def _row_to_entry(row) -> dict:
+        ts, bloque, fecha, concepto, respuesta, meta = row
+        try:
+            meta = json.loads(meta) if meta else {}
+        except Exception:
+            meta = {}
+        return {
+            "timestamp": ts,
+            "bloque": bloque,
+            "fecha": fecha or "",
+            "concepto": concepto,
+            "respuesta": respuesta or "",
+            "meta": meta,
+        }
+
+    @staticmethod
+    def _entry_to_row(uid: str, e: dict) -> tuple:
+        bloque = e.get("bloque")
+        return (
+            uid,
+            schema.entry_timestamp(e),
+            int(bloque) if bloque is not None else None,
+            e.get("fecha") or "",
+            e.get("concepto"),
+            e.get("respuesta") or "",
+            json.dumps(e.get("meta") or {}, ensure_ascii=False),
+        )
+
+    @staticmethod
+    def _version(con, uid: str) -> int:
+        row = con.execute("SELECT version FROM versions WHERE uid = ?", (uid,)).fetchone()
+        return row[0] if row else 0
+
+    def _bump_version(self, con, uid: str):
+        # En la misma transacción que la escritura (ya con el bloqueo de escritura tomado).
+        con.execute(
+            "INSERT INTO versions (uid, version) VALUES (?, 1) ON CONFLICT(uid) DO UPDATE SET version = version + 1",
+            (uid,),
+        )
+        after = self._version(con, uid)
+        self.versions.wrote(uid, after - 1, after)
+
+    def disk_version(self, uid: str) -> int:
+        with self.connection() as con:
+            return self._version(con, uid)
+
+    def changed(self, uid: str) -> bool:
+        return self.versions.changed(uid, self.disk_version(uid))
+
+    def archive(self, uid: str) -> ArchiveTier:
+        return self.layout.archive(uid)
+
+    def load(self, uid: str) -> list:
+        # El bloqueo de fichero evita que dos workers archiven a la vez el mismo usuario.
+        with self.layout.file_lock(uid):
+            with self.connection() as con:
+                # Lectura y versión en la misma transacción (misma instantánea WAL).
+                con.execute("BEGIN")
+                rows = con.execute(
+                    f"SELECT {', '.join(_ENTRY_COLS)} FROM entries WHERE uid = ? ORDER BY timestamp, id",
+                    (uid,),
+                ).fetchall()
+                self.versions.loaded(uid, self._version(con, uid))
+                max_id = con.execute("SELECT MAX(id) FROM entries WHERE uid = ?", (uid,)).fetchone()[0] or 0
+            hist = [self._row_to_entry(r) for r in rows]
+            cutoff = archive_cutoff(after_days=self.archive_after_days)
+            return settle_archive(self.archive(uid), hist, lambda _, c: self._drop_archived(uid, c, max_id), cutoff)
+
+    def _drop_archived(self, uid: str, cutoff: int, max_id: int):
+        # Solo filas ya leídas (y archivadas): un INSERT concurrente no se pierde.
+        with self.connection() as con:
+            con.execute(
+                "DELETE FROM entries WHERE uid = ? AND id <= ? AND length(timestamp) = 19 AND timestamp < ?",
+                (uid, max_id, schema.ts_to_text(cutoff)),
+            )
+            self._bump_version(con, uid)
+        self.layout.drop_positional(uid)
+
+    def save(self, uid: str, hist: list):
+        # Reemplaza el historial completo, archivo incluido (p. ej. al limpiarlo).
+        with self.connection() as con:
+            con.execute("DELETE FROM entries WHERE uid = ?", (uid,))
+            self._insert_many(con, uid, hist)
+            self._bump_version(con, uid)
+        self.archive(uid).clear()
+        self.layout.index.record(uid, None, len(hist))
+
+    def append(self, uid: str, entry: dict, hist: list | None = None):
+        with self.connection() as con:
+            self._insert_many(con, uid, [entry])
+            self._bump_version(con, uid)
+        self.layout.index.record(uid, None, len(hist) if hist is not None else None)
+
+    def extend(self, uid: str, entries: list, hist: list | None = None, n_entries: int | None = None):
+        # Una sola transacción para todo el lote.
+        with self.connection() as con:
+            self._insert_many(con, uid, entries)
+            self._bump_version(con, uid)
+        self.layout.index.record(uid, None, len(hist) if hist is not None else n_entries)
+
+    def _insert_many(self, con, uid: str, entries):
+        con.executemany(
+            "INSERT INTO entries (uid, timestamp, bloque, fecha, concepto, respuesta, meta) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (self._entry_to_row(uid, e) for e in entries if isinstance(e, dict)),
+        )
+
+    # ---------- filtros en SQL (sin cargar el historial) ----------
+    # La app filtra en memoria con HistoryQueryIndex porque ya tiene el historial
+    # caliente cargado (búsqueda, resúmenes); estas consultas usan los índices
+    # (uid, timestamp) y (uid, bloque) para quien no lo tenga.
+    def bounds(self, uid: str):
+        # (primer timestamp, último timestamp, bloques presentes) sin cargar registros.
+        with self.connection() as con:
+            lo, hi = con.execute("SELECT MIN(timestamp), MAX(timestamp) FROM entries WHERE uid = ?", (uid,)).fetchone()
+            bloques = [
+                r[0]
+                for r in con.execute(
+                    "SELECT DISTINCT bloque FROM entries WHERE uid = ? AND bloque IS NOT NULL ORDER BY bloque", (uid,)
+                )
+            ]
+        return lo, hi, bloques
+
+    def query(self, uid: str, start=None, end=None, bloques=None) -> list:
+        # `start`/`end` son fechas (inclusive); el timestamp "YYYY-MM-DD HH:MM:SS"
+        # ordena lexicográficamente, así que el rango usa el índice (uid, timestamp).
+        sql = f"SELECT {', '.join(_ENTRY_COLS)} FROM entries WHERE uid = ?"
+        args: list = [uid]
+        if start is not None:
+            sql += " AND timestamp >= ?"
+            args.append(start.isoformat())
+        if end is not None:
+            sql += " AND timestamp < ?"
+            args.append((end + timedelta(days=1)).isoformat())
+        if bloques is not None:
+            bloques = [int(b) for b in bloques]
+            if not bloques:
+                return []
+            sql += f" AND bloque IN ({', '.join('?' * len(bloques))})"
+            args.extend(bloques)
+        sql += " ORDER BY timestamp, id"
+        with self.connection() as con:
+            rows = con.execute(sql, args).fetchall()
+        return [self._row_to_entry(r) for r in rows]
+
+    def migrate_json(self, layout: UserLayout) -> int:
+        # Migración única desde history_*.json (+ diario), en estructura plana o
+        # por prefijo. No borra los JSON.
+        migrated = 0
+        with self.connection() as con:
+            done = {r[0] for r in con.execute("SELECT uid FROM migrated_json")}
+        for uid in sorted(layout.uids() - done):
+            history_file = layout.path(uid, f"history_{uid}.json")
+            hist = read_history(history_file)
+            with self.connection() as con:
+                self._insert_many(con, uid, hist)
+                self._bump_version(con, uid)
+                con.execute("INSERT INTO migrated_json (uid) VALUES (?)", (uid,))
+            migrated += 1
+        return migrated
+
+
+# =========================================================
+# ESCRITURA EN SEGUNDO PLANO (write-behind)
+# =========================================================
+# Un hilo por proceso vacía una cola acotada de escrituras. Lo que se acumula
+# mientras escribe se agrupa en un solo lote:
+#   - registros nuevos del mismo uid → un extend (una escritura, un fsync)
+#   - un `save` completo anula los registros pendientes anteriores de ese uid
+#   - ficheros derivados (resúmenes) → gana el último contenido, temp + rename
+#   - líneas añadidas a un mismo fichero (índice de búsqueda) → un solo fsync
+# Cada escritura devuelve un WriteTicket: la interfaz espera la confirmación
+# de durabilidad con un tiempo máximo y sigue adelante si no llega.
+WRITE_QUEUE_MAX = 1000
+WRITE_BATCH_MAX = 500
+WRITE_COALESCE_S = 0.01  # espera breve para juntar ráfagas tras el primer evento
+
+
+class WriteTicket:
+    __slots__ = ("_done", "error")
+
+    def __init__(self):
+        self._done = threading.Event()
+        self.error: BaseException | None = None
+
+    def _finish(self, error: BaseException | None = None):
+        self.error = error
+        self._done.set()
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        # True si ya está en disco (o ha fallado: ver `error`).
+        return self._done.wait(timeout)
+
+
+def _append_text_fsync(path: Path, text: str):
+    with Path(path).open("a", encoding="utf-8") as fh:
+        fh.write(text)
+        fh.flush()
+        os.fsync(fh.fileno())
+
+
+class WriteBehind:
+    def __init__(self, store, threaded: bool = True, max_pending: int = WRITE_QUEUE_MAX):
+        self.store = store
+        self.threaded = threaded
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.failures = 0
+        self.last_error: BaseException | None = None
+        # Escrituras de historial encoladas y sin terminar, por uid: mientras
+        # haya alguna, un cambio en disco puede ser nuestro (ver `pending`).
+        self._pending: dict[str, int] = {}
+        self._pending_lock = threading.Lock()
+
+    # ---------- encolado ----------
+    def append(self, uid: str, entries: list, n_entries: int | None = None) -> WriteTicket:
+        # `n_entries`: longitud del historial tras añadirlos (para el índice de usuarios).
+        return self._submit(("append", uid, list(entries), n_entries))
+
+    def save(self, uid: str, hist) -> WriteTicket:
+        # Copia: el historial en memoria puede seguir cambiando antes de escribirse.
+        return self._submit(("save", uid, list(hist), None))
+
+    def write_text(self, path: Path, text: str) -> WriteTicket:
+        return self._submit(("write", Path(path), text, None))
+
+    def append_text(self, path: Path, text: str) -> WriteTicket:
+        return self._submit(("lines", Path(path), text, None))
+
+    def pending(self, uid: str) -> bool:
+        # El fichero cambia antes de que el store anote la versión escrita: hasta
+        # que termina la escritura, `store.changed(uid)` no distingue la propia.
+        with self._pending_lock:
+            return self._pending.get(uid, 0) > 0
+
+    def _track(self, uid: str, delta: int):
+        with self._pending_lock:
+            n = self._pending.get(uid, 0) + delta
+            if n > 0:
+                self._pending[uid] = n
+            else:
+                self._pending.pop(uid, None)
+
+    def drain(self, timeout: float | None = None) -> bool:
+        # Espera a que todo lo encolado hasta ahora esté escrito (p. ej. antes de leer del disco).
+        if not self.threaded or self._thread is None:
+            return True
+        return self._submit(("barrier", None, None, None)).wait(timeout)
+
+    def _submit(self, op) -> WriteTicket:
+        ticket = WriteTicket()
+        if op[0] in ("append", "save"):
+            self._track(op[1], 1)
+        if not self.threaded:
+            self._run([(op, ticket)])
+            return ticket
+        self._ensure_thread()
+        # Cola llena: se bloquea (contrapresión) en lugar de crecer sin límite.
+        self._queue.put((op, ticket))
+        return ticket
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="azimut-write-behind", daemon=True)
+                self._thread.start()
+                atexit.register(self.drain, 10)
+
+    # ---------- hilo escritor ----------
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + WRITE_COALESCE_S
+            while len(batch) < WRITE_BATCH_MAX:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            self._run(batch)
+
+    def _run(self, batch):
+        # Agrupa el lote conservando el orden por uid / fichero y escribe cada grupo una vez.
+        histories: dict[str, dict] = {}
+        files: dict[Path, tuple[str, list]] = {}
+        lines: dict[Path, tuple[list, list]] = {}
+        barriers = []
+        for (kind, key, payload, n_entries), ticket in batch:
+            if kind in ("append", "save"):
+                h = histories.setdefault(key, {"save": None, "entries": [], "n": None, "tickets": []})
+                if kind == "save":
+                    h["save"], h["entries"], h["n"] = payload, [], len(payload)
+                else:
+                    h["entries"].extend(payload)
+                    if n_entries is not None:
+                        h["n"] = n_entries
+                h["tickets"].append(ticket)
+            elif kind == "write":
+                prev = files.get(key)
+                files[key] = (payload, (prev[1] if prev else []) + [ticket])
+            elif kind == "lines":
+                chunks, tickets = lines.setdefault(key, ([], []))
+                chunks.append(payload)
+                tickets.append(ticket)
+            else:
+                barriers.append(ticket)
+
+        groups = [(self._write_history, uid, h, h["tickets"]) for uid, h in histories.items()]
+        groups += [(_append_text_fsync, path, "".join(chunks), tickets) for path, (chunks, tickets) in lines.items()]
+        groups += [(atomic_write_text, path, text, tickets) for path, (text, tickets) in files.items()]
+        for fn, key, payload, tickets in groups:
+            error = None
+            try:
+                fn(key, payload)
+            except Exception as exc:  # el hilo no puede morir: el error viaja en el ticket
+                error = exc
+                self.failures += 1
+                self.last_error = exc
+            for t in tickets:
+                t._finish(error)
+        for t in barriers:
+            t._finish()
+
+    def _write_history(self, uid: str, h: dict):
+        try:
+            if h["save"] is not None:
+                self.store.save(uid, h["save"])
+            if h["entries"]:
+                self.store.extend(uid, h["entries"], None, h["n"])
+        finally:
+            self._track(uid, -len(h["tickets"]))
+
+
+def open_store(backend: str, data_dir: Path, archive_after_days: int = ARCHIVE_AFTER_DAYS):
+    backend = (backend or "json").strip().lower()
+    if backend == "sqlite":
+        store = SQLiteHistoryStore(Path(data_dir) / SQLITE_FILE, archive_after_days=archive_after_days)
+        store.migrate_json(store.layout)
+    else:
+        store = JsonHistoryStore(data_dir, archive_after_days=archive_after_days)
+    store.layout.start_migration()
+    return store
@@ -0,0 +1,226 @@
+import argparse
+import hashlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+# El archivo frío reescribe el historial al cargar: fuera de las mediciones
+# (se mide aparte en bench_archive) y también en los reruns con AppTest.
+os.environ["AZIMUT_ARCHIVE_AFTER_DAYS"] = "0"
+
+import azimut_cache as cache  # noqa: E402
+import azimut_export as export  # noqa: E402
+import azimut_frames as frames  # noqa: E402
+import azimut_query as query  # noqa: E402
+import azimut_schema as schema  # noqa: E402
+import azimut_storage as storage  # noqa: E402
+from synthetic import synthetic_history  # noqa: E402
+
+# =========================================================
+# BENCHMARKS: almacenamiento, DataFrame, filtros, export, reruns
+# =========================================================
+# Uso:
+#   python benchmarks/run_benchmarks.py --sizes 100,1000,10000 --output bench.json
+#   python benchmarks/run_benchmarks.py --compare bench_antes.json --output bench_despues.json
+BENCH_EMAIL = "bench@azimut.local"
+BENCH_KEY = "clave-benchmark"
+ARCHIVE_BENCH_DAYS = 365
+
+
+def bench_uid() -> str:
+    # Igual que _hash_identity() en streamlit_app.py.
+    raw = f"{BENCH_EMAIL.strip().lower()}:{BENCH_KEY.strip()}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def timed(fn, repeat: int, setup=None) -> list[float]:
+    out = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        out.append(time.perf_counter() - t0)
+    return out
+
+
+def bench_storage(hist: list, data_dir: Path, repeat: int) -> dict:
+    uid = bench_uid()
+    res = {}
+    json_store = storage.JsonHistoryStore(data_dir, archive_after_days=0)
+    res["json_save_full"] = timed(lambda: json_store.save(uid, hist), repeat)
+    res["json_load"] = timed(lambda: json_store.load(uid), repeat)
+
+    extra = synthetic_history(50, seed=7)
+
+    def append_50():
+        for e in extra:
+            json_store.append(uid, e)
+
+    res["json_append_50"] = timed(append_50, repeat, setup=lambda: json_store.save(uid, hist))
+    json_store.save(uid, hist)
+
+    sql_store = storage.SQLiteHistoryStore(data_dir / "bench.sqlite3", archive_after_days=0)
+    res["sqlite_save_full"] = timed(lambda: sql_store.save(uid, hist), repeat)
+    res["sqlite_load"] = timed(lambda: sql_store.load(uid), repeat)
+    res["sqlite_append_50"] = timed(lambda: [sql_store.append(uid, e) for e in extra], repeat)
+    last = schema.entry_day(hist[-1])
+    res["sqlite_query_30d"] = timed(lambda: sql_store.query(uid, last - timedelta(days=30), last, range(1, 10)), repeat)
+    res["sqlite_query_bloque"] = timed(lambda: sql_store.query(uid, bloques=[4]), repeat)
+    return res
+
+
+def bench_archive(hist: list, data_dir: Path, repeat: int) -> dict:
+    # Primera carga con archivo (mueve los meses antiguos) y carga posterior
+    # (solo el caliente), en un directorio propio.
+    uid = bench_uid()
+    res = {}
+    store = storage.JsonHistoryStore(data_dir / "archive_bench", archive_after_days=ARCHIVE_BENCH_DAYS)
+    res["json_load_archiving"] = timed(lambda: store.load(uid), repeat, setup=lambda: store.save(uid, hist))
+    res["json_load_archived"] = timed(lambda: store.load(uid), repeat)
+    res["archive_read_all"] = timed(lambda: sum(1 for _ in store.archive(uid).entries()), repeat)
+    return res
+
+
+def bench_frames(hist: list, repeat: int) -> dict:
+    # Mismo camino que "Mis respuestas": índice de consultas → página → DataFrame.
+    res = {}
+    res["history_df"] = timed(lambda: frames.add_date_columns(frames.entries_df(hist)), repeat)
+    columnar = cache.ColumnarHistory.from_entries(hist)
+    res["query_index_build"] = timed(lambda: query.HistoryQueryIndex.from_history(columnar), repeat)
+    qidx = query.HistoryQueryIndex.from_history(columnar)
+    lo, hi = qidx.bounds()
+    bloques = list(range(1, 10))
+
+    def page(start, limit):
+        positions = qidx.query(start, hi, bloques, limit=limit).positions
+        return frames.add_date_columns(frames.entries_df([columnar[i] for i in positions]))
+
+    res["query_30d"] = timed(lambda: page(hi - timedelta(days=30), None), repeat)
+    res["query_page_50"] = timed(lambda: page(lo, 50), repeat)
+    dff = frames.add_date_columns(frames.entries_df([columnar[i] for i in qidx.query(lo, hi, bloques).all_positions()]))
+    res["export_csv"] = timed(lambda: export.export_bytes(export.frame_chunks(dff), "CSV"), repeat)
+    res["export_jsonl"] = timed(lambda: export.export_bytes(export.frame_chunks(dff), "JSONL"), repeat)
+    return res
+
+
+def bench_apptest(hist: list, data_dir: Path, repeat: int) -> dict:
+    # Reruns completos de la app con Streamlit AppTest (mismo DATA_DIR relativo).
+    from streamlit.testing.v1 import AppTest
+
+    storage.JsonHistoryStore(data_dir).save(bench_uid(), hist)
+    res = {}
+    cwd = os.getcwd()
+    os.chdir(data_dir.parent)
+    try:
+        for page in ["Bloque 3: Arquitectura Emocional", "📊 MIS RESPUESTAS"]:
+            at = AppTest.from_file(str(ROOT / "streamlit_app.py"), default_timeout=600)
+            at.run()
+            at.sidebar.text_input[0].input(BENCH_EMAIL)
+            at.sidebar.text_input[1].input(BENCH_KEY)
+            at.run()
+            at.sidebar.radio[0].set_value(page)
+            t0 = time.perf_counter()
+            at.run()
+            first = time.perf_counter() - t0
+            if at.exception:
+                raise RuntimeError(f"AppTest {page}: {at.exception}")
+            name = "apptest_bloque3" if page.startswith("Bloque") else "apptest_mis_respuestas"
+            res[f"{name}_first"] = [first]
+            res[f"{name}_rerun"] = timed(at.run, repeat)
+    finally:
+        os.chdir(cwd)
+    return res
+
+
+def git_rev() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def run(sizes: list[int], repeat: int, apptest_max: int) -> dict:
+    results = []
+    for n in sizes:
+        print(f"· {n} registros", flush=True)
+        hist = synthetic_history(n)
+        with tempfile.TemporaryDirectory() as tmp:
+            data_dir = Path(tmp) / "data"
+            data_dir.mkdir()
+            groups = [bench_storage(hist, data_dir, repeat), bench_archive(hist, data_dir, repeat), bench_frames(hist, repeat)]
+            if n <= apptest_max:
+                groups.append(bench_apptest(hist, data_dir, repeat))
+        for group in groups:
+            for name, times in group.items():
+                results.append(
+                    {
+                        "name": name,
+                        "size": n,
+                        "repeat": len(times),
+                        "min_s": min(times),
+                        "median_s": statistics.median(times),
+                    }
+                )
+                print(f"    {name:<32} {min(times) * 1000:10.2f} ms", flush=True)
+
+    try:
+        import pandas
+        import streamlit
+
+        versions = {"pandas": pandas.__version__, "streamlit": streamlit.__version__}
+    except Exception:
+        versions = {}
+    return {
+        "meta": {
+            "git_rev": git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "versions": versions,
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def compare(old: dict, new: dict):
+    prev = {(r["name"], r["size"]): r for r in old.get("results", [])}
+    print(f"\n{'benchmark':<32} {'n':>8} {'antes ms':>11} {'ahora ms':>11} {'ratio':>7}")
+    for r in new["results"]:
+        o = prev.get((r["name"], r["size"]))
+        if o is None:
+            continue
+        ratio = r["min_s"] / o["min_s"] if o["min_s"] else float("inf")
+        flag = "  ⚠" if ratio > 1.2 else ""
+        print(f"{r['name']:<32} {r['size']:>8} {o['min_s'] * 1000:>11.2f} {r['min_s'] * 1000:>11.2f} {ratio:>7.2f}{flag}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmarks de Azimut con historiales sintéticos.")
+    ap.add_argument("--sizes", default="100,1000,10000,100000", help="Tamaños separados por comas (hasta 1000000).")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--apptest-max", type=int, default=10000, help="Tamaño máximo para los reruns con AppTest (0 = omitir).")
+    ap.add_argument("--output", default="bench_results.json")
+    ap.add_argument("--compare", help="Resultados previos (JSON) con los que comparar.")
+    args = ap.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    data = run(sizes, args.repeat, args.apptest_max)
+    Path(args.output).write_text(json.dumps(data, indent=2), encoding="utf-8")
+    print(f"\nResultados en {args.output}")
+    if args.compare:
+        compare(json.loads(Path(args.compare).read_text(encoding="utf-8")), data)
+
+
+if __name__ == "__main__":
+    main()
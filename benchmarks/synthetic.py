@@ -0,0 +1,88 @@
+import random
+from datetime import datetime, timedelta
+
+# =========================================================
+# HISTORIALES SINTÉTICOS (los 9 bloques, meta realista)
+# =========================================================
+_SITUACIONES = [
+    "Reunión con el equipo", "Discusión en casa", "Correo del banco", "Llamada de mi madre",
+    "Atasco de camino al trabajo", "Entrega con poco margen", "Comentario en redes", "Revisión médica",
+]
+_EMOCIONES = ["Miedo", "Tristeza", "Ira", "Alegría", "Vergüenza", "Culpa", "Calma", "Ilusión", "Sorpresa", "Asco"]
+_PRECISAS = ["Frustración", "Inquietud", "Desánimo", "Alivio", "Rabia", "Nostalgia", "Orgullo", "Ansiedad"]
+_SESGOS = [
+    "Sesgo de confirmación", "Sesgo de negatividad", "Heurística de disponibilidad",
+    "Efecto anclaje", "Falacia de los costes hundidos", "Ilusión de control",
+]
+_FRASES = [
+    "Lo vi con más distancia y decidí esperar antes de responder.",
+    "Me di cuenta de que estaba anticipando lo peor sin datos.",
+    "Respiré, nombré lo que sentía y bajó la intensidad.",
+    "No era para tanto: era cansancio acumulado.",
+    "Pedí ayuda en lugar de cargar con todo.",
+]
+
+
+def _phrase(rng: random.Random) -> str:
+    return " ".join(rng.sample(_FRASES, rng.randint(1, 3)))
+
+
+def synthetic_entry(rng: random.Random, bloque: int, ts: datetime) -> dict:
+    sit = rng.choice(_SITUACIONES)
+    fecha = (ts - timedelta(days=rng.choice([0, 0, 0, 1]))).strftime("%d/%m/%Y")
+    if bloque == 1:
+        concepto, resp, meta = "Vía negativa — Resta del día", f"Dejar de {rng.choice(['mirar el móvil', 'quejarme', 'posponer'])}", {}
+    elif bloque == 2:
+        d = rng.choice(["Aproximación", "Retirada"])
+        concepto, resp, meta = f"Dirección conductual — {d}", d, {"situacion": sit, "utilidad": _phrase(rng)}
+    elif bloque == 3:
+        concepto, resp = "Arquitectura emocional — Registro", sit
+        meta = {
+            "emocion_automatica": rng.choice(_EMOCIONES),
+            "sentimiento": rng.choice(_PRECISAS),
+            "estado_animo": rng.choice(["Tranquilo", "Nublado", "Tenso"]),
+            "energia": rng.choice(["Alto", "Medio", "Bajo"]),
+        }
+    elif bloque == 4:
+        concepto, resp = f"Raíz y rama — {sit}", _phrase(rng)
+        meta = {"primaria": rng.choice(_EMOCIONES), "secundaria": rng.choice(_PRECISAS), "pensamiento": _phrase(rng)}
+    elif bloque == 5:
+        concepto, resp = f"Precisión emocional — {sit}", _phrase(rng)
+        meta = {"antes": "Mal", "precisas": ", ".join(rng.sample(_PRECISAS, rng.randint(2, 5))), "cuerpo": "Pecho"}
+    elif bloque == 6:
+        sesgo = rng.choice(_SESGOS)
+        concepto, resp = f"Sesgo — {sesgo}", _phrase(rng)
+        meta = {"situacion": sit, "pensamiento": _phrase(rng), "alternativa": resp}
+    elif bloque == 7:
+        concepto, resp, meta = "Abogado del diablo — Nunca me sale nada bien", _phrase(rng), {"evidencia": _phrase(rng)}
+    elif bloque == 8:
+        concepto, resp = f"Antifragilidad — {sit}", _phrase(rng)
+        meta = {"habilidad": "Paciencia", "distinto": _phrase(rng)}
+    else:
+        concepto, resp = "Integración — Cierre", _phrase(rng)
+        meta = {"bloque_util": f"Bloque {rng.randint(1, 8)}", "dificil": "Constancia", "mejor": "Ansiedad", "rumbo": _phrase(rng)}
+    return {
+        "timestamp": ts.strftime("%Y-%m-%d %H:%M:%S"),
+        "bloque": bloque,
+        "fecha": fecha,
+        "concepto": concepto,
+        "respuesta": resp,
+        "meta": meta,
+    }
+
+
+def synthetic_history(n: int, seed: int = 42, end: datetime | None = None, per_day: float = 3.0) -> list:
+    # `n` registros en orden cronológico, ~`per_day` por día hasta `end`.
+    rng = random.Random(seed)
+    end = end or datetime(2026, 1, 1, 21, 0, 0)
+    span = timedelta(days=max(1, int(n / per_day)))
+    start = end - span
+    step = span / max(1, n)
+    out = []
+    ts = start
+    for _ in range(n):
+        ts = ts + step * rng.uniform(0.5, 1.5)
+        # Los bloques 1–3 se usan más que los finales.
+        bloque = min(9, 1 + int(rng.expovariate(0.35)))
+        out.append(synthetic_entry(rng, bloque, ts.replace(microsecond=0)))
+    return out
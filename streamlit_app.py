@@ -1,12 +1,26 @@
-import json
+import os
 import re
 import hashlib
-from datetime import datetime, date, timedelta
+import hmac
+import functools
+from datetime import date, timedelta
 from pathlib import Path
 
 import pandas as pd
 import streamlit as st
 
+import azimut_cache as cache
+import azimut_corpus as corpus
+import azimut_export as export
+import azimut_frames as frames
+import azimut_import as importer
+import azimut_metrics as metrics
+import azimut_query as query
+import azimut_schema as schema
+import azimut_search as search
+import azimut_stats as stats
+import azimut_storage as storage
+
 # =========================
 # Plotly opcional (NO rompe si falta)
 # =========================
@@ -33,6 +47,16 @@ NEWSLETTERS_FILE = Path("AA-TODAS las newsletters publicadas .txt")
 DATA_DIR = Path("data")
 DATA_DIR.mkdir(exist_ok=True)
 
+metrics.configure(DATA_DIR / "metrics")
+metrics.begin_run()
+
+# "json" (por defecto: snapshot + diario por usuario) o "sqlite" (azimut.sqlite3 en DATA_DIR)
+STORAGE_BACKEND = os.environ.get("AZIMUT_STORAGE", "json")
+# Escrituras en un hilo aparte (AZIMUT_WRITE_BEHIND=0 → en el hilo de la petición).
+WRITE_BEHIND = os.environ.get("AZIMUT_WRITE_BEHIND", "1").strip().lower() not in {"0", "false", "no", "off"}
+# Segundos que la interfaz espera la confirmación de escritura antes de seguir.
+WRITE_ACK_TIMEOUT = float(os.environ.get("AZIMUT_WRITE_ACK_TIMEOUT", "2"))
+
 # =========================================================
 # IDENTIDAD DE USUARIO (email + clave → archivo aislado)
 # =========================================================
@@ -55,58 +79,102 @@ def _hash_identity(email: str, user_key: str) -> str:
     return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
 
 
-def get_user_storage_paths():
+def get_user_uid():
     if not has_identity():
-        return None, None
-    uid = _hash_identity(st.session_state.user_email, st.session_state.user_key)
-    history_file = DATA_DIR / f"history_{uid}.json"
-    export_file = DATA_DIR / f"history_export_{uid}.csv"
-    return history_file, export_file
+        return None
+    return _hash_identity(st.session_state.user_email, st.session_state.user_key)
+
+
+def get_search_index_path(uid: str) -> Path:
+    return STORE.user_path(uid, f"search_{uid}.jsonl")
+
+
+def get_rollup_path(uid: str) -> Path:
+    return STORE.user_path(uid, f"rollup_{uid}.json")
+
+
+def get_emotion_rollup_path(uid: str) -> Path:
+    return STORE.user_path(uid, f"emotions_{uid}.json")
 
 
 # =========================================================
 # HISTORIAL (por usuario)
 # =========================================================
+@st.cache_resource(show_spinner=False)
+def get_store(backend: str, data_dir: str):
+    # Un store por proceso: en SQLite comparte el pool de conexiones entre sesiones.
+    return storage.open_store(backend, Path(data_dir))
+
+
+STORE = get_store(STORAGE_BACKEND, str(DATA_DIR))
+
+
+@st.cache_resource(show_spinner=False)
+def get_history_cache():
+    # Historiales columnares por uid, compartidos por todas las sesiones del proceso (LRU).
+    return cache.HistoryCache()
+
+
+HISTORY_CACHE = get_history_cache()
+
+
+@st.cache_resource(show_spinner=False)
+def get_writer(backend: str, data_dir: str, threaded: bool):
+    # Un hilo escritor por proceso, compartido por todas las sesiones.
+    return storage.WriteBehind(get_store(backend, data_dir), threaded=threaded)
+
+
+WRITER = get_writer(STORAGE_BACKEND, str(DATA_DIR), WRITE_BEHIND)
+
+
+def _load_from_store(uid: str):
+    # Lo pendiente en la cola tiene que estar en disco antes de leerlo.
+    WRITER.drain()
+    return STORE.load(uid)
+
+
 def load_history():
-    history_file, _ = get_user_storage_paths()
-    if history_file is None:
+    uid = get_user_uid()
+    if uid is None:
         return []
-    if history_file.exists():
-        try:
-            return json.loads(history_file.read_text(encoding="utf-8"))
-        except Exception:
-            return []
-    return []
+    return HISTORY_CACHE.get(uid, lambda: _load_from_store(uid))
 
 
 def save_history(hist):
-    history_file, _ = get_user_storage_paths()
-    if history_file is None:
+    uid = get_user_uid()
+    if uid is None:
         return
-    history_file.write_text(json.dumps(hist, ensure_ascii=False, indent=2), encoding="utf-8")
+    WRITER.save(uid, hist)
+    WRITER.drain(WRITE_ACK_TIMEOUT)
+    HISTORY_CACHE.invalidate(uid)
 
 
-if "historial" not in st.session_state:
-    st.session_state.historial = load_history()
+def append_history(entries: list) -> storage.WriteTicket | None:
+    # Solo se escriben los registros nuevos (diario append-only / INSERT), en segundo plano.
+    uid = get_user_uid()
+    if uid is None:
+        return None
+    return WRITER.append(uid, entries, len(st.session_state.historial))
+
+
+def bump_history_version():
+    # Invalida las vistas derivadas del historial (DataFrame memoizado, etc.).
+    st.session_state.historial_version = st.session_state.get("historial_version", 0) + 1
 
-# =========================================================
-# TEXTO (corpus) — cacheado
-# =========================================================
-@st.cache_data(show_spinner=False)
-def load_text_cached(path_str: str) -> str:
-    path = Path(path_str)
-    if not path.exists():
-        return ""
-    try:
-        return path.read_text(encoding="utf-8", errors="ignore")
-    except Exception:
-        return ""
 
+def history_version():
+    # La longitud cubre los guardados hechos desde otra pestaña sobre el historial compartido.
+    return st.session_state.get("historial_version", 0), len(st.session_state.get("historial", []))
 
-AZIMUT_TEXT = load_text_cached(str(AZIMUT_FILE))
-NEWS_TEXT = load_text_cached(str(NEWSLETTERS_FILE))
 
+if "historial" not in st.session_state:
+    with metrics.phase("load_history"):
+        st.session_state.historial = load_history()
+    bump_history_version()
 
+# =========================================================
+# TEXTO (corpus) — mmap perezoso + artefactos precalculados en disco
+# =========================================================
 def normalize_space(s: str) -> str:
     return re.sub(r"\s+", " ", (s or "").strip())
 
@@ -122,8 +190,7 @@ def unique_preserve(seq):
     return out
 
 
-@st.cache_data(show_spinner=False)
-def extract_emotions_from_azimut_cached(text: str) -> list[str]:
+def extract_emotions_from_azimut(text: str) -> list[str]:
     if not text:
         return []
 
@@ -182,9 +249,34 @@ def biases_cached() -> list[str]:
     )
 
 
-EMOTIONS = extract_emotions_from_azimut_cached(AZIMUT_TEXT)
+CORPUS_LABELS = {"azimut": "Azimut", "news": "Newsletter"}
+
+
+@st.cache_resource(show_spinner=False)
+def corpus_cached(azimut_path: str, news_path: str) -> corpus.Corpus:
+    # Un Corpus por proceso: los ficheros se mapean al usarse y los derivados
+    # (emociones, pasajes, índice BM25) se leen de DATA_DIR si siguen vigentes.
+    return corpus.Corpus(
+        {"azimut": azimut_path, "news": news_path},
+        cache_dir=DATA_DIR,
+        emotions_fn=extract_emotions_from_azimut,
+        emotions_source="azimut",
+    )
+
+
+CORPUS = corpus_cached(str(AZIMUT_FILE), str(NEWSLETTERS_FILE))
+EMOTIONS = CORPUS.emotions
 BIASES = biases_cached()
 
+
+@st.cache_resource(show_spinner=False)
+def emotion_completer_cached(azimut_path: str, news_path: str) -> search.PrefixIndex:
+    c = corpus_cached(azimut_path, news_path)
+    return search.PrefixIndex(c.emotions, c.emotion_freq)
+
+
+EMOTION_COMPLETER = emotion_completer_cached(str(AZIMUT_FILE), str(NEWSLETTERS_FILE))
+
 # =========================================================
 # BRAND / THEME (solo modo claro)
 # =========================================================
@@ -403,27 +495,175 @@ def apply_theme():
     )
 
 
-apply_theme()
+with metrics.phase("apply_theme"):
+    apply_theme()
 
 # =========================================================
 # DF + utilidades
 # =========================================================
-def history_df():
+def history_df(hist=None):
+    if hist is None:
+        hist = st.session_state.historial
+    return frames.entries_df(hist)
+
+
+def attached_to_history(name: str, build):
+    # Derivados mantenidos en cada guardado (índice, resumen). Con el historial
+    # compartido viven junto a él; si no, en la sesión.
+    hist = st.session_state.historial
+    if isinstance(hist, cache.ColumnarHistory):
+        return hist.attached(name, build)
+    uid = get_user_uid()
+    key = f"_{name}"
+    cached = st.session_state.get(key)
+    if cached is None or cached[0] != uid:
+        st.session_state[key] = (uid, build())
+        cached = st.session_state[key]
+    return cached[1]
+
+
+def detach_from_history(name: str):
     hist = st.session_state.historial
-    if not hist:
-        return pd.DataFrame(columns=["timestamp", "bloque", "fecha", "concepto", "respuesta", "meta"])
-    df = pd.DataFrame(hist)
-    for col in ["timestamp", "bloque", "fecha", "concepto", "respuesta", "meta"]:
-        if col not in df.columns:
-            df[col] = None
-    return df
-
-
-def to_sortable_date(d):
-    try:
-        return datetime.strptime(d, "%d/%m/%Y").strftime("%Y-%m-%d")
-    except Exception:
+    if isinstance(hist, cache.ColumnarHistory):
+        hist.detach(name)
+    st.session_state.pop(f"_{name}", None)
+
+
+def get_history_index():
+    # Índice de búsqueda del usuario: se carga una vez (sin re-tokenizar) y
+    # después se mantiene en cada guardado.
+    uid = get_user_uid()
+    if uid is None:
+        return None
+    return attached_to_history(
+        "search_index", lambda: search.load_history_index(get_search_index_path(uid), st.session_state.historial)
+    )
+
+
+def clear_history_index():
+    uid = get_user_uid()
+    if uid is not None:
+        search.clear_history_index(get_search_index_path(uid))
+    st.session_state.pop("_search_index", None)
+
+
+def get_archive():
+    uid = get_user_uid()
+    return None if uid is None else STORE.archive(uid)
+
+
+def full_history():
+    # Archivo + caliente, para los resúmenes de todo el tiempo. Solo se descomprime
+    # el archivo si el resumen guardado no vale y hay que reconstruirlo.
+    hist = st.session_state.historial
+    tier = get_archive()
+    if tier is None or not tier.months():
+        return hist
+    return cache.TieredHistory(tier, hist)
+
+
+def history_view(start=None, end=None):
+    # El historial caliente o, si el rango llega a meses archivados, esos meses
+    # seguidos del caliente. Los segmentos solo se leen en ese caso.
+    hot = st.session_state.historial
+    tier = get_archive()
+    months = tier.months_between(start, end) if tier is not None else []
+    if not months or not isinstance(hot, cache.ColumnarHistory):
+        return hot
+    stamp = tier.stamp(months)
+    cold = HISTORY_CACHE.get(f"{get_user_uid()}@archive:{stamp}", lambda: tier.entries(months))
+    return hot.memo(("archive_view", stamp), lambda: cache.ConcatHistory([cold, hot]))
+
+
+def get_rollup():
+    # Resumen incremental (por día / bloque, rachas) del usuario, archivo incluido.
+    uid = get_user_uid()
+    if uid is None:
+        return None
+    return attached_to_history("rollup", lambda: stats.load_rollup(get_rollup_path(uid), full_history()))
+
+
+def clear_rollup():
+    uid = get_user_uid()
+    if uid is not None:
+        stats.clear_rollup(get_rollup_path(uid))
+    st.session_state.pop("_rollup", None)
+
+
+def get_emotion_rollup():
+    # Emociones por semana (Bloques 3–5), normalizadas contra EMOTIONS.
+    uid = get_user_uid()
+    if uid is None:
         return None
+    return attached_to_history(
+        "emotion_rollup",
+        lambda: stats.load_emotion_rollup(get_emotion_rollup_path(uid), full_history(), EMOTIONS),
+    )
+
+
+def clear_emotion_rollup():
+    uid = get_user_uid()
+    if uid is not None:
+        stats.clear_rollup(get_emotion_rollup_path(uid))
+    st.session_state.pop("_emotion_rollup", None)
+
+
+def refresh_history_if_changed():
+    # Otra pestaña, worker o réplica ha escrito este historial: una comprobación
+    # barata por ejecución (stat / contador), y solo si cambió se recarga.
+    # Con escrituras propias aún en la cola no se comprueba: el disco ya puede
+    # tenerlas sin que el store las haya anotado, y parecerían ajenas.
+    uid = get_user_uid()
+    if uid is None:
+        return
+    if not WRITER.pending(uid) and STORE.changed(uid):
+        WRITER.drain()
+        HISTORY_CACHE.invalidate(uid)
+        # Los derivados en disco pueden mezclar posiciones de los dos escritores:
+        # se reconstruyen desde el historial recargado.
+        clear_history_index()
+        clear_rollup()
+        clear_emotion_rollup()
+        st.toast("🔄 Historial actualizado con cambios de otra sesión")
+    current = load_history()
+    if current is not st.session_state.historial:
+        # Otra sesión del proceso lo recargó (p. ej. tras limpiarlo): se adopta el compartido.
+        st.session_state.historial = current
+        st.session_state.pop("_query_index", None)
+        bump_history_version()
+
+
+def get_query_index(hist=None):
+    # Posiciones por timestamp (global) y por bloque → fecha → timestamp para los filtros.
+    if hist is None or hist is st.session_state.historial:
+        return attached_to_history("query_index", lambda: query.HistoryQueryIndex.from_history(st.session_state.historial))
+    return hist.attached("query_index", lambda: query.HistoryQueryIndex.from_history(hist))
+
+
+def get_view_search_index(hist=None):
+    # En una vista con meses archivados: índice en memoria de esos meses + el del caliente.
+    if not isinstance(hist, cache.ConcatHistory):
+        return get_history_index()
+    cold = hist.parts[0]
+    return search.ConcatIndex(
+        [(0, cold.attached("search_index", lambda: search.build_history_index(cold))), (len(cold), get_history_index())]
+    )
+
+
+def query_history(start=None, end=None, bloques=None, text=None, limit=None, offset: int = 0, hist=None) -> query.QueryResult:
+    # Rango de fechas por búsqueda binaria + bloques por listas de posiciones;
+    # con `text`, se parte de las coincidencias del índice invertido. `hist`: vista
+    # de history_view (posiciones relativas a ella).
+    hits = get_view_search_index(hist).search(text) if text and text.strip() else None
+    return get_query_index(hist).query(start, end, bloques, hits=hits, limit=limit, offset=offset)
+
+
+def entries_frame(positions, hist=None) -> pd.DataFrame:
+    # Solo se materializan los registros pedidos.
+    if hist is None:
+        hist = st.session_state.historial
+    with metrics.phase("history_df"):
+        return frames.add_date_columns(history_df([hist[i] for i in positions]))
 
 
 # =========================================================
@@ -434,18 +674,71 @@ def guardar_respuesta(bloque: int, fecha_str: str, concepto: str, respuesta: str
         st.warning("Para guardar y ver un historial privado, introduce tu **email** y tu **clave privada** en la barra lateral.")
         return
 
-    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    entry = {
-        "timestamp": ts,
-        "bloque": int(bloque),
-        "fecha": fecha_str if fecha_str else "",
-        "concepto": concepto,
-        "respuesta": respuesta if respuesta else "",
-        "meta": meta or {},
-    }
+    entry = schema.make_entry(bloque, fecha_str, concepto, respuesta, meta)
+    idx = get_history_index()
+    rollup = get_rollup()
+    emotion_rollup = get_emotion_rollup()
+    qidx = get_query_index()
     st.session_state.historial.append(entry)
-    save_history(st.session_state.historial)
-    st.toast(f"✅ Guardado — Bloque {bloque}")
+    bump_history_version()
+    ticket = append_history([entry])
+    uid = get_user_uid()
+    pos = len(st.session_state.historial) - 1
+    WRITER.append_text(get_search_index_path(uid), search.index_entries_text(idx, [(pos, entry)]))
+    qidx.add(pos, entry)
+    rollup.add(entry)
+    WRITER.write_text(get_rollup_path(uid), stats.rollup_text(rollup))
+    emotion_rollup.add(entry)
+    WRITER.write_text(get_emotion_rollup_path(uid), stats.rollup_text(emotion_rollup))
+    notify_saved(ticket, f"Bloque {bloque}")
+
+
+def notify_saved(ticket, what: str):
+    # Confirmación de durabilidad con tiempo máximo: si el disco va lento, la
+    # escritura sigue en segundo plano y la sesión no se queda esperando.
+    with metrics.phase("write_ack"):
+        acked = ticket is None or ticket.wait(WRITE_ACK_TIMEOUT)
+    if not acked:
+        st.toast(f"⏳ Guardado — {what} (escribiendo en disco…)")
+    elif ticket is not None and ticket.error is not None:
+        st.error(f"No se pudo escribir en disco: {ticket.error}")
+    else:
+        st.toast(f"✅ Guardado — {what}")
+
+
+def import_history(fh, fmt: str) -> importer.ImportReport:
+    # Importación masiva: lectura por bloques, deduplicado por hash y una sola
+    # escritura del lote (no un guardar_respuesta por fila).
+    uid = get_user_uid()
+    hist = st.session_state.historial
+    report = importer.ImportReport()
+    with metrics.phase("import"):
+        # Contra el historial completo: lo archivado también cuenta como existente.
+        new = list(importer.read_entries(fh, fmt, importer.history_hashes(full_history()), report))
+        if report.failed is not None:
+            # Fichero cortado a mitad: no se importa una parte.
+            report.imported = 0
+            return report
+        if not new:
+            return report
+        idx = get_history_index()
+        rollup = get_rollup()
+        emotion_rollup = get_emotion_rollup()
+        first = len(hist)
+        for e in new:
+            hist.append(e)
+        bump_history_version()
+        ticket = append_history(new)
+        WRITER.append_text(get_search_index_path(uid), search.index_entries_text(idx, enumerate(new, start=first)))
+        rollup.add_many(new)
+        WRITER.write_text(get_rollup_path(uid), stats.rollup_text(rollup))
+        for e in new:
+            emotion_rollup.add(e)
+        WRITER.write_text(get_emotion_rollup_path(uid), stats.rollup_text(emotion_rollup))
+        # Registros antiguos al final del historial: el índice ordenado se rehace una vez.
+        detach_from_history("query_index")
+    notify_saved(ticket, f"{report.imported} registros importados")
+    return report
 
 
 # =========================================================
@@ -476,9 +769,15 @@ if "last_identity" not in st.session_state:
     st.session_state.last_identity = current_identity
 
 if current_identity != st.session_state.last_identity:
-    st.session_state.historial = load_history()
+    with metrics.phase("load_history"):
+        st.session_state.historial = load_history()
+    bump_history_version()
     st.session_state.last_identity = current_identity
+    metrics.end_run(complete=False)
     st.rerun()
+else:
+    with metrics.phase("refresh_history"):
+        refresh_history_if_changed()
 
 if not has_identity():
     st.sidebar.info("Introduce **email + clave** para activar tu historial privado.")
@@ -497,6 +796,7 @@ MENU_ITEMS = [
     "📊 MIS RESPUESTAS",
 ]
 menu = st.sidebar.radio("Ir a:", MENU_ITEMS, key="nav_menu")
+metrics.set_page(menu)
 
 # =========================================================
 # UI helpers: cards + fecha
@@ -516,65 +816,264 @@ def card_end():
     st.markdown("</div>", unsafe_allow_html=True)
 
 
+EMOTION_SUGGESTIONS = 5
+
+
+def _apply_emotion_suggestion(key: str, pills_key: str, multi: bool):
+    sug = st.session_state.get(pills_key)
+    if not sug:
+        return
+    current = st.session_state.get(key, "")
+    if multi and "," in current:
+        head = current.rsplit(",", 1)[0]
+        st.session_state[key] = f"{head}, {sug}"
+    else:
+        st.session_state[key] = sug
+    st.session_state[pills_key] = None
+
+
+def emotion_input(label: str, key: str, multi: bool = False) -> str:
+    # text_input con sugerencias del vocabulario de emociones del corpus.
+    # Con multi=True se completa el último elemento de una lista separada por comas.
+    value = st.text_input(label, key=key)
+    fragment = value.rsplit(",", 1)[-1] if multi else value
+    done = {search.strip_accents(v).strip() for v in value.split(",")} if multi else set()
+    norm = search.strip_accents(fragment).strip()
+    sugs = [
+        s for s in EMOTION_COMPLETER.suggest(fragment, k=EMOTION_SUGGESTIONS)
+        if search.strip_accents(s) != norm and search.strip_accents(s) not in done
+    ]
+    if sugs:
+        pills_key = f"{key}__sugerencias"
+        st.pills(
+            "Sugerencias",
+            sugs,
+            key=pills_key,
+            on_change=_apply_emotion_suggestion,
+            args=(key, pills_key, multi),
+            label_visibility="collapsed",
+        )
+    return value
+
+
+RELATED_READING_K = 3
+RELATED_READING_MAX_CHARS = 700
+
+
+def related_reading(*texts):
+    # Pasajes del material relacionados con lo que la persona está escribiendo.
+    query = " ".join(t for t in texts if isinstance(t, str) and t.strip())
+    if not query:
+        return
+    with metrics.phase("related_reading"):
+        hits = CORPUS.index().search(query, k=RELATED_READING_K)
+    if not hits:
+        return
+    with st.expander("Lecturas relacionadas", expanded=False):
+        for h in hits:
+            st.caption(CORPUS_LABELS.get(h["source"], h["source"]))
+            txt = normalize_space(h["text"])
+            if len(txt) > RELATED_READING_MAX_CHARS:
+                txt = txt[:RELATED_READING_MAX_CHARS].rsplit(" ", 1)[0] + "…"
+            st.write(txt)
+
+
+def _turn_reading_page(key: str, delta: int):
+    st.session_state[key] = max(0, st.session_state.get(key, 0) + delta)
+
+
+def reading_pane(bloque: int):
+    # Capítulo del bloque en el material de Azimut, por páginas: el índice de
+    # secciones está en caché y cada ejecución solo decodifica la página visible.
+    sec = CORPUS.section("azimut", bloque)
+    if sec is None or not sec["pages"]:
+        return
+    n_pages = len(sec["pages"])
+    if not st.toggle(f"📖 Leer el capítulo ({n_pages} págs.)", key=f"read_bloque_{bloque}"):
+        return
+    key = f"read_page_{bloque}"
+    page = min(st.session_state.get(key, 0), n_pages - 1)
+    with metrics.phase("reading_pane"):
+        text = CORPUS.section_page("azimut", bloque, page)
+    card(sec["title"], subtitle=f"Página {page + 1} de {n_pages}")
+    for para in re.split(r"\n[ \t\r]*\n", text):
+        if para.strip():
+            st.write(normalize_space(para))
+    card_end()
+    prev_col, next_col = st.columns(2)
+    prev_col.button(
+        "← Anterior", key=f"read_prev_{bloque}", disabled=page == 0, on_click=_turn_reading_page, args=(key, -1)
+    )
+    next_col.button(
+        "Siguiente →",
+        key=f"read_next_{bloque}",
+        disabled=page >= n_pages - 1,
+        on_click=_turn_reading_page,
+        args=(key, 1),
+    )
+
+
 def fecha_bloque(bloque: int):
     st.caption("Fecha del registro (manual, para tu seguimiento):")
     key = f"fecha_bloque_{bloque}"
     default = st.session_state.get(key, date.today())
     d = st.date_input("Fecha", value=default, key=key)
-    return d.strftime("%d/%m/%Y")
-
-
-# =========================================================
-# PANTALLAS
-# =========================================================
-df_all = history_df()
+    return d.isoformat()
 
-# ---------- INICIO ----------
-if menu == "INICIO":
-    card("Azimut", "<b>Cuaderno de navegación: no es para pensar más, es para pensar mejor.</b>")
 
-    st.markdown(
-        """
-        Azimut está diseñado para que avances **a tu ritmo**.  
-        No se trata de hacerlo “rápido” ni de recortar el proceso, sino de darte el tiempo que necesites para **entrenar habilidades**, fortalecer recursos y ensayar formas nuevas de afrontar lo que te ocurre.
+HISTORY_PAGE_SIZE = 50
 
-        Con esfuerzo y constancia, lo que cambia no es solo lo que escribes: cambia **cómo te observas**, cómo te regulas y qué decisiones eres capaz de sostener cuando el día aprieta.
 
-        Esta app te aporta una estructura clara para registrar tu proceso con orden (sin depender de papel y boli, sin perder lo que escribiste ayer),
-        y para que tus respuestas queden agrupadas por bloques y fechas en **“📊 MIS RESPUESTAS”**.
-        """,
-        unsafe_allow_html=False,
-    )
+def render_history_record(row):
+    card(row.concepto or "Registro", subtitle=None)
+    resp = row.respuesta
+    if isinstance(resp, str) and resp.strip():
+        st.write(resp)
+    meta = row.meta
+    if isinstance(meta, dict) and meta:
+        lines = [f"**{k.replace('_',' ').capitalize()}:** {v}" for k, v in meta.items() if str(v).strip()]
+        if lines:
+            st.markdown("<div class='az-gap'></div>", unsafe_allow_html=True)
+            st.caption("Detalles")
+            st.markdown("  \n".join(lines))
+    card_end()
+    st.markdown("<div class='az-gap'></div>", unsafe_allow_html=True)
+
+
+def history_page_limit(page_key) -> int:
+    # Registros visibles; vuelve a HISTORY_PAGE_SIZE cuando cambian los filtros.
+    if st.session_state.get("hist_page_key") != page_key:
+        st.session_state.hist_page_key = page_key
+        st.session_state.hist_limit = HISTORY_PAGE_SIZE
+    return st.session_state.get("hist_limit", HISTORY_PAGE_SIZE)
+
+
+def render_history_grouped(window, total: int, limit: int):
+    # Bloque → fecha en una sola pasada y solo sobre la ventana visible: el coste
+    # de render depende de HISTORY_PAGE_SIZE, no del tamaño del historial.
+    # `fecha` es ISO; se muestra como DD/MM/YYYY y, si falta, la del timestamp.
+    # La ventana ya llega en orden bloque → fecha → timestamp (ver query_history):
+    # cada grupo es un tramo seguido y no se reordena.
+    fecha = pd.to_datetime(window["fecha"], format=schema.FECHA_FORMAT, errors="coerce").fillna(window["ts_dt"])
+    group_date = fecha.dt.strftime(schema.LEGACY_FECHA_FORMAT).fillna("")
+
+    last_bloque = None
+    for (bloque, gd), gdf in window.groupby([window["bloque"], group_date], sort=False, dropna=False):
+        if bloque != last_bloque:
+            st.subheader(f"Bloque {bloque}")
+            last_bloque = bloque
+        st.markdown(f"#### {gd}")
+        for row in gdf.itertuples(index=False):
+            render_history_record(row)
+
+    if total > limit:
+        st.caption(f"Mostrando {limit} de {total} registros.")
+        if st.button("Cargar más", key="hist_load_more"):
+            st.session_state.hist_limit = limit + HISTORY_PAGE_SIZE
+            metrics.end_run(complete=False)
+            st.rerun()
+
+
+def export_chunks(positions, hist):
+    # Los registros pedidos en DataFrames de EXPORT_CHUNK_ROWS filas (nunca todos a la vez).
+    def chunks():
+        for i in range(0, len(positions), export.EXPORT_CHUNK_ROWS):
+            yield history_df([hist[p] for p in positions[i : i + export.EXPORT_CHUNK_ROWS]])
+
+    return chunks
+
+
+def lazy_export(positions_fn, hist, fmt: str, cache_key: str):
+    # Los bytes (y las posiciones filtradas, `positions_fn()`) se generan al pulsar
+    # "Descargar", no en cada rerun, y se guardan por clave de filtros + versión
+    # del historial; solo se conserva la última.
+    cache = st.session_state.setdefault("_export_cache", {})
+
+    def build():
+        data = cache.get(cache_key)
+        if data is None:
+            cache.clear()
+            with metrics.phase(f"export_{fmt.lower()}"):
+                data = export.export_bytes(export_chunks(positions_fn(), hist), fmt)
+            cache[cache_key] = data
+        return data
+
+    return build
+
+
+CHART_CACHE_ENTRIES = 8
+
+
+def chart_specs(cache_key: str, counts_fn) -> dict:
+    # Series y figuras de "Gráficos" por clave de filtros + versión del historial:
+    # un rerun sin cambios no vuelve a contar ni a construir las figuras. La serie
+    # diaria se agrega por semana/mes en rangos largos (la misma para Plotly y
+    # para st.line_chart). Se conservan las últimas CHART_CACHE_ENTRIES.
+    cache = st.session_state.setdefault("_chart_cache", {})
+    spec = cache.pop(cache_key, None)
+    if spec is None:
+        with metrics.phase("charts_build"):
+            daily, by_block = counts_fn()
+            series, freq = frames.resample_counts(daily)
+            unit = frames.CHART_FREQ_LABELS[freq]
+            spec = {"series": series, "by_block": by_block, "freq": freq, "line": None, "bar": None}
+            if PLOTLY_AVAILABLE:
+                spec["line"] = px.line(
+                    series, x="ts_date", y="registros", markers=freq == "D", title=f"Constancia (registros/{unit})"
+                )
+                spec["bar"] = px.bar(by_block, x="bloque", y="registros", title="Distribución por bloque")
+        while len(cache) >= CHART_CACHE_ENTRIES:
+            cache.pop(next(iter(cache)))
+    cache[cache_key] = spec
+    return spec
+
+
+def is_metrics_admin() -> bool:
+    # Vista oculta: ?admin=metrics&token=... con el valor de AZIMUT_ADMIN_TOKEN.
+    # Sin token configurado no se abre a nadie.
+    if not metrics.METRICS_ENABLED or st.query_params.get("admin") != "metrics":
+        return False
+    token = os.environ.get("AZIMUT_ADMIN_TOKEN", "")
+    given = st.query_params.get("token", "")
+    return bool(token) and hmac.compare_digest(given.encode("utf-8"), token.encode("utf-8"))
+
+
+def render_metrics_admin():
+    st.title("Métricas de ejecución")
+    rows = metrics.summary()
+    if not rows:
+        st.write("Aún no hay muestras.")
+        return
+    st.markdown("### Fases más lentas (p95)")
+    st.dataframe(pd.DataFrame(rows).head(30), hide_index=True)
+    with st.expander("Formato Prometheus"):
+        st.code(metrics.prometheus_text(), language="text")
 
-    # ✅ Caja IMPORTANTE sin tags visibles (HTML seguro + contenido en texto limpio)
-    st.markdown(
-        """
-        <div class="az-important">
-          <div class="az-important-title">IMPORTANTE</div>
 
-          <p>Para que tu registro sea <b>personal y privado</b>, introduce tu <b>email</b> y una <b>clave privada</b> en la barra lateral.</p>
+# =========================================================
+# PANTALLAS DE BLOQUE (fragmentos aislados)
+# =========================================================
+# Cada bloque es un st.fragment: escribir en sus campos o pulsar "Guardar" solo
+# vuelve a ejecutar el fragmento, no la barra lateral, el tema ni el resto del script.
+# Sus fases se miden en su propia ejecución, con la página del menú.
+def bloque_fragment(n: int):
+    def decorate(fn):
+        @st.fragment
+        @functools.wraps(fn)
+        def body():
+            with metrics.run(MENU_ITEMS[n]):
+                fn()
 
-          <p><b>Paso a paso (sin dudas):</b></p>
-          <ul>
-            <li><b>Escribe tu email y tu clave privada</b> (solo escribirlos ya sirve; <b>no</b> hace falta pulsar Enter).</li>
-            <li>Después completa cualquier bloque y pulsa <b>“Guardar…”</b> (ese botón es el que guarda tus respuestas).</li>
-            <li>Ve a <b>“📊 MIS RESPUESTAS”</b> para ver tu historial y evolución.</li>
-          </ul>
+        return body
 
-          <p>Si entras otro día, usa el <b>mismo email</b> y la <b>misma clave</b> para recuperar tu cuaderno.</p>
-          <p><b>Sin email + clave:</b> la app <b>no guarda</b> y <b>no muestra</b> “Mis respuestas”.</p>
-          <p><b>Consejo:</b> usa una frase larga (difícil de adivinar) y guárdala en tu gestor de contraseñas.</p>
-        </div>
-        """,
-        unsafe_allow_html=True,
-    )
+    return decorate
 
-    card_end()
 
-# ---------- BLOQUE 1 ----------
-elif menu == "Bloque 1: Vía Negativa":
+@bloque_fragment(1)
+def bloque_1():
     st.header("Bloque 1: Vía negativa")
     st.write("Antes de añadir soluciones, quita lo que empeora la situación.")
+    reading_pane(1)
     f = fecha_bloque(1)
 
     card("Registro del día", subtitle="Menos, pero con impacto.", enunciado="Una frase clara. Sin negociación.")
@@ -584,10 +1083,14 @@ elif menu == "Bloque 1: Vía Negativa":
     if st.button("Guardar compromiso"):
         guardar_respuesta(1, f, "Vía negativa — Resta del día", dato)
 
-# ---------- BLOQUE 2 ----------
-elif menu == "Bloque 2: Aproximación/Retirada":
+    related_reading(dato)
+
+
+@bloque_fragment(2)
+def bloque_2():
     st.header("Bloque 2: Aproximación o retirada")
     st.write("Tu cerebro decide primero si acercarse o alejarse.")
+    reading_pane(2)
     f = fecha_bloque(2)
 
     card("Registro", subtitle="Dirección conductual del día.", enunciado="Detecta la dirección antes de justificarla.")
@@ -600,15 +1103,19 @@ elif menu == "Bloque 2: Aproximación/Retirada":
         meta = {"situacion": situacion, "utilidad": utilidad}
         guardar_respuesta(2, f, f"Dirección conductual — {direccion}", direccion, meta=meta)
 
-# ---------- BLOQUE 3 ----------
-elif menu == "Bloque 3: Arquitectura Emocional":
+    related_reading(situacion, utilidad)
+
+
+@bloque_fragment(3)
+def bloque_3():
     st.header("Bloque 3: Arquitectura emocional")
     st.write("No todo lo que sientes es lo mismo. Distinguir capas te da palanca.")
+    reading_pane(3)
     f = fecha_bloque(3)
 
     card("Mapa emocional", subtitle="Emoción → sentimiento → clima.", enunciado="Separa capas internas, sin moralina.")
     situacion = st.text_input("Situación del día")
-    emocion = st.text_input("Emoción automática (rápida)")
+    emocion = emotion_input("Emoción automática (rápida)", key="b3_emocion")
     sentimiento = st.text_input("Sentimiento consciente (cuando lo nombraste)")
     estado = st.text_input("Estado de ánimo de fondo (clima)")
     energia = st.selectbox("Nivel de energía", ["Alto", "Medio", "Bajo"])
@@ -623,10 +1130,14 @@ elif menu == "Bloque 3: Arquitectura Emocional":
         }
         guardar_respuesta(3, f, "Arquitectura emocional — Registro", situacion, meta=meta)
 
-# ---------- BLOQUE 4 ----------
-elif menu == "Bloque 4: Raíz y Rama":
+    related_reading(situacion, emocion, sentimiento, estado)
+
+
+@bloque_fragment(4)
+def bloque_4():
     st.header("Bloque 4: Raíz y rama")
     st.write("Toda emoción compleja suele tener una base más simple.")
+    reading_pane(4)
     f = fecha_bloque(4)
 
     card(
@@ -635,8 +1146,8 @@ elif menu == "Bloque 4: Raíz y Rama":
         enunciado="Separa la reacción automática de la historia mental.",
     )
     situacion = st.text_input("Situación")
-    primaria = st.text_input("Emoción primaria (raíz)")
-    secundaria = st.text_input("Emoción secundaria (rama)")
+    primaria = emotion_input("Emoción primaria (raíz)", key="b4_primaria")
+    secundaria = emotion_input("Emoción secundaria (rama)", key="b4_secundaria")
     pensamiento = st.text_area("Pensamiento asociado (la frase interna)", height=90)
     reflexion = st.text_area("Reflexión breve (qué cambió al verlo así)", height=90)
     card_end()
@@ -645,16 +1156,20 @@ elif menu == "Bloque 4: Raíz y Rama":
         meta = {"primaria": primaria, "secundaria": secundaria, "pensamiento": pensamiento}
         guardar_respuesta(4, f, f"Raíz y rama — {situacion}", reflexion, meta=meta)
 
-# ---------- BLOQUE 5 ----------
-elif menu == "Bloque 5: Precisión Emocional":
+    related_reading(situacion, primaria, secundaria, pensamiento, reflexion)
+
+
+@bloque_fragment(5)
+def bloque_5():
     st.header("Bloque 5: Precisión emocional")
     st.write("Lo que se nombra, se puede regular.")
+    reading_pane(5)
     f = fecha_bloque(5)
 
     card("Registro", subtitle="De ‘mal’ a matiz.", enunciado="Pasa de etiqueta vaga a emoción concreta.")
     situacion = st.text_input("Situación")
     antes = st.text_input("Antes decía que me sentía…")
-    precisas = st.text_input("Emociones más precisas (2–5, separadas por comas)")
+    precisas = emotion_input("Emociones más precisas (2–5, separadas por comas)", key="b5_precisas", multi=True)
     cuerpo = st.text_input("¿Dónde lo sentiste en el cuerpo?")
     frase = st.text_area("Frase final de integración (1–3 líneas)", height=90)
     card_end()
@@ -663,10 +1178,14 @@ elif menu == "Bloque 5: Precisión Emocional":
         meta = {"antes": antes, "precisas": precisas, "cuerpo": cuerpo}
         guardar_respuesta(5, f, f"Precisión emocional — {situacion}", frase, meta=meta)
 
-# ---------- BLOQUE 6 ----------
-elif menu == "Bloque 6: Detector de Sesgos":
+    related_reading(situacion, antes, precisas, cuerpo, frase)
+
+
+@bloque_fragment(6)
+def bloque_6():
     st.header("Bloque 6: Detector de sesgos")
     st.write("El piloto automático es eficiente… y a veces tramposo.")
+    reading_pane(6)
     f = fecha_bloque(6)
 
     card("Registro", subtitle="Sesgo → pensamiento → alternativa.", enunciado="Detecta el sesgo antes de actuar.")
@@ -683,10 +1202,14 @@ elif menu == "Bloque 6: Detector de Sesgos":
         meta = {"situacion": situacion, "pensamiento": pensamiento, "alternativa": alternativa}
         guardar_respuesta(6, f, f"Sesgo — {sesgo}", alternativa, meta=meta)
 
-# ---------- BLOQUE 7 ----------
-elif menu == "Bloque 7: El Abogado del Diablo":
+    related_reading(sesgo, situacion, pensamiento, alternativa)
+
+
+@bloque_fragment(7)
+def bloque_7():
     st.header("Bloque 7: El abogado del diablo")
     st.write("No es autoataque: es higiene mental.")
+    reading_pane(7)
     f = fecha_bloque(7)
 
     card(
@@ -703,10 +1226,14 @@ elif menu == "Bloque 7: El Abogado del Diablo":
         meta = {"evidencia": evidencia}
         guardar_respuesta(7, f, f"Abogado del diablo — {creencia}", nueva, meta=meta)
 
-# ---------- BLOQUE 8 ----------
-elif menu == "Bloque 8: Antifragilidad":
+    related_reading(creencia, evidencia, nueva)
+
+
+@bloque_fragment(8)
+def bloque_8():
     st.header("Bloque 8: Antifragilidad")
     st.write("No romantizamos el caos: lo convertimos en información.")
+    reading_pane(8)
     f = fecha_bloque(8)
 
     card("Registro", subtitle="Evento → aprendizaje.", enunciado="El imprevisto ya ocurrió; ahora que te pague en datos.")
@@ -720,10 +1247,14 @@ elif menu == "Bloque 8: Antifragilidad":
         meta = {"habilidad": habilidad, "distinto": distinto}
         guardar_respuesta(8, f, f"Antifragilidad — {evento}", aprendizaje, meta=meta)
 
-# ---------- BLOQUE 9 ----------
-elif menu == "Bloque 9: El Nuevo Rumbo":
+    related_reading(evento, habilidad, distinto, aprendizaje)
+
+
+@bloque_fragment(9)
+def bloque_9():
     st.header("Bloque 9: El nuevo rumbo")
     st.write("Cierre del recorrido. Integración: pocas ideas, mucha verdad.")
+    reading_pane(9)
     f = fecha_bloque(9)
 
     card("¿Qué me llevo de esto?")
@@ -754,25 +1285,108 @@ elif menu == "Bloque 9: El Nuevo Rumbo":
         guardar_respuesta(9, f, "Integración — Cierre", cambio, meta=meta)
         st.balloons()
 
+    related_reading(cambio, util, dificil, mejor, rumbo)
+
+
+# =========================================================
+# PANTALLAS
+# =========================================================
+if is_metrics_admin():
+    render_metrics_admin()
+    metrics.end_run()
+    st.stop()
+
+# ---------- INICIO ----------
+if menu == "INICIO":
+    card("Azimut", "<b>Cuaderno de navegación: no es para pensar más, es para pensar mejor.</b>")
+
+    st.markdown(
+        """
+        Azimut está diseñado para que avances **a tu ritmo**.  
+        No se trata de hacerlo “rápido” ni de recortar el proceso, sino de darte el tiempo que necesites para **entrenar habilidades**, fortalecer recursos y ensayar formas nuevas de afrontar lo que te ocurre.
+
+        Con esfuerzo y constancia, lo que cambia no es solo lo que escribes: cambia **cómo te observas**, cómo te regulas y qué decisiones eres capaz de sostener cuando el día aprieta.
+
+        Esta app te aporta una estructura clara para registrar tu proceso con orden (sin depender de papel y boli, sin perder lo que escribiste ayer),
+        y para que tus respuestas queden agrupadas por bloques y fechas en **“📊 MIS RESPUESTAS”**.
+        """,
+        unsafe_allow_html=False,
+    )
+
+    # ✅ Caja IMPORTANTE sin tags visibles (HTML seguro + contenido en texto limpio)
+    st.markdown(
+        """
+        <div class="az-important">
+          <div class="az-important-title">IMPORTANTE</div>
+
+          <p>Para que tu registro sea <b>personal y privado</b>, introduce tu <b>email</b> y una <b>clave privada</b> en la barra lateral.</p>
+
+          <p><b>Paso a paso (sin dudas):</b></p>
+          <ul>
+            <li><b>Escribe tu email y tu clave privada</b> (solo escribirlos ya sirve; <b>no</b> hace falta pulsar Enter).</li>
+            <li>Después completa cualquier bloque y pulsa <b>“Guardar…”</b> (ese botón es el que guarda tus respuestas).</li>
+            <li>Ve a <b>“📊 MIS RESPUESTAS”</b> para ver tu historial y evolución.</li>
+          </ul>
+
+          <p>Si entras otro día, usa el <b>mismo email</b> y la <b>misma clave</b> para recuperar tu cuaderno.</p>
+          <p><b>Sin email + clave:</b> la app <b>no guarda</b> y <b>no muestra</b> “Mis respuestas”.</p>
+          <p><b>Consejo:</b> usa una frase larga (difícil de adivinar) y guárdala en tu gestor de contraseñas.</p>
+        </div>
+        """,
+        unsafe_allow_html=True,
+    )
+
+    card_end()
+
+# ---------- BLOQUE 1 ----------
+elif menu == "Bloque 1: Vía Negativa":
+    bloque_1()
+
+elif menu == "Bloque 2: Aproximación/Retirada":
+    bloque_2()
+
+elif menu == "Bloque 3: Arquitectura Emocional":
+    bloque_3()
+
+elif menu == "Bloque 4: Raíz y Rama":
+    bloque_4()
+
+elif menu == "Bloque 5: Precisión Emocional":
+    bloque_5()
+
+elif menu == "Bloque 6: Detector de Sesgos":
+    bloque_6()
+
+elif menu == "Bloque 7: El Abogado del Diablo":
+    bloque_7()
+
+elif menu == "Bloque 8: Antifragilidad":
+    bloque_8()
+
+elif menu == "Bloque 9: El Nuevo Rumbo":
+    bloque_9()
+
 # ---------- MIS RESPUESTAS ----------
 elif menu == "📊 MIS RESPUESTAS":
     st.title("📊 Mis respuestas")
 
     if not has_identity():
         st.warning("Introduce tu **email** y tu **clave privada** en la barra lateral para ver tu historial privado.")
+        metrics.end_run()
         st.stop()
 
-    df = history_df()
-    if df.empty:
+    uid = get_user_uid()
+    qidx = get_query_index()
+    min_d, max_d = qidx.bounds()
+    tier = get_archive()
+    archived = tier.count() if tier is not None else 0
+    # Los bloques del archivo no se conocen sin leerlo: con archivo se ofrecen todos.
+    bloques_all = list(range(1, 10)) if archived else qidx.bloques()
+
+    if not st.session_state.historial and not archived:
         st.write("Aún no tienes registros guardados.")
     else:
-        df["fecha_sort"] = df["fecha"].apply(lambda x: to_sortable_date(x) if isinstance(x, str) else None)
-        df["ts_dt"] = pd.to_datetime(df["timestamp"], errors="coerce")
-        df["ts_date"] = df["ts_dt"].dt.date
-
-        min_d = df["ts_date"].dropna().min()
-        max_d = df["ts_date"].dropna().max()
-        if pd.isna(min_d) or pd.isna(max_d):
+        if min_d is None or max_d is None:
             min_d = date.today()
             max_d = date.today()
 
@@ -785,80 +1399,177 @@ elif menu == "📊 MIS RESPUESTAS":
         with f3:
             bloques_sel = st.multiselect(
                 "Bloques",
-                sorted(df["bloque"].dropna().unique().tolist()),
-                default=sorted(df["bloque"].dropna().unique().tolist()),
+                bloques_all,
+                default=bloques_all,
+            )
+        text_query = st.text_input("Buscar en tus respuestas", key="hist_search", placeholder="Palabras de concepto, respuesta o detalles")
+        if archived and tier.months_between(start, end) != tier.months():
+            st.caption(
+                f"🗄️ {archived} registros hasta {tier.months()[-1]} están archivados; "
+                "elige una fecha «Desde» anterior para verlos, buscarlos y exportarlos."
             )
 
-        dff = df[df["bloque"].isin(bloques_sel)].copy()
-        dff = dff[(dff["ts_date"].notna()) & (dff["ts_date"] >= start) & (dff["ts_date"] <= end)]
+        with metrics.phase("filter"):
+            page_key = (start, end, tuple(bloques_sel), text_query, history_version())
+            limit = history_page_limit(page_key)
+            view = history_view(start, end)
+            view_qidx = get_query_index(view)
+            result = query_history(start, end, bloques_sel, text=text_query, limit=limit, hist=view)
+            # Ya en el orden del índice (bloque → fecha → timestamp), el mismo con el que se
+            # pagina: "Cargar más" solo añade registros al final.
+            window = entries_frame(result.positions, view)
 
-        tab1, tab2 = st.tabs(["Historial", "Gráficos"])
+        tab1, tab2, tab3 = st.tabs(["Historial", "Gráficos", "Emociones"])
 
         with tab1:
-            st.markdown("### Historial por bloque → por fecha")
-            dff2 = dff.sort_values(by=["bloque", "fecha_sort", "timestamp"], ascending=[True, True, True])
-
-            for bloque in sorted(dff2["bloque"].unique()):
-                st.subheader(f"Bloque {bloque}")
-                bdf = dff2[dff2["bloque"] == bloque].copy()
-
-                bdf["group_date"] = bdf["fecha"].where(bdf["fecha"].astype(str).str.strip() != "", None)
-                bdf["group_date"] = bdf["group_date"].fillna(bdf["ts_date"].astype(str))
-
-                for gd in bdf["group_date"].unique():
-                    st.markdown(f"#### {gd}")
-                    gdf = bdf[bdf["group_date"] == gd]
-                    for _, row in gdf.iterrows():
-                        card(row.get("concepto", "") or "Registro", subtitle=None)
-                        resp = row.get("respuesta", "")
-                        if isinstance(resp, str) and resp.strip():
-                            st.write(resp)
-                        meta = row.get("meta", {})
-                        if isinstance(meta, dict) and meta:
-                            st.markdown("<div class='az-gap'></div>", unsafe_allow_html=True)
-                            st.caption("Detalles")
-                            for k, v in meta.items():
-                                if str(v).strip():
-                                    st.write(f"**{k.replace('_',' ').capitalize()}:** {v}")
-                        card_end()
-                        st.markdown("<div class='az-gap'></div>", unsafe_allow_html=True)
+            with metrics.phase("historial_render"):
+                st.markdown("### Historial por bloque → por fecha")
+                render_history_grouped(window, result.total, limit)
 
         with tab2:
-            st.markdown("### Visualización de datos")
-
-            daily = dff.dropna(subset=["ts_date"]).groupby("ts_date").size().reset_index(name="registros")
-            daily = daily.sort_values("ts_date")
-
-            if PLOTLY_AVAILABLE:
-                fig_line = px.line(daily, x="ts_date", y="registros", markers=True, title="Constancia (registros/día)")
-                st.plotly_chart(fig_line, use_container_width=True)
-            else:
-                if len(daily):
-                    st.line_chart(daily.set_index("ts_date"))
-
-            by_block = dff.groupby("bloque").size().reindex(range(1, 10), fill_value=0).reset_index(name="registros")
-            if PLOTLY_AVAILABLE:
-                fig_bar = px.bar(by_block, x="bloque", y="registros", title="Distribución por bloque")
-                st.plotly_chart(fig_bar, use_container_width=True)
-            else:
-                st.bar_chart(by_block.set_index("bloque"))
+            with metrics.phase("charts"):
+                st.markdown("### Visualización de datos")
+
+                rollup = get_rollup()
+                racha, racha_max = rollup.streaks()
+                m1, m2, m3, m4 = st.columns(4)
+                m1.metric("Racha actual", f"{racha} días")
+                m2.metric("Racha más larga", f"{racha_max} días")
+                m3.metric("Media 7 días", f"{rollup.cadence(7):.1f}/día")
+                m4.metric("Media 30 días", f"{rollup.cadence(30):.1f}/día")
+
+                def chart_counts():
+                    if text_query.strip():
+                        # Con búsqueda de texto el resumen no aplica: se cuenta sobre las posiciones filtradas.
+                        matches = result.all_positions()
+                        daily = pd.DataFrame(view_qidx.daily_counts(matches), columns=["ts_date", "registros"])
+                        by_block = pd.Series(view_qidx.bloque_counts(matches), dtype="int64")
+                    else:
+                        daily = pd.DataFrame(rollup.daily_counts(start, end, bloques_sel), columns=["ts_date", "registros"])
+                        by_block = pd.Series(rollup.bloque_counts(start, end, bloques_sel), dtype="int64")
+                    by_block = by_block.reindex(range(1, 10), fill_value=0).rename_axis("bloque").reset_index(name="registros")
+                    return daily, by_block
+
+                chart_key = repr((uid, start, end, tuple(bloques_sel), text_query, history_version()))
+                charts = chart_specs(chart_key, chart_counts)
+                if charts["freq"] != "D":
+                    st.caption(f"Rango largo: registros agrupados por {frames.CHART_FREQ_LABELS[charts['freq']]}.")
+
+                if PLOTLY_AVAILABLE:
+                    st.plotly_chart(charts["line"], width="stretch")
+                else:
+                    if len(charts["series"]):
+                        st.line_chart(charts["series"].set_index("ts_date"))
+
+                if PLOTLY_AVAILABLE:
+                    st.plotly_chart(charts["bar"], width="stretch")
+                else:
+                    st.bar_chart(charts["by_block"].set_index("bloque"))
+
+        with tab3:
+            with metrics.phase("emotions"):
+                st.markdown("### Emociones por semana")
+                st.caption("Bloques 3, 4 y 5: emoción automática, primaria, secundaria y emociones precisas.")
+                if text_query.strip():
+                    # Con búsqueda de texto se cuenta solo sobre los registros encontrados.
+                    emo = stats.EmotionRollup.from_history((view[i] for i in result.all_positions()), EMOTIONS)
+                else:
+                    emo = get_emotion_rollup()
+                top_n = st.slider("Emociones a mostrar", min_value=3, max_value=15, value=8, key="emo_top_n")
+                top = [e for e, _ in emo.top_emotions(top_n, start, end, bloques_sel)]
+                weeks = emo.week_counts(start, end, bloques_sel)
+
+                if not top:
+                    st.write("No hay emociones registradas en este rango.")
+                else:
+                    heat = pd.DataFrame(
+                        [[weeks[w].get(e, 0) for w in weeks] for e in top],
+                        index=top,
+                        columns=[w.strftime("%d/%m/%Y") for w in weeks],
+                    )
+                    if PLOTLY_AVAILABLE:
+                        fig_heat = px.imshow(
+                            heat,
+                            aspect="auto",
+                            color_continuous_scale="Blues",
+                            labels={"x": "Semana", "y": "Emoción", "color": "Registros"},
+                            title="Frecuencia por semana",
+                        )
+                        st.plotly_chart(fig_heat, width="stretch")
+                    else:
+                        st.dataframe(heat, width="stretch")
+
+                    st.markdown("#### Más frecuentes cada semana")
+                    per_week = emo.top_per_week(3, start, end, bloques_sel)
+                    st.dataframe(
+                        pd.DataFrame(
+                            {
+                                "Semana": [w.strftime("%d/%m/%Y") for w, _ in per_week],
+                                "Emociones": [", ".join(f"{e} ({n})" for e, n in items) for _, items in per_week],
+                            }
+                        ),
+                        hide_index=True,
+                        width="stretch",
+                    )
 
         st.write("")
         c1, c2 = st.columns([0.55, 0.45])
         with c1:
-            _, export_file = get_user_storage_paths()
-            export_path = export_file if export_file is not None else (DATA_DIR / "history_export.csv")
-
-            export_cols = ["timestamp", "bloque", "fecha", "concepto", "respuesta", "meta"]
-            dff_export = dff.copy()[export_cols]
-            dff_export.to_csv(export_path, index=False, encoding="utf-8")
+            export_fmt = st.selectbox("Formato de exportación", list(export.EXPORT_FORMATS), key="export_fmt")
+            ext, mime = export.EXPORT_FORMATS[export_fmt]
+            export_key = hashlib.sha1(
+                repr((uid, start, end, tuple(bloques_sel), text_query, history_version(), export_fmt)).encode("utf-8")
+            ).hexdigest()
             st.download_button(
-                "Descargar CSV (filtrado)",
-                data=export_path.read_bytes(),
-                file_name="azimut_historial_filtrado.csv",
+                f"Descargar {export_fmt} (filtrado)",
+                data=lazy_export(result.all_positions, view, export_fmt, export_key),
+                file_name=f"azimut_historial_filtrado.{ext}",
+                mime=mime,
+            )
+            st.caption(
+                "La columna `fecha` se exporta como AAAA-MM-DD. Los ficheros exportados antes "
+                "(DD/MM/AAAA) se siguen pudiendo importar."
             )
         with c2:
             if st.button("Limpiar historial"):
-                st.session_state.historial = []
                 save_history([])
+                clear_history_index()
+                clear_rollup()
+                clear_emotion_rollup()
+                st.session_state.pop("_query_index", None)
+                st.session_state.historial = load_history()
+                bump_history_version()
+                metrics.end_run(complete=False)
                 st.rerun()
+
+    st.write("")
+    with st.expander("Importar historial (CSV / JSONL / JSON exportado)"):
+        st.caption("Se añaden los registros que no tengas ya; los duplicados se ignoran.")
+        upload = st.file_uploader("Fichero exportado", type=list(importer.IMPORT_FORMATS), key="import_file")
+        if upload is not None and st.button("Importar", key="import_run"):
+            fmt = importer.detect_format(upload.name)
+            if fmt is None:
+                st.error("Formato no reconocido.")
+            else:
+                report = import_history(upload, fmt)
+                st.session_state.import_report = report
+                metrics.end_run(complete=False)
+                st.rerun()
+        report = st.session_state.get("import_report")
+        if report is not None:
+            if report.failed is not None:
+                st.error(f"No se ha importado nada: {report.failed}.")
+            elif report.rejected and not report.imported:
+                st.error(
+                    f"No se ha importado nada: {report.rejected} de {report.read} registros descartados "
+                    f"({report.duplicates} duplicados)."
+                )
+            else:
+                st.success(
+                    f"Importados {report.imported} de {report.read} registros "
+                    f"({report.duplicates} duplicados, {report.rejected} descartados)."
+                )
+            for err in report.errors:
+                st.caption(err)
+
+metrics.end_run()
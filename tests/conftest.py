@@ -0,0 +1,24 @@
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import azimut_schema as schema  # noqa: E402
+
+
+def make_history(n: int, start: datetime, step: timedelta = timedelta(hours=9)) -> list:
+    # Registros v2 válidos, ordenados, repartidos entre los 9 bloques.
+    return [
+        schema.make_entry(1 + i % 9, start + step * i, f"concepto {i % 5}", f"respuesta {i}", None, now=start + step * i)
+        for i in range(n)
+    ]
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    d = tmp_path / "data"
+    d.mkdir()
+    return d
@@ -0,0 +1,32 @@
+from datetime import date
+
+import azimut_analytics as analytics
+
+AS_OF_DAY = date(2024, 6, 1).toordinal() - date(1970, 1, 1).toordinal()
+
+
+def _records(n, fail_after=None):
+    for i in range(n):
+        if i == fail_after:
+            raise ValueError("fichero dañado")
+        yield i * 86400, 6, f"{analytics.SESGO_PREFIX}confirmación", "r", {}
+
+
+def test_failed_read_leaves_no_partial_counts():
+    part = analytics.Partial()
+    part.add_user(_records(3), AS_OF_DAY)
+    before = {k: (dict(v) if isinstance(v, dict) else v) for k, v in vars(part).items()}
+    try:
+        part.add_user(_records(5, fail_after=3), AS_OF_DAY)
+    except ValueError:
+        pass
+    assert vars(part) == before
+
+
+def test_fields_filled_respects_min_users():
+    part = analytics.Partial()
+    for fields in (1, 1, 1, 3):
+        meta = dict.fromkeys(("bloque_util", "dificil", "mejor", "rumbo")[:fields], "x")
+        part.add_user([(0, 9, "Integración — Cierre", "", meta)], AS_OF_DAY)
+    summary = analytics.summarize(part, date(2024, 6, 1), min_users=3)
+    assert summary["bloque9"]["fields_filled"] == {"1": 3}
@@ -0,0 +1,54 @@
+from datetime import datetime
+
+import azimut_cache as cache
+from conftest import make_history
+
+HIST = make_history(50, datetime(2024, 1, 1))
+
+
+def _loader(n=50):
+    return lambda: HIST[:n]
+
+
+def _size(n=50):
+    return cache.ColumnarHistory.from_entries(HIST[:n]).nbytes
+
+
+def test_least_recently_used_is_evicted_first():
+    lru = cache.HistoryCache(max_bytes=_size() * 2)
+    a = lru.get("a", _loader())
+    lru.get("b", _loader())
+    assert lru.get("a", _loader()) is a  # acierto: "a" pasa a ser la más reciente
+    lru.get("c", _loader())
+    assert len(lru) == 2 and lru.total_bytes() <= lru.max_bytes
+    assert lru.get("a", _loader()) is a
+    # "b" salió de la caché: se vuelve a cargar.
+    assert len(lru.get("b", lambda: [])) == 0
+
+
+def test_in_place_appends_are_bounded_on_the_next_hit():
+    lru = cache.HistoryCache(max_bytes=_size(25) * 2)
+    lru.get("a", _loader(25))
+    b = lru.get("b", _loader(25))
+    for e in HIST[25:]:
+        b.append(e)
+    assert lru.total_bytes() > lru.max_bytes
+    assert lru.get("b", _loader()) is b
+    assert len(lru) == 1
+    assert len(lru.get("a", lambda: [])) == 0
+
+
+def test_the_entry_in_use_is_never_evicted():
+    lru = cache.HistoryCache(max_bytes=1)
+    h = lru.get("a", _loader())
+    assert lru.get("a", _loader()) is h
+    lru.get("b", _loader())
+    assert len(lru) == 1
+
+
+def test_invalidate_reloads():
+    lru = cache.HistoryCache()
+    h = lru.get("a", _loader())
+    lru.invalidate("a")
+    assert lru.get("a", _loader(10)) is not h
+    assert len(lru.get("a", _loader())) == 10
@@ -0,0 +1,55 @@
+import json
+import pickle
+
+import pytest
+
+import azimut_corpus as corpus
+import azimut_search as search
+
+TEXT = "\n\n".join(
+    f"BLOQUE {b}\n\nEl miedo aparece cuando la decisión {b} se retrasa.\n\nLa calma llega al cerrar el bloque {b}."
+    for b in range(1, 10)
+)
+
+
+@pytest.fixture
+def sources(tmp_path):
+    path = tmp_path / "azimut.txt"
+    path.write_text(TEXT, encoding="utf-8")
+    return {"azimut": path}
+
+
+def _corpus(sources, cache_dir):
+    return corpus.Corpus(sources, cache_dir, emotions_fn=lambda text: ["Miedo"], emotions_source="azimut")
+
+
+def test_bm25_index_is_stored_as_data_and_reused(sources, data_dir, monkeypatch):
+    expected = _corpus(sources, data_dir).index().search("decisión 4 miedo")
+    assert expected and "decisión 4" in expected[0]["text"]
+    head = json.loads((data_dir / corpus.CORPUS_BM25_FILE).read_bytes().split(b"\n", 1)[0])
+    assert head["version"] == corpus.CORPUS_CACHE_VERSION and head["bm25"]["n_docs"] == len(head["passages"])
+
+    # Otro proceso: lo lee del disco sin volver a tokenizar el corpus.
+    def rebuild(*args):
+        raise AssertionError("reconstruido")
+
+    monkeypatch.setattr(search.CorpusIndex, "add_document", rebuild)
+    assert _corpus(sources, data_dir).index().search("decisión 4 miedo") == expected
+
+
+@pytest.mark.parametrize("damage", [lambda b: b[:-6], lambda b: b[: b.index(b"\n") // 2], lambda b: b"\0" + b])
+def test_damaged_index_is_rebuilt(sources, data_dir, damage):
+    expected = _corpus(sources, data_dir).index().search("calma bloque 7")
+    path = data_dir / corpus.CORPUS_BM25_FILE
+    path.write_bytes(damage(path.read_bytes()))
+    assert _corpus(sources, data_dir).index().search("calma bloque 7") == expected
+
+
+def test_legacy_pickle_is_deleted_without_loading(sources, data_dir, monkeypatch):
+    _corpus(sources, data_dir).meta()
+    legacy = data_dir / "corpus_bm25.pkl"
+    legacy.write_bytes(pickle.dumps({"version": corpus.CORPUS_CACHE_VERSION}))
+    monkeypatch.setattr(pickle, "load", lambda *a, **k: pytest.fail("pickle leído"))
+    monkeypatch.setattr(pickle, "loads", lambda *a, **k: pytest.fail("pickle leído"))
+    assert _corpus(sources, data_dir).index().search("miedo")
+    assert not legacy.exists()
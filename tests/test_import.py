@@ -0,0 +1,137 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import azimut_cache as cache
+import azimut_export as export
+import azimut_frames as frames
+import azimut_import as importer
+import azimut_storage as storage
+from conftest import make_history
+
+UID = "ab12cd34ef56ab78"
+FORMATS = ["CSV", "JSONL"] + (["Parquet"] if export.PARQUET_AVAILABLE else [])
+
+
+def _export(hist, fmt: str) -> bytes:
+    return export.export_bytes(export.frame_chunks(frames.entries_df(list(hist)), rows=700), fmt)
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_reimport_of_own_export_is_all_duplicates(fmt):
+    hist = make_history(300, datetime(2024, 1, 1))
+    report = importer.ImportReport()
+    new = list(importer.read_entries(_export(hist, fmt), fmt, importer.history_hashes(hist), report))
+    assert new == []
+    assert (report.read, report.duplicates, report.rejected) == (300, 300, 0)
+
+
+def test_duplicates_inside_the_file_are_dropped():
+    hist = make_history(20, datetime(2024, 1, 1))
+    data = _export(hist + hist, "JSONL")
+    report = importer.ImportReport()
+    new = list(importer.read_entries(data, "JSONL", set(), report))
+    assert len(new) == 20
+    assert report.duplicates == 20
+
+
+def test_legacy_and_current_records_hash_alike():
+    e = make_history(1, datetime(2024, 5, 6, 7, 8, 9))[0]
+    legacy = {k: v for k, v in e.items() if k not in ("v", "ts")}
+    legacy["timestamp"] = "2024-05-06 07:08:09"
+    legacy["fecha"] = "06/05/2024"
+    assert importer.entry_hash(legacy) == importer.entry_hash(e)
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_reimport_of_archived_history_export(data_dir, fmt):
+    # Export del historial completo (archivo + caliente) y reimportación: nada es nuevo.
+    store = storage.JsonHistoryStore(data_dir, archive_after_days=365)
+    start = datetime.combine(date.today() - timedelta(days=1000), datetime.min.time())
+    store.save(UID, make_history(3000, start, timedelta(hours=7)))
+    hot = cache.ColumnarHistory.from_entries(store.load(UID))
+    tier = store.archive(UID)
+    assert tier.count() > 0 and len(hot) > 0
+    full = cache.TieredHistory(tier, hot)
+    assert len(full) == 3000
+
+    report = importer.ImportReport()
+    new = list(importer.read_entries(_export(full, fmt), fmt, importer.history_hashes(full), report))
+    assert new == []
+    assert report.duplicates == 3000
+
+    # Solo con el caliente, lo archivado volvería a entrar.
+    report = importer.ImportReport()
+    new = list(importer.read_entries(_export(full, fmt), fmt, importer.history_hashes(hot), report))
+    assert len(new) == tier.count()
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_import_of_exports_with_legacy_fecha(fmt):
+    # Exports anteriores al esquema v2: `fecha` como DD/MM/YYYY.
+    hist = make_history(50, datetime(2024, 2, 1))
+    df = frames.entries_df(hist)
+    iso = df["fecha"].copy()
+    df["fecha"] = [f"{d[8:10]}/{d[5:7]}/{d[:4]}" for d in iso]
+    data = export.export_bytes(export.frame_chunks(df), fmt)
+
+    report = importer.ImportReport()
+    new = list(importer.read_entries(data, fmt, set(), report))
+    assert report.rejected == 0
+    assert [e["fecha"] for e in new] == list(iso)
+    # Y son los mismos registros que los de un export actual.
+    assert importer.history_hashes(new) == importer.history_hashes(hist)
+
+
+def test_json_array_and_v2_records(tmp_path):
+    # El propio history_{uid}.json: una lista de registros v2 (ts, sin timestamp).
+    hist = make_history(40, datetime(2024, 3, 1))
+    history_file = tmp_path / f"history_{UID}.json"
+    storage.write_history(history_file, hist)
+    fmt = importer.detect_format(history_file.name)
+    report = importer.ImportReport()
+    new = list(importer.read_entries(history_file.read_bytes(), fmt, set(), report))
+    assert (report.read, report.rejected, report.failed) == (40, 0, None)
+    assert importer.history_hashes(new) == importer.history_hashes(hist)
+
+    # Los mismos registros v2 en JSONL.
+    data = "".join(storage.json.dumps(e) + "\n" for e in hist).encode("utf-8")
+    report = importer.ImportReport()
+    assert len(list(importer.read_entries(data, "JSONL", set(), report))) == 40
+
+
+def test_malformed_jsonl_lines_are_rejected():
+    hist = make_history(5, datetime(2024, 3, 1))
+    lines = [storage.json.dumps(e).encode("utf-8") for e in hist]
+    lines[1] = lines[1][:20]  # línea cortada
+    lines[3] = b'{"respuesta": "\xff\xfe"}'  # no es UTF-8
+    report = importer.ImportReport()
+    new = list(importer.read_entries(b"\n".join(lines) + b"\n", "JSONL", set(), report))
+    assert [e["respuesta"] for e in new] == [hist[0]["respuesta"], hist[2]["respuesta"], hist[4]["respuesta"]]
+    assert (report.read, report.rejected, report.failed) == (5, 2, None)
+    assert report.errors == ["fila 2: línea JSON ilegible", "fila 4: línea JSON ilegible"]
+
+
+def test_csv_with_non_utf8_bytes_rejects_the_row():
+    hist = make_history(3, datetime(2024, 3, 1))
+    data = _export(hist, "CSV").replace(b"respuesta 1", b"respuesta \xe9")
+    report = importer.ImportReport()
+    new = list(importer.read_entries(data, "CSV", set(), report))
+    assert len(new) == 2
+    assert (report.rejected, report.failed) == (1, None)
+    assert report.errors == ["fila 2: texto que no es UTF-8"]
+
+
+@pytest.mark.parametrize(
+    "data, fmt",
+    [
+        (b"[{", "JSON"),
+        (b'{"timestamp": "2024-01-01 00:00:00"}', "JSON"),
+        (b"\xff\xfe\x00", "JSON"),
+        (b'timestamp,bloque\n"2024-01-01 00:00:00,1\n', "CSV"),
+    ],
+)
+def test_unreadable_files_are_reported(data, fmt):
+    report = importer.ImportReport()
+    assert list(importer.read_entries(data, fmt, set(), report)) == []
+    assert report.failed
@@ -0,0 +1,114 @@
+import random
+from datetime import date, datetime, timedelta
+
+import azimut_cache as cache
+import azimut_query as query
+import azimut_schema as schema
+from conftest import make_history
+
+
+def _shuffled_history(n=400, seed=3):
+    rng = random.Random(seed)
+    t0 = datetime(2024, 1, 1)
+    return [
+        schema.make_entry(rng.randint(1, 9), None, "c", f"r{i}", None, now=t0 + timedelta(minutes=rng.randint(0, 90 * 1440)))
+        for i in range(n)
+    ]
+
+
+def _expected_order(hist, start=None, end=None, bloques=None):
+    keyed = []
+    for pos, e in enumerate(hist):
+        day = schema.entry_day(e)
+        if (start is None or day >= start) and (end is None or day <= end) and (bloques is None or e["bloque"] in bloques):
+            keyed.append((e["bloque"], e["fecha"] or day.isoformat(), e["ts"], pos))
+    return [pos for *_, pos in sorted(keyed)]
+
+
+def test_query_orders_by_bloque_then_timestamp():
+    hist = _shuffled_history()
+    idx = query.HistoryQueryIndex.from_history(cache.ColumnarHistory.from_entries(hist))
+    start, end = date(2024, 1, 20), date(2024, 2, 20)
+    result = idx.query(start, end, [2, 5, 7])
+    assert result.all_positions() == _expected_order(hist, start, end, {2, 5, 7})
+    assert result.total == len(result.all_positions())
+
+
+def test_larger_page_extends_the_smaller_one():
+    # "Cargar más": la página nueva empieza por la anterior, sin reordenar nada.
+    hist = _shuffled_history()
+    idx = query.HistoryQueryIndex.from_history(hist)
+    everything = idx.query(bloques=range(1, 10)).all_positions()
+    previous = []
+    for limit in (50, 100, 150, 1000):
+        page = idx.query(bloques=range(1, 10), limit=limit).positions
+        assert page[: len(previous)] == previous
+        assert page == everything[:limit]
+        previous = page
+
+
+def test_offset_pages_concatenate_to_everything():
+    hist = _shuffled_history()
+    idx = query.HistoryQueryIndex.from_history(hist)
+    pages = [idx.query(None, None, [1, 3, 9], limit=25, offset=o).positions for o in range(0, 400, 25)]
+    assert sum(pages, []) == idx.query(None, None, [1, 3, 9]).all_positions()
+
+
+def test_text_hits_use_the_same_order():
+    hist = _shuffled_history()
+    idx = query.HistoryQueryIndex.from_history(hist)
+    hits = set(range(0, len(hist), 3))
+    expected = [p for p in _expected_order(hist) if p in hits]
+    assert idx.query(hits=hits).all_positions() == expected
+    assert idx.query(hits=hits, limit=10).positions == expected[:10]
+
+
+def test_added_entries_keep_the_order():
+    hist = make_history(100, datetime(2024, 3, 1))
+    idx = query.HistoryQueryIndex.from_history(hist)
+    # Uno al final y uno más antiguo que todo (importación).
+    hist.append(schema.make_entry(4, None, "c", "nuevo", None, now=datetime(2024, 6, 1)))
+    hist.append(schema.make_entry(4, None, "c", "antiguo", None, now=datetime(2023, 1, 1)))
+    idx.add(len(hist) - 2, hist[-2])
+    idx.add(len(hist) - 1, hist[-1])
+    assert idx.query().all_positions() == _expected_order(hist)
+    assert idx.bounds() == (date(2023, 1, 1), date(2024, 6, 1))
+
+
+def test_all_positions_survive_an_older_insert():
+    # El export pide all_positions() después de la consulta; una importación
+    # intermedia con registros antiguos desplaza los índices de las listas.
+    hist = make_history(100, datetime(2024, 3, 1))
+    idx = query.HistoryQueryIndex.from_history(hist)
+    result = idx.query(date(2024, 3, 10), date(2024, 3, 20), [1, 2, 3], limit=10)
+    hist.append(schema.make_entry(2, None, "c", "antiguo", None, now=datetime(2024, 3, 12)))
+    idx.add(len(hist) - 1, hist[-1])
+    expected = _expected_order(hist, date(2024, 3, 10), date(2024, 3, 20), {1, 2, 3})
+    assert result.all_positions() == expected
+
+
+def _backdated_history():
+    # Algunos registros con la fecha elegida a mano (días antes o después del timestamp).
+    hist = make_history(300, datetime(2024, 3, 1))
+    for i in range(0, len(hist), 7):
+        hist[i]["fecha"] = (schema.entry_day(hist[i]) - timedelta(days=(i % 5 - 2) * 6 or 9)).isoformat()
+    return hist
+
+
+def test_backdated_entries_keep_one_heading_per_date():
+    hist = _backdated_history()
+    for idx in (
+        query.HistoryQueryIndex.from_history(hist),
+        query.HistoryQueryIndex.from_history(cache.ColumnarHistory.from_entries(hist)),
+    ):
+        start, end = date(2024, 3, 5), date(2024, 4, 10)
+        everything = idx.query(start, end).all_positions()
+        assert everything == _expected_order(hist, start, end)
+        # Páginas seguidas y con texto: el mismo orden.
+        pages = [idx.query(start, end, limit=17, offset=o).positions for o in range(0, len(everything), 17)]
+        assert sum(pages, []) == everything
+        assert idx.query(start, end, hits=range(len(hist))).all_positions() == everything
+        # Cada (bloque, fecha) es un solo tramo.
+        keys = [(hist[p]["bloque"], hist[p]["fecha"]) for p in everything]
+        runs = [k for i, k in enumerate(keys) if i == 0 or k != keys[i - 1]]
+        assert len(runs) == len(set(runs))
@@ -0,0 +1,355 @@
+import json
+import shutil
+import threading
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import azimut_schema as schema
+import azimut_storage as storage
+from conftest import make_history
+
+
+def _interrupted_compaction(history_file, hist):
+    # Snapshot escrito pero diario sin borrar: lo que deja una caída entre los dos pasos.
+    jpath = storage.journal_path(history_file)
+    shutil.copy(jpath, jpath.with_name("kept"))
+    storage.compact_history(history_file, hist)
+    shutil.move(jpath.with_name("kept"), jpath)
+
+
+def test_identical_saves_are_kept(tmp_path):
+    history_file = tmp_path / "history_u.json"
+    hist = make_history(5, datetime(2024, 1, 1))
+    storage.write_history(history_file, hist)
+    # El mismo registro que cierra el snapshot, guardado otra vez.
+    storage.append_history(history_file, hist[-1])
+    assert storage.read_history(history_file) == hist + [hist[-1]]
+
+
+def test_interrupted_compaction_does_not_duplicate(tmp_path):
+    history_file = tmp_path / "history_u.json"
+    hist = make_history(10, datetime(2024, 1, 1))
+    storage.write_history(history_file, hist[:6])
+    storage.extend_history(history_file, hist[6:])
+    _interrupted_compaction(history_file, hist)
+    assert storage.read_history(history_file) == hist
+
+    # Lo que se guarde después no se pierde con el diario sobrante.
+    extra = schema.make_entry(3, None, "c", "después", None, now=datetime(2024, 2, 1))
+    storage.append_history(history_file, extra)
+    assert storage.read_history(history_file) == hist + [extra]
+
+
+def test_save_over_a_journal_replaces_it(tmp_path):
+    # Limpiar el historial con un diario pendiente y caer antes de borrarlo.
+    history_file = tmp_path / "history_u.json"
+    hist = make_history(4, datetime(2024, 1, 1))
+    storage.extend_history(history_file, hist)
+    _interrupted_compaction(history_file, [])
+    assert storage.read_history(history_file) == []
+
+
+def test_legacy_journal_without_header(tmp_path):
+    history_file = tmp_path / "history_u.json"
+    hist = make_history(6, datetime(2024, 1, 1))
+    storage.write_history(history_file, hist[:3])
+    storage.journal_path(history_file).write_text(
+        "".join(json.dumps(e) + "\n" for e in hist[3:5]), encoding="utf-8"
+    )
+    storage.append_history(history_file, hist[5])
+    assert storage.read_history(history_file) == hist
+
+
+# ---------- estructura plana → por prefijo ----------
+UID = "ab12cd34ef56ab78"
+OTHER_UID = "cd34ef56ab78ab12"
+
+
+def _flat_user(data_dir, uid, hist):
+    storage.write_history(data_dir / f"history_{uid}.json", hist[:-2])
+    storage.extend_history(data_dir / f"history_{uid}.json", hist[-2:])
+    (data_dir / f"search_{uid}.jsonl").write_text("{}\n", encoding="utf-8")
+
+
+def test_flat_user_is_migrated_on_access(data_dir):
+    hist = make_history(30, datetime(2024, 1, 1))
+    _flat_user(data_dir, UID, hist)
+    store = storage.JsonHistoryStore(data_dir, archive_after_days=0)
+    assert store.load(UID) == hist
+    user_dir = data_dir / storage.USERS_DIR / UID[:2] / UID
+    assert sorted(p.name for p in user_dir.iterdir() if p.suffix != ".lock") == [
+        f"history_{UID}.json",
+        f"history_{UID}.jsonl",
+        f"search_{UID}.jsonl",
+    ]
+    assert not list(data_dir.glob(f"*{UID}*"))
+    assert store.layout.index.get(UID)["entries"] == len(hist)
+
+
+def test_background_migration_moves_everyone(data_dir):
+    hists = {uid: make_history(10, datetime(2024, 1, 1 + i)) for i, uid in enumerate((UID, OTHER_UID))}
+    for uid, hist in hists.items():
+        _flat_user(data_dir, uid, hist)
+    layout = storage.UserLayout(data_dir)
+    assert layout.migrate_all(pause=0) == 2
+    assert layout.legacy_uids() == set()
+    assert layout.uids() == set(hists)
+    store = storage.JsonHistoryStore(data_dir, archive_after_days=0)
+    assert {uid: store.load(uid) for uid in hists} == hists
+
+
+def test_interrupted_migration_keeps_the_moved_copy(data_dir):
+    # Caída tras el renombrado y antes de borrar los planos.
+    hist = make_history(10, datetime(2024, 1, 1))
+    _flat_user(data_dir, UID, hist)
+    storage.UserLayout(data_dir).migrate_all(pause=0)
+    _flat_user(data_dir, UID, hist)
+    store = storage.JsonHistoryStore(data_dir, archive_after_days=0)
+    assert store.load(UID) == hist
+    assert not list(data_dir.glob(f"*{UID}*"))
+
+
+def test_migration_deletes_legacy_export_copies(data_dir):
+    # history_export_{uid}.csv: copia en claro de la versión anterior, no se mueve.
+    hist = make_history(10, datetime(2024, 1, 1))
+    _flat_user(data_dir, UID, hist)
+    (data_dir / f"history_export_{UID}.csv").write_text("timestamp\n", encoding="utf-8")
+    (data_dir / f"history_export_{OTHER_UID}.csv").write_text("timestamp\n", encoding="utf-8")
+    layout = storage.UserLayout(data_dir)
+    assert layout.legacy_uids() == {UID, OTHER_UID}
+    assert layout.migrate_all(pause=0) == 1
+    assert not list(data_dir.glob("history_export_*"))
+    assert not list((data_dir / storage.USERS_DIR).rglob("history_export_*"))
+    assert layout.legacy_uids() == set()
+
+
+def test_user_index_compaction_keeps_other_workers_records(data_dir, monkeypatch):
+    # Dos workers (dos instancias) sobre el mismo users_index.jsonl.
+    monkeypatch.setattr(storage, "USER_INDEX_MIN_COMPACT", 10)
+    path = data_dir / storage.USER_INDEX_FILE
+    a, b = storage.UserIndex(path), storage.UserIndex(path)
+    a.record("u0", 100, 1)
+    assert b.get("u0")["entries"] == 1
+    for i in range(1, 30):
+        b.record(f"u{i}", 100, i)
+    b.record("u0", 200, 7)
+    # `a` compacta varias veces con su vista de hace rato: nada de `b` se pierde.
+    for _ in range(30):
+        a.record("a", 1, None)
+    users = storage.UserIndex(path).all()
+    assert set(users) == {"a"} | {f"u{i}" for i in range(30)}
+    assert users["u0"]["entries"] == 7 and users["a"]["entries"] == 30
+    assert len(path.read_text(encoding="utf-8").splitlines()) <= 2 * len(users)
+
+
+def test_sqlite_index_records_no_size(data_dir):
+    store = storage.open_store("sqlite", data_dir, archive_after_days=0)
+    store.save(UID, make_history(3, datetime(2024, 1, 1)))
+    rec = store.layout.index.get(UID)
+    assert rec["entries"] == 3 and "size" not in rec
+
+
+# ---------- archivo frío ----------
+def _old_and_recent(days=1000):
+    return make_history(days * 24 // 7, datetime.combine(date.today() - timedelta(days=days), datetime.min.time()), timedelta(hours=7))
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_archive_round_trip(data_dir, backend):
+    hist = _old_and_recent()
+    storage.open_store(backend, data_dir, archive_after_days=0).save(UID, hist)
+    store = storage.open_store(backend, data_dir, archive_after_days=365)
+    hot = store.load(UID)
+    tier = store.archive(UID)
+    cutoff = storage.archive_cutoff(after_days=365)
+    assert tier.months() and hot
+    assert all(schema.entry_ts(e) >= cutoff for e in hot)
+    assert tier.count() == len(hist) - len(hot)
+    assert [schema.entry_ts(e) for e in list(tier.entries()) + hot] == [schema.entry_ts(e) for e in hist]
+    # Cargar otra vez no mueve nada más.
+    assert store.load(UID) == hot
+    assert tier.count() == len(hist) - len(hot)
+
+
+def test_interrupted_archive_move_is_completed_on_load(data_dir):
+    # Segmentos y manifiesto con `pending` escritos, historial caliente sin reescribir.
+    hist = _old_and_recent()
+    store = storage.JsonHistoryStore(data_dir, archive_after_days=365)
+    store.save(UID, hist)
+    cutoff = storage.archive_cutoff(after_days=365)
+    old = [e for e in hist if schema.entry_ts(e) < cutoff]
+    store.archive(UID).add(old, cutoff)
+    hot = store.load(UID)
+    assert store.archive(UID).pending() is None
+    assert list(store.archive(UID).entries()) + hot == hist
+    assert storage.read_history(store.history_file(UID)) == hot
+
+
+# ---------- SQLite: filtros en SQL ----------
+def test_sqlite_query_filters_by_date_and_bloque(data_dir):
+    hist = make_history(500, datetime(2024, 1, 1))
+    store = storage.SQLiteHistoryStore(data_dir / storage.SQLITE_FILE, archive_after_days=0)
+    store.save(UID, hist)
+    start, end = date(2024, 1, 20), date(2024, 2, 10)
+    expected = [e for e in hist if start <= schema.entry_day(e) <= end and e["bloque"] in (2, 5)]
+    got = store.query(UID, start, end, [2, 5])
+    assert [schema.entry_ts(e) for e in got] == [schema.entry_ts(e) for e in expected]
+    assert store.query(UID, bloques=[]) == []
+    lo, hi, bloques = store.bounds(UID)
+    assert (lo, hi, bloques) == (schema.entry_timestamp(hist[0]), schema.entry_timestamp(hist[-1]), list(range(1, 10)))
+
+
+def test_sqlite_filters_use_the_indexes(data_dir):
+    store = storage.SQLiteHistoryStore(data_dir / storage.SQLITE_FILE, archive_after_days=0)
+    with store.connection() as con:
+        names = {r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert {"idx_entries_uid_ts", "idx_entries_uid_bloque"} <= names
+        plan = " ".join(
+            str(r[-1])
+            for r in con.execute("EXPLAIN QUERY PLAN SELECT * FROM entries WHERE uid = ? AND bloque IN (1, 2)", (UID,))
+        )
+        assert "idx_entries_uid_bloque" in plan
+
+
+# ---------- cambios de otros escritores ----------
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_changed_sees_other_writers_only(data_dir, backend):
+    hist = make_history(6, datetime(2024, 1, 1))
+    mine = storage.open_store(backend, data_dir, archive_after_days=0)
+    other = storage.open_store(backend, data_dir, archive_after_days=0)
+    mine.save(UID, hist[:3])
+    mine.load(UID)
+    mine.extend(UID, hist[3:4], None, 4)
+    assert not mine.changed(UID)
+    # Otro proceso / réplica (otra instancia) escribe: se detecta hasta recargar.
+    other.extend(UID, hist[4:], None, 6)
+    assert mine.changed(UID)
+    assert [schema.entry_ts(e) for e in mine.load(UID)] == [schema.entry_ts(e) for e in hist]
+    assert not mine.changed(UID)
+
+
+def test_queued_own_write_is_pending_until_recorded(data_dir):
+    # El fichero cambia antes de que el store anote la versión: en ese hueco
+    # `changed` da True, pero el uid sigue con escrituras pendientes.
+    store = storage.JsonHistoryStore(data_dir, archive_after_days=0)
+    hist = make_history(4, datetime(2024, 1, 1))
+    store.save(UID, hist[:3])
+    store.load(UID)
+    on_disk, release = threading.Event(), threading.Event()
+    wrote = store.versions.wrote
+
+    def slow_wrote(*args):
+        on_disk.set()
+        release.wait(5)
+        wrote(*args)
+
+    store.versions.wrote = slow_wrote
+    writer = storage.WriteBehind(store)
+    ticket = writer.append(UID, hist[3:], 4)
+    assert writer.pending(UID)
+    assert on_disk.wait(5)
+    assert store.changed(UID) and writer.pending(UID)
+    release.set()
+    assert ticket.wait(5) and ticket.error is None
+    assert writer.drain(5)
+    assert not writer.pending(UID) and not store.changed(UID)
+
+
+def test_file_lock_excludes_other_layouts(data_dir):
+    # Dos UserLayout (como dos procesos): el segundo espera al flock del primero.
+    a, b = storage.UserLayout(data_dir), storage.UserLayout(data_dir)
+    order = []
+    held = threading.Event()
+
+    def other():
+        held.wait(5)
+        with b.file_lock(UID):
+            order.append("b")
+
+    t = threading.Thread(target=other)
+    t.start()
+    with a.file_lock(UID):
+        with a.file_lock(UID):  # reentrante en el mismo layout
+            held.set()
+            t.join(0.2)
+            assert t.is_alive()
+            order.append("a")
+    t.join(5)
+    assert order == ["a", "b"]
+
+
+# ---------- escritura en segundo plano ----------
+class _GatedStore(storage.JsonHistoryStore):
+    # La primera escritura espera a `gate`: lo encolado mientras tanto va en un lote.
+    def __init__(self, data_dir, fail=False):
+        super().__init__(data_dir, archive_after_days=0)
+        self.gate = threading.Event()
+        self.fail = fail
+
+    def extend(self, uid, entries, hist=None, n_entries=None):
+        self.gate.wait(5)
+        if self.fail:
+            raise OSError("disco lleno")
+        super().extend(uid, entries, hist, n_entries)
+
+
+def test_write_behind_coalesces_and_save_drops_earlier_entries(data_dir):
+    store = _GatedStore(data_dir)
+    writer = storage.WriteBehind(store)
+    hist = make_history(5, datetime(2024, 1, 1))
+    first = writer.append(UID, hist[:1], 1)
+    queued = [writer.append(UID, hist[1:3], 3), writer.save(UID, []), writer.append(UID, hist[3:], 2)]
+    path = data_dir / "rollup.json"
+    writes = [writer.write_text(path, "viejo"), writer.write_text(path, "nuevo")]
+    lines = [writer.append_text(data_dir / "idx.jsonl", f"{i}\n") for i in range(3)]
+    store.gate.set()
+    assert writer.drain(5)
+    assert all(t.done and t.error is None for t in [first, *queued, *writes, *lines])
+    # El `save` (limpiar) anula lo pendiente de antes; lo posterior se conserva.
+    assert storage.read_history(store.history_file(UID)) == hist[3:]
+    assert path.read_text(encoding="utf-8") == "nuevo"
+    assert (data_dir / "idx.jsonl").read_text(encoding="utf-8") == "0\n1\n2\n"
+
+
+def test_write_behind_ack_timeout(data_dir):
+    store = _GatedStore(data_dir)
+    writer = storage.WriteBehind(store)
+    ticket = writer.append(UID, make_history(1, datetime(2024, 1, 1)), 1)
+    # Sin confirmación a tiempo la interfaz sigue: wait/drain devuelven False.
+    assert not ticket.wait(0.05) and not ticket.done
+    assert not writer.drain(0.05)
+    assert writer.pending(UID)
+    store.gate.set()
+    assert ticket.wait(5) and ticket.error is None
+    assert writer.drain(5) and not writer.pending(UID)
+
+
+def test_write_behind_error_travels_in_the_ticket(data_dir):
+    store = _GatedStore(data_dir, fail=True)
+    store.gate.set()
+    writer = storage.WriteBehind(store)
+    hist = make_history(2, datetime(2024, 1, 1))
+    ticket = writer.append(UID, hist[:1], 1)
+    assert ticket.wait(5)
+    assert isinstance(ticket.error, OSError)
+    assert writer.failures == 1 and writer.last_error is ticket.error
+    assert not writer.pending(UID)
+    # El hilo escritor sigue vivo para lo siguiente.
+    store.fail = False
+    ok = writer.append(UID, hist[1:], 1)
+    assert ok.wait(5) and ok.error is None
+    assert storage.read_history(store.history_file(UID)) == hist[1:]
+
+
+def test_drain_before_clear_loses_nothing_queued(data_dir):
+    # Como "Limpiar historial": save([]) + drain tras appends aún en la cola.
+    store = _GatedStore(data_dir)
+    writer = storage.WriteBehind(store)
+    writer.append(UID, make_history(3, datetime(2024, 1, 1)), 3)
+    writer.save(UID, [])
+    store.gate.set()
+    assert writer.drain(5)
+    assert store.load(UID) == []
+    assert writer.append(UID, make_history(1, datetime(2024, 2, 1)), 1).wait(5)
+    assert len(store.load(UID)) == 1